@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Indexed access to the particle annotation STAR files of the Chlamy dataset
+(e.g. 10.1101-2024.12.28.630444/star/*.star and 10.1126-science.ads8738/star/*.star).
+
+The annotation files are large flat STAR tables with one loop and a _rlnTomoName column.
+An index mapping each _rlnTomoName to the byte ranges of its rows is built once and stored
+next to the STAR file, so that the particles of one tomogram can be read without parsing
+the whole file. Rows are parsed natively, column by column (parse_star_rows); pandas is
+only imported to return the particles as DataFrames.
+"""
+import os
+import mmap
+import json
+import glob
+import argparse
+import numpy as np
+
+from cache import source_signature, write_cache
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Folders of this repository holding particle annotations in STAR format
+ANNOTATION_STAR_DIRS = [
+    os.path.join(REPO_DIR, '10.1101-2024.12.28.630444', 'star'),
+    os.path.join(REPO_DIR, '10.1126-science.ads8738', 'star'),
+]
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+def find_annotation_stars(star_dirs=None):
+    """
+    Find the annotation STAR files of the repository.
+
+    Returns:
+        dict of species name (file name without extension, e.g. 'rubisco') -> STAR file path
+    """
+    stars = {}
+    for star_dir in (star_dirs or ANNOTATION_STAR_DIRS):
+        for path in sorted(glob.glob(os.path.join(star_dir, '*.star'))):
+            stars[os.path.splitext(os.path.basename(path))[0]] = path
+    return stars
+
+def parse_star_loop_header(f):
+    """
+    Parse the header of a single-loop STAR file up to its first data row.
+
+    Args:
+        f: file object opened in binary mode, positioned at the start of the file
+
+    Returns:
+        list of column labels (without leading underscore and '#n' suffix) and the byte
+        offset of the first data row
+    """
+    columns = []
+    in_loop = False
+    offset = 0
+    for line in iter(f.readline, b''):
+        stripped = line.strip()
+        if in_loop and stripped and not stripped.startswith(b'#'):
+            if stripped.startswith(b'_'):
+                columns.append(stripped.split()[0][1:].decode())
+            elif columns:
+                return columns, offset
+        elif stripped == b'loop_':
+            in_loop = True
+        offset += len(line)
+    return columns, offset
+
+def _parse_column(values):
+    """Convert the raw values (bytes) of a column to int, float or str, as starfile.read would."""
+    first = values[0]
+    if not any(char in first for char in b'.eEnN'):
+        try:
+            return np.array(values).astype(np.int64)
+        except ValueError:
+            pass
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        return np.array([value.decode() for value in values], dtype=object)
+
+def parse_star_rows(rows, columns):
+    """
+    Parse the raw data rows (bytes) of a STAR loop, split on whitespace (no quoted strings).
+
+    Returns:
+        dict of column label -> array (int64, float64 or object for strings)
+    """
+    if b'#' in rows:
+        rows = b'\n'.join(line for line in rows.split(b'\n') if not line.lstrip().startswith(b'#'))
+    fields = rows.split()
+    if len(fields) % len(columns):
+        raise ValueError(f"{len(fields)} values do not fill rows of {len(columns)} columns")
+    if not fields:
+        return {column: np.zeros(0) for column in columns}
+    return {column: _parse_column(fields[i::len(columns)]) for i, column in enumerate(columns)}
+
+def _dataframe(rows, columns):
+    import pandas as pd
+    return pd.DataFrame(parse_star_rows(rows, columns), columns=columns)
+
+def read_annotation_star(star_path):
+    """
+    Read a whole single-loop annotation STAR file into a DataFrame (same columns as
+    starfile.read), parsing the header and the rows natively.
+    """
+    with open(star_path, 'rb') as f:
+        columns, offset = parse_star_loop_header(f)
+        f.seek(offset)
+        return _dataframe(f.read(), columns)
+
+def build_star_index(star_path, tomo_column='rlnTomoName'):
+    """
+    Scan a single-loop STAR file once and map each tomogram name to the byte ranges of its rows.
+
+    Returns:
+        index dict with the columns, the data offset and, for each tomogram, a list of
+        [start, end, n_rows] ranges (rows of a tomogram are usually contiguous)
+    """
+    size, mtime_ns = source_signature(star_path)
+    tomos = {}
+    with open(star_path, 'rb') as f:
+        columns, offset = parse_star_loop_header(f)
+        if tomo_column not in columns:
+            raise ValueError(f"No _{tomo_column} column in {star_path}")
+        tomo_idx = columns.index(tomo_column)
+        f.seek(offset)
+        current, start, n_rows = None, offset, 0
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith(b'#'):
+                offset += len(line)
+                continue
+            tomo = fields[tomo_idx].decode()
+            if tomo != current:
+                if current is not None:
+                    tomos.setdefault(current, []).append([start, offset, n_rows])
+                current, start, n_rows = tomo, offset, 0
+            n_rows += 1
+            offset += len(line)
+        if current is not None:
+            tomos.setdefault(current, []).append([start, offset, n_rows])
+    return {
+        'version': INDEX_VERSION,
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'columns': columns,
+        'tomo_column': tomo_column,
+        'tomos': tomos,
+    }
+
+def load_star_index(star_path, tomo_column='rlnTomoName', index_path=None):
+    """
+    Load the sidecar index of a STAR file, (re)building it if missing or outdated (see cache.py).
+    """
+    index_path = index_path or star_path + INDEX_SUFFIX
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if (index.get('version') == INDEX_VERSION and [index['size'], index['mtime_ns']] == source_signature(star_path)
+                and index['tomo_column'] == tomo_column):
+            return index
+    index = build_star_index(star_path, tomo_column)
+
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(index, f)
+    write_cache(index_path, write)
+    return index
+
+class AnnotationStar:
+    """
+    Indexed reader of a particle annotation STAR file.
+
+    Only the rows of the requested tomograms are parsed, from a memory map of the file:
+
+        rubisco = AnnotationStar('10.1101-2024.12.28.630444/star/rubisco.star')
+        df = rubisco.read_tomo('tomo_0022')
+        for tomo_name, df in rubisco.iter_tomos():
+            ...
+    """
+    def __init__(self, star_path, tomo_column='rlnTomoName', index_path=None):
+        self.path = star_path
+        self.index = load_star_index(star_path, tomo_column, index_path)
+        self.columns = self.index['columns']
+        self._file = open(star_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._range_offsets = None
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def tomo_names(self):
+        """Names of the tomograms with particles, in file order."""
+        return list(self.index['tomos'])
+
+    def count(self, tomo_name=None):
+        """Number of particles of a tomogram, or of the whole file."""
+        if tomo_name is None:
+            return sum(count for ranges in self.index['tomos'].values() for _, _, count in ranges)
+        return sum(count for _, _, count in self.index['tomos'].get(tomo_name, []))
+
+    def row_numbers(self, tomo_name):
+        """
+        Positions (0-based, in file order) of the rows of a tomogram in the whole table, e.g.
+        to select them in the DataFrame returned by starfile.read.
+        """
+        if self._range_offsets is None:
+            # Rows before each range, over the ranges of all tomograms sorted by position
+            ranges = sorted((start, count) for ranges in self.index['tomos'].values() for start, _, count in ranges)
+            offsets = np.cumsum([0] + [count for _, count in ranges[:-1]])
+            self._range_offsets = {start: int(offset) for (start, _), offset in zip(ranges, offsets)}
+        return np.concatenate([np.arange(self._range_offsets[start], self._range_offsets[start] + count)
+                               for start, _, count in self.index['tomos'].get(tomo_name, [])] or [np.zeros(0, dtype=int)])
+
+    def read_rows(self, tomo_name):
+        """Raw bytes of the rows of a tomogram (empty if it has no particles)."""
+        return b''.join(self._mmap[start:end] for start, end, _ in self.index['tomos'].get(tomo_name, []))
+
+    def read_tomo(self, tomo_name):
+        """Particles of a single tomogram as a DataFrame (same columns as starfile.read)."""
+        return _dataframe(self.read_rows(tomo_name), self.columns)
+
+    def read_tomos(self, tomo_names):
+        """Particles of several tomograms as a single DataFrame."""
+        return _dataframe(b''.join(self.read_rows(name) for name in tomo_names), self.columns)
+
+    def iter_tomos(self, tomo_names=None):
+        """
+        Iterate over (tomo_name, DataFrame) one tomogram at a time, so that only the
+        particles of a single tomogram are held in memory.
+        """
+        for name in (self.tomo_names if tomo_names is None else tomo_names):
+            yield name, self.read_tomo(name)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the per-tomogram indices of particle annotation STAR files and report particle counts.')
+    parser.add_argument('star_files', type=str, nargs='*',
+                        help='Annotation STAR files (default: all annotation STAR files of this repository)')
+    parser.add_argument('--tomo', type=str, nargs='+', default=None, help='Only report these tomograms (e.g. tomo_0022)')
+    args = parser.parse_args()
+
+    star_files = args.star_files or list(find_annotation_stars().values())
+    for star_path in star_files:
+        with AnnotationStar(star_path) as star:
+            print(f"{star_path}: {star.count()} particles in {len(star.tomo_names)} tomograms")
+            for name in (args.tomo or []):
+                print(f"  {name}: {star.count(name)} particles")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of chlamydataset2relion5.py and of the annotation STAR readers, on a synthetic
+copy of the chlamy_visual_proteomics tree of EMPIAR-11830 (no download needed).
+
+    python benchmark.py generate --root /scratch/bench --n_tomograms 1829 --n_tilts 41
+    python benchmark.py run --root /scratch/bench --save_baseline baseline.json
+    python benchmark.py run --root /scratch/bench --baseline baseline.json
+
+The generated tree has, per tilt-series, the AreTomo .tlt/.xf files, the ctfphaseflip CTF
+file and the tomolist STAR files in their real formats, and small stand-ins for the tilt
+stacks (a valid MRC header of 16 x 16 sections, one per tilt, so that they pass validation). Baselines store the timings of a run; comparing
+against a baseline exits with an error if any timing got slower than the tolerance allows.
+"""
+import os
+import sys
+import json
+import time
+import struct
+import shutil
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+from chlamydataset2relion5 import (PIXEL_SIZE, MRC_HEADER_SIZE, read_star_loop, tomolist_mapping,
+                                   tomogram_input_files, tomogram_stack_files)
+from annotations import find_annotation_stars, read_annotation_star, build_star_index, AnnotationStar
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERTER = os.path.join(SCRIPT_DIR, 'chlamydataset2relion5.py')
+TOMOLIST_STAR = os.path.join(SCRIPT_DIR, 'tomolist_num_dir.star')
+
+TREE_DIRNAME = 'chlamy_visual_proteomics'
+CORRESPONDENCE_FILENAME = 'tomolist_num_dir.star'
+TREE_PARAMETERS_FILENAME = 'tree.json'
+BASELINE_VERSION = 1
+
+# Tilt stack stand-ins: only their headers are read, so their sections are tiny (1 KiB each, i.e. about
+# 40 KiB per stack and 80 MB for the 1829 tilt-series of the full dataset, sparse or not)
+STACK_SIZE = (16, 16)
+
+def synthetic_prefixes(n_tomograms):
+    """Names of the real tilt-series of the dataset (tomolist_num_dir.star), continued with made-up ones if more are asked for."""
+    prefixes = [str(name) for name in read_star_loop(TOMOLIST_STAR)['tomoman_stack_dir']][:n_tomograms]
+    prefixes += [f"01012024_Synthetic_Position_{i}" for i in range(1, n_tomograms - len(prefixes) + 1)]
+    return prefixes
+
+def write_mrc_stack(path, nx, ny, nz, pixel_size):
+    """Write a float32 MRC header for an nx x ny x nz stack and extend the file to its full size with zeros (sparse where supported)."""
+    header = bytearray(MRC_HEADER_SIZE)
+    struct.pack_into('<4i', header, 0, nx, ny, nz, 2)
+    struct.pack_into('<3i', header, 28, nx, ny, nz)
+    struct.pack_into('<3f', header, 40, nx * pixel_size, ny * pixel_size, nz * pixel_size)
+    struct.pack_into('<3i', header, 64, 1, 2, 3)
+    header[208:212] = b'MAP '
+    header[212:214] = b'\x44\x44'
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(MRC_HEADER_SIZE + nx * ny * nz * 4)
+
+def write_star_column(path, column, values):
+    with open(path, 'w') as f:
+        f.write(f"data_\n\nloop_\n_{column}\n")
+        f.writelines(f"{value:.4f}\n" for value in values)
+
+def generate_tomogram(tomos_dir, tomo_prefix, n_tilts, tilt_step, rng, removed_fraction=0.3):
+    """
+    Write the metadata files and stack stand-ins of one synthetic tilt-series: a dose-symmetric
+    scheme of n_tilts tilts, some of which (for removed_fraction of the tilt-series) were removed
+    during preprocessing and are missing from the .tlt, .xf and CTF files.
+    """
+    tomo_dir = os.path.join(tomos_dir, tomo_prefix)
+    for subdir in ['AreTomo', 'tiltctf', os.path.join('metadata', 'tomolist')]:
+        os.makedirs(os.path.join(tomo_dir, subdir), exist_ok=True)
+    tlt_path, xf_path, ctf_path, order_path, dose_path, removed_path = [os.path.join(tomo_dir, rel) for rel in tomogram_input_files(tomos_dir, tomo_prefix)]
+
+    collected = (np.arange(n_tilts) - (n_tilts - 1) / 2) * tilt_step + rng.normal(0, 0.01, n_tilts)
+    removed = np.zeros(0)
+    if rng.random() < removed_fraction:
+        removed = collected[rng.choice(n_tilts, size=min(2, n_tilts - 1), replace=False)]
+    kept = np.sort(np.setdiff1d(collected, removed))
+
+    with open(tlt_path, 'w') as f:
+        f.writelines(f"{tilt:8.2f}\n" for tilt in kept)
+    with open(xf_path, 'w') as f:
+        for _ in kept:
+            angle = np.radians(rng.normal(-85, 1))
+            a11, a12, a21, a22 = np.cos(angle), -np.sin(angle), np.sin(angle), np.cos(angle)
+            f.write(f"{a11:12.7f}{a12:12.7f}{a21:12.7f}{a22:12.7f}{rng.normal(0, 20):12.3f}{rng.normal(0, 20):12.3f}\n")
+    with open(ctf_path, 'w') as f:
+        # ctfphaseflip defocus file (version 3): first and last view, tilt range, defocus U/V in nm, astigmatism angle
+        f.write("1  0 0.0 0.0 0.0 3\n")
+        for view, tilt in enumerate(kept, start=1):
+            f.write(f"{view} {view} {tilt:.2f} {tilt:.2f} {rng.normal(400, 80):.2f} {rng.normal(390, 80):.2f} {rng.uniform(-90, 90):.2f}\n")
+
+    order = collected[np.argsort(np.abs(collected), kind='stable')]
+    write_star_column(order_path, 'collected_tilts', order)
+    write_star_column(dose_path, 'dose', np.arange(n_tilts) * 3.5)
+    write_star_column(removed_path, 'removed_tilts', removed)
+
+    for rel in tomogram_stack_files(tomo_prefix):
+        path = os.path.join(tomo_dir, rel)
+        if rel.endswith('.st'):
+            write_mrc_stack(path, *STACK_SIZE, len(kept), PIXEL_SIZE)
+        else:
+            open(path, 'wb').close()
+
+def generate_tree(root, n_tomograms=1829, n_tilts=41, tilt_step=3.0, seed=0):
+    """
+    Generate a synthetic dataset in root: the tomogram folders in root/chlamy_visual_proteomics
+    and their correspondence STAR file in root/tomolist_num_dir.star. The parameters are
+    stored in root/tree.json; an existing tree with the same parameters is kept.
+
+    Returns:
+        the tree parameters
+    """
+    parameters = {'n_tomograms': n_tomograms, 'n_tilts': n_tilts, 'tilt_step': tilt_step, 'seed': seed}
+    parameters_path = os.path.join(root, TREE_PARAMETERS_FILENAME)
+    if os.path.exists(parameters_path):
+        with open(parameters_path, 'r') as f:
+            existing = json.load(f)
+        if existing == parameters:
+            print(f"Synthetic tree in {root} is up to date.")
+            return parameters
+        raise ValueError(f"{root} holds a synthetic tree generated with other parameters ({existing}), use another --root")
+
+    tomos_dir = os.path.join(root, TREE_DIRNAME)
+    os.makedirs(tomos_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    prefixes = synthetic_prefixes(n_tomograms)
+    start = time.perf_counter()
+    for i, prefix in enumerate(prefixes, start=1):
+        generate_tomogram(tomos_dir, prefix, n_tilts, tilt_step, rng)
+        if i % 200 == 0:
+            print(f"Generated {i}/{n_tomograms} tilt-series")
+    with open(os.path.join(root, CORRESPONDENCE_FILENAME), 'w') as f:
+        f.write("data_tomoman_tomolist\n\nloop_\n_tomoman_tomo_num\n_tomoman_stack_dir\n\n")
+        f.writelines(f"{num} {prefix}\n" for num, prefix in enumerate(prefixes, start=1))
+    with open(parameters_path, 'w') as f:
+        json.dump(parameters, f, indent=1)
+    print(f"Generated {n_tomograms} synthetic tilt-series with {n_tilts} tilts in {tomos_dir} ({time.perf_counter() - start:.1f} s)")
+    return parameters
+
+def run_converter(root, name, arguments):
+    """
+    Run chlamydataset2relion5.py end to end in a subprocess with --report.
+
+    Returns:
+        dict of metric name -> seconds: the wall time of the process and the total time of each stage
+    """
+    report_path = os.path.join(root, f"report_{name}.json")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, CONVERTER, *arguments, '--report', report_path],
+                   check=True, stdout=subprocess.DEVNULL)
+    metrics = {f"{name}.wall": time.perf_counter() - start}
+    with open(report_path, 'r') as f:
+        report = json.load(f)
+    for stage, summary in report['stages'].items():
+        metrics[f"{name}.{stage}"] = summary['total_seconds']
+    return metrics
+
+def run_subcommand(name, arguments):
+    """Run a subcommand of chlamydataset2relion5.py in a subprocess and return its wall time."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, CONVERTER, *arguments], check=True, stdout=subprocess.DEVNULL)
+    return {f"{name}.wall": time.perf_counter() - start}
+
+def benchmark_converter(root, jobs=1):
+    """
+    Time the conversion of the synthetic tree: a first conversion, an incremental re-run with
+    nothing to do, a conversion into a multi-block STAR file, the validation of the stacks, and
+    building then converting from a metadata cache.
+    """
+    tomos_dir = os.path.join(root, TREE_DIRNAME)
+    correspondence_star = os.path.join(root, CORRESPONDENCE_FILENAME)
+    cache_path = os.path.join(root, 'metadata_cache.bin')
+    common = ['--tomos_dir', tomos_dir, '--correspondence_star', correspondence_star, '--jobs', str(jobs)]
+    for name in ['output', 'output_multiblock', 'output_cached']:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    metrics = {}
+    metrics.update(run_converter(root, 'convert', common + ['--output_dir', os.path.join(root, 'output')]))
+    metrics.update(run_converter(root, 'convert_incremental', common + ['--output_dir', os.path.join(root, 'output')]))
+    metrics.update(run_converter(root, 'convert_multiblock', common + ['--output_dir', os.path.join(root, 'output_multiblock'), '--multiblock_star']))
+    metrics.update(run_subcommand('validate', ['validate', '--tomos_dir', tomos_dir]))
+    metrics.update(run_subcommand('build_cache', ['build-cache', '--tomos_dir', tomos_dir, '--cache', cache_path]))
+    metrics.update(run_converter(root, 'convert_cached', ['--correspondence_star', correspondence_star, '--jobs', str(jobs),
+                                                          '--metadata_cache', cache_path, '--output_dir', os.path.join(root, 'output_cached')]))
+    return metrics
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def benchmark_annotations(root):
+    """
+    Time the readers of the annotation STAR files of this repository: reading a whole file,
+    building its tomogram index, and reading it tomogram by tomogram through the index, and
+    the export of all of them to RELION-5 (particles command). The indices and exported
+    files are written to root, not next to the STAR files.
+    """
+    metrics = {'read_tomolist_star': timed(lambda: tomolist_mapping(read_star_loop(TOMOLIST_STAR)))}
+    index_dir = os.path.join(root, 'annotation_indices')
+    os.makedirs(index_dir, exist_ok=True)
+    for species, star_path in find_annotation_stars().items():
+        metrics[f"annotations.{species}.read_star"] = timed(read_annotation_star, star_path)
+        metrics[f"annotations.{species}.build_index"] = timed(build_star_index, star_path)
+        index_path = os.path.join(index_dir, f"{species}.star.idx")
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        with AnnotationStar(star_path, index_path=index_path) as star:
+            metrics[f"annotations.{species}.read_tomos"] = timed(lambda: sum(len(df) for _, df in star.iter_tomos()))
+    metrics.update(run_subcommand('particles_export', ['particles', '--correspondence_star', TOMOLIST_STAR,
+                                                       '--output_dir', os.path.join(root, 'particles')]))
+    return metrics
+
+def run_benchmarks(root, parameters, jobs=1, repeat=3, annotations=True):
+    """
+    Run all benchmarks repeat times and keep the fastest time of each metric.
+
+    Returns:
+        baseline-like dict with the parameters of the run and the metrics (in seconds)
+    """
+    metrics = {}
+    for i in range(repeat):
+        print(f"Benchmark run {i + 1}/{repeat}")
+        run_metrics = benchmark_converter(root, jobs)
+        if annotations:
+            run_metrics.update(benchmark_annotations(root))
+        for name, seconds in run_metrics.items():
+            metrics[name] = min(seconds, metrics.get(name, np.inf))
+    return {
+        'version': BASELINE_VERSION,
+        'parameters': dict(parameters, jobs=jobs),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'metrics': metrics,
+    }
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_seconds=0.01):
+    """
+    Compare the metrics of a run to a baseline. A metric regressed if it is slower than the
+    baseline by more than tolerance (relative) and min_seconds (absolute, for very short timings).
+
+    Returns:
+        list of (metric, baseline seconds, seconds) of the regressions
+    """
+    if baseline.get('version') != BASELINE_VERSION:
+        raise ValueError(f"Unsupported baseline version {baseline.get('version')}")
+    if baseline['parameters'] != results['parameters']:
+        raise ValueError(f"Baseline was recorded with other parameters ({baseline['parameters']}), "
+                         f"not comparable to this run ({results['parameters']})")
+    regressions = []
+    for name, seconds in results['metrics'].items():
+        reference = baseline['metrics'].get(name)
+        if reference is not None and seconds > reference * (1 + tolerance) + min_seconds:
+            regressions.append((name, reference, seconds))
+    return regressions
+
+def print_metrics(results, baseline=None):
+    reference = baseline['metrics'] if baseline is not None else {}
+    for name, seconds in results['metrics'].items():
+        if name in reference:
+            print(f"{name:<60} {seconds:10.4f} s  (baseline {reference[name]:.4f} s, {seconds / max(reference[name], 1e-9):5.2f}x)")
+        else:
+            print(f"{name:<60} {seconds:10.4f} s")
+
+def generate_main(args):
+    generate_tree(args.root, args.n_tomograms, args.n_tilts, args.tilt_step, args.seed)
+
+def run_main(args):
+    parameters = generate_tree(args.root, args.n_tomograms, args.n_tilts, args.tilt_step, args.seed)
+    results = run_benchmarks(args.root, parameters, args.jobs, args.repeat, not args.skip_annotations)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    print_metrics(results, baseline)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f"Saved baseline: {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f"\nREGRESSION: {len(regressions)} timings slower than the baseline by more than {args.tolerance:.0%}:", file=sys.stderr)
+            for name, reference, seconds in regressions:
+                print(f"  {name}: {reference:.4f} s -> {seconds:.4f} s ({seconds / max(reference, 1e-9):.2f}x)", file=sys.stderr)
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+def add_tree_arguments(parser):
+    parser.add_argument('--root', type=str, required=True, help='Directory of the synthetic tree and benchmark outputs')
+    parser.add_argument('--n_tomograms', type=int, default=1829, help='Number of tilt-series (default: 1829, as in EMPIAR-11830)')
+    parser.add_argument('--n_tilts', type=int, default=41, help='Number of collected tilts per tilt-series (default: 41)')
+    parser.add_argument('--tilt_step', type=float, default=3.0, help='Tilt increment in degrees (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic metadata (default: 0)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark chlamydataset2relion5.py and the annotation readers on a synthetic dataset.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='Generate a synthetic chlamy_visual_proteomics tree')
+    add_tree_arguments(generate_parser)
+    generate_parser.set_defaults(function=generate_main)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks (generating the tree first if needed)')
+    add_tree_arguments(run_parser)
+    run_parser.add_argument('--jobs', type=int, default=1, help='--jobs of the conversions (default: 1)')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the fastest time of each metric is kept (default: 3)')
+    run_parser.add_argument('--skip_annotations', action='store_true', default=False, help='Do not benchmark the annotation STAR readers')
+    run_parser.add_argument('--baseline', type=str, default=None, help='Baseline to compare to, exit with an error on regressions')
+    run_parser.add_argument('--save_baseline', type=str, default=None, help='Save the timings of this run as a baseline')
+    run_parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Relative slowdown allowed before a timing counts as a regression (default: 0.25)')
+    run_parser.add_argument('--min_seconds', type=float, default=0.01,
+                            help='Absolute slowdown in seconds always allowed, for very short timings (default: 0.01)')
+    run_parser.set_defaults(function=run_main)
+
+    args = parser.parse_args()
+    try:
+        args.function(args)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
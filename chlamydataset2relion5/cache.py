@@ -0,0 +1,39 @@
+"""
+Sidecar caches of data derived from the files of the repository (the composition table of
+summary.xlsx, the particle statistics and the tomogram indices of the annotation STAR files).
+
+A cache records the signature (size and modification time) of its sources, so that it is
+rebuilt when they change, and is written to a temporary file first, so that readers never
+see a partial cache. A cache that cannot be written (e.g. in a read-only folder) is only a
+lost optimization: the data is then only kept in memory.
+"""
+import os
+import sys
+
+def source_signature(path):
+    """Signature of a source file, as a JSON-serializable list: [size, mtime_ns]."""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def write_cache(cache_path, write, tmp_path=None):
+    """
+    Write a cache with write(tmp_path), then move it into place. tmp_path defaults to
+    cache_path + '.tmp' (pass one with the right extension for writers that append theirs,
+    like np.savez). If the cache cannot be written, a warning is printed (to stderr, stdout
+    may be the output of a script) and the cache is left as it was.
+
+    Returns:
+        True if the cache was written
+    """
+    tmp_path = tmp_path or cache_path + '.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, cache_path)
+        return True
+    except OSError as e:
+        print(f"Warning: Could not write cache {cache_path}, keeping the data in memory only: {e}", file=sys.stderr)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
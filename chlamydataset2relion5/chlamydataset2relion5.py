@@ -5,21 +5,82 @@ import math
 import numpy as np
 import sys
 import re
-import starfile
+import json
+import hashlib
+import sqlite3
+import struct
+import time
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-def parse_args():
-    parser = argparse.ArgumentParser(description='Generate RELION-5 tomograms.star for Chlamy dataset (EMPIAR-11830).')
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate RELION-5 tomograms.star for Chlamy dataset (EMPIAR-11830).',
+                                     epilog='Additional commands: catalog, build-cache, validate, merge, particles (run e.g. "chlamydataset2relion5.py validate -h" for details).')
     parser.add_argument('--tomos_dir', type=str, help='Directory containing tomogram folders')
     parser.add_argument('--output_dir', type=str, default='relion_star_files', help='Output directory for RELION-5 star files')
-    parser.add_argument('--correspondence_star', type=str, default='tomolist_num_dir.star', help='STAR file with correspondence between tomo_num and stack_dir.',required=True)
+    parser.add_argument('--correspondence_star', type=str, default=None, help='STAR file with correspondence between tomo_num and stack_dir (e.g. tomolist_num_dir.star). Required unless --catalog is given.')
+    parser.add_argument('--catalog', type=str, default=None,
+                        help='Dataset catalog created with the "catalog" command. Tomograms are then selected from the catalog instead of scanning --tomos_dir.')
+    parser.add_argument('--metadata_cache', type=str, default=None,
+                        help='Metadata cache created with the "build-cache" command. The tilt angles, alignments, CTF and dose metadata '
+                             'are then read from the cache instead of the files of each tomogram folder.')
     parser.add_argument('--ctf3d', type=str, default='ctf3d_bin4', help='Path to ctf3d tomos. It will be referenced in the output tomograms.star, but does not need to exist.')
     parser.add_argument('--cryocare', type=str, default='cryocare_bin4', help='Path to cryo-CARE denoised tomos. It will be referenced in the output tomograms.star, but does not need to exist.')
     parser.add_argument('--cosine_weight', action='store_true', default=False, help='Weight tilt images by cosine of tilt angle.')
+    parser.add_argument('--allow_missing_ctf', action='store_true', default=False,
+                        help='Convert tomograms with tilts that have no entry in their CTF file, with a defocus of 0.0 for those tilts. '
+                             'By default, such tomograms are reported and skipped.')
     parser.add_argument('--include', type=str, nargs='+', default=None, 
                         help='Include only these tomogram prefixes (e.g., Position_1 Position_2)')
     parser.add_argument('--exclude', type=str, nargs='+', default=None,
                         help='Exclude these tomogram prefixes (e.g., Position_3 Position_4)')
-    return parser.parse_args()
+    parser.add_argument('--composition', type=str, nargs='+', default=None, metavar='QUERY',
+                        help="Only convert tomograms whose composition in the dataset summary of the comprehensive segmentation "
+                             "(10.1101-2025.01.16.633326/summary.xlsx) matches all these thresholds on the share (in %%) of segmented "
+                             "features, e.g. 'Mitochondrion>=5' 'ATP synthase>=0.05'. Combined with --include/--exclude.")
+    parser.add_argument('--composition_summary', type=str, default=None,
+                        help='Dataset summary spreadsheet used by --composition (default: the summary.xlsx of this repository).')
+    parser.add_argument('--particle_counts', type=str, nargs='+', default=None, metavar='QUERY',
+                        help="Only convert tomograms whose particle counts in the annotation STAR files of this repository match all "
+                             "these thresholds, e.g. 'respirasome>=100' 'mitoribosome>=1' (species by STAR file name). Counts are read "
+                             "from the cached per-tomogram statistics (see particle_stats.py).")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of worker processes used to convert tomograms in parallel (default: 1, serial).')
+    parser.add_argument('--multiblock_star', action='store_true', default=False,
+                        help='Write all tilt-series tables into a single multi-block tilt_series.star file (one data_<prefix> block each, '
+                             'with a block-offset index) and a single dummy .edf file, instead of one .star and .edf file per tilt-series.')
+    parser.add_argument('--io_threads', type=int, default=IO_THREADS,
+                        help=f'Maximum number of concurrent filesystem operations (probes, softlinks) per process (default: {IO_THREADS}).')
+    parser.add_argument('--validate', action='store_true', default=False,
+                        help='Check the tilt stacks against the .tlt files (section count, pixel size, file size) from their MRC headers '
+                             'and skip tomograms that fail.')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=False,
+                        help='Only report which softlinks would be created and which source files are missing, without writing anything.')
+    parser.add_argument('--shard', type=parse_shard, default=None, metavar='i/N',
+                        help='Only convert the i-th of N disjoint subsets of the tomograms (e.g. 1/4, for array jobs sharing the output '
+                             'directory) and write a partial tomograms.shard<i>of<N>.star. Combine the partial files with the "merge" command.')
+    parser.add_argument('--watch', action='store_true', default=False,
+                        help='Keep running and convert new tilt-series as they appear in --tomos_dir, once their AreTomo, tiltctf and '
+                             'tomolist outputs and tilt stack are complete, updating tomograms.star after each batch.')
+    parser.add_argument('--watch_interval', type=float, default=WATCH_INTERVAL,
+                        help=f'Seconds between two scans of --tomos_dir in watch mode (default: {WATCH_INTERVAL:g}). A tilt-series is '
+                             'converted once its files did not change over one interval.')
+    parser.add_argument('--report', type=str, default=None,
+                        help='Record the wall time, files opened, bytes read/written and syscalls of each conversion stage per tomogram '
+                             'and write a run report with per-stage percentiles, as CSV (path ending in .csv) or JSON. The I/O counters are '
+                             'those of the whole process while a stage runs.')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Run under cProfile and save the statistics to this file (e.g. run.prof). With --jobs > 1, '
+                             'only the main process is profiled.')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='Re-convert all tomograms, even those recorded as up to date in the output manifest.')
+    args = parser.parse_args(argv)
+    if args.correspondence_star is None and args.catalog is None:
+        parser.error('the following arguments are required: --correspondence_star (or --catalog)')
+    if args.watch and (args.catalog or args.metadata_cache or args.composition or args.particle_counts or args.dry_run):
+        parser.error('--watch needs --tomos_dir and --correspondence_star, and cannot be combined with --catalog, --metadata_cache, '
+                     '--composition, --particle_counts or --dry-run')
+    return args
 
 def filter_prefixes(all_prefixes, include=None, exclude=None):
     """
@@ -49,11 +110,90 @@ def filter_prefixes(all_prefixes, include=None, exclude=None):
         
     return result
 
+def select_by_composition(tomo_prefixes, queries, summary_path=None):
+    """
+    Keep the tomograms whose composition in the dataset summary matches all queries (e.g.
+    'Mitochondrion>=5', see composition.py). The summary is read from its cached columnar table.
+    """
+    from composition import SUMMARY_XLSX, load_summary
+    selected = set(load_summary(summary_path or SUMMARY_XLSX).select(queries))
+    kept = [prefix for prefix in tomo_prefixes if prefix in selected]
+    print(f"Composition {' and '.join(queries)}: {len(kept)} of {len(tomo_prefixes)} tomograms")
+    return kept
+
+def select_by_particle_counts(tomo_prefixes, queries, tomolist):
+    """
+    Keep the tomograms whose particle counts in the annotation STAR files match all queries
+    (e.g. 'respirasome>=100', see particle_stats.py), from the cached per-tomogram statistics.
+    Annotated tomograms (tomo_NNNN) are mapped to prefixes with the correspondence table of
+    the run (tomolist, dict of stack_dir -> tomo_num).
+    """
+    from particle_stats import load_particle_stats
+    selected = set(load_particle_stats(tomolist=tomolist).select(queries))
+    kept = [prefix for prefix in tomo_prefixes if prefix in selected]
+    print(f"Particle counts {' and '.join(queries)}: {len(kept)} of {len(tomo_prefixes)} tomograms")
+    return kept
+
+def _star_column(values):
+    """Convert the values of a STAR column to int or float arrays where possible."""
+    values = np.array(values, dtype=str)
+    for dtype in (np.int64, np.float64):
+        try:
+            return values.astype(dtype)
+        except ValueError:
+            continue
+    return values.astype(object)
+
+def read_star(star_path):
+    """
+    Minimal STAR file reader for the simple files read by this tool (tomolist metadata,
+    tomolist_num_dir.star, tomograms.star), so that the conversion needs neither starfile
+    nor pandas. Values are split on whitespace (no quoted strings). The large single-loop
+    annotation STAR files are read column-wise by annotations.py (parse_star_rows) instead.
+
+    Returns:
+        dict of block name (without 'data_') -> dict of column name (without leading
+        underscore) -> array; for blocks without loop_, dict of name -> value
+    """
+    blocks = {}
+    block = columns = rows = None
+
+    def finish():
+        if block is not None and columns is not None:
+            blocks[block] = {name: _star_column([row[i] for row in rows]) for i, name in enumerate(columns)}
+
+    with open(star_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('data_'):
+                finish()
+                block, columns, rows = line[5:], None, []
+                blocks[block] = {}
+            elif line == 'loop_':
+                columns = []
+            elif line.startswith('_'):
+                fields = line.split()
+                if columns is not None and not rows:
+                    columns.append(fields[0][1:])
+                elif len(fields) > 1:
+                    blocks[block][fields[0][1:]] = _star_column([fields[1]])[0]
+            elif columns is not None:
+                rows.append(line.split())
+    finish()
+    return blocks
+
+def read_star_loop(star_path, block=None):
+    """Columns of a loop block of a STAR file (by default the first block), see read_star."""
+    blocks = read_star(star_path)
+    if not blocks:
+        raise ValueError(f"No data block found in STAR file: {star_path}")
+    return blocks[block] if block is not None else next(iter(blocks.values()))
+
 def read_tlt_file(tomos_dir, tomo_prefix):
     """Read tilt angles from the .tlt file."""
     tlt_file = os.path.join(tomos_dir, f"{tomo_prefix}", "AreTomo", f"{tomo_prefix}_dose-filt.tlt")
-    if not os.path.exists(tlt_file):
-        raise FileNotFoundError(f"Tilt file not found: {tlt_file}")
     with open(tlt_file, 'r') as f:
         return [float(line.strip()) for line in f if line.strip()]
 
@@ -64,8 +204,6 @@ def read_xf_file(tomos_dir, tomo_prefix):
       A list of lists, each with 6 floats: [A11, A12, A21, A22, DX, DY].
     """
     xf_file = os.path.join(tomos_dir, f"{tomo_prefix}", "AreTomo", f"{tomo_prefix}_dose-filt.xf")
-    if not os.path.exists(xf_file):
-        raise FileNotFoundError(f"XF file not found: {xf_file}")
     xf_data = []
     with open(xf_file, 'r') as f:
         for line in f:
@@ -79,8 +217,6 @@ def read_ctf_file(tomos_dir, tomo_prefix):
     Adjust parsing logic as needed if your file differs in format.
     """
     ctf_file = os.path.join(tomos_dir, f"{tomo_prefix}", "tiltctf", "ctfphaseflip_tiltctf.txt")
-    if not os.path.exists(ctf_file):
-        raise FileNotFoundError(f"CTF file not found: {ctf_file}")
     ctf_data = []
     with open(ctf_file, 'r') as f:
         for line in f:
@@ -97,33 +233,117 @@ def read_ctf_file(tomos_dir, tomo_prefix):
                     })
     return ctf_data
 
-def compute_tilt_alignment(xf_row, pixel_size):
+def compute_tilt_alignments(xf_data, pixel_size):
     """
-    Compute RELION tilt parameters from an IMOD .xf transformation matrix.
+    Compute RELION tilt parameters from the IMOD .xf transformation matrices of all tilts.
      Following:
      https://github.com/scipion-em/scipion-em-reliontomo/blob/8d538ca04f8d02d7a9978e594876bbf7617dcf5f/reliontomo/convert/convert50_tomo.py
      and
      https://github.com/teamtomo/yet-another-imod-wrapper/blob/main/src/yet_another_imod_wrapper/utils/xf.py#L52
 
+    Args:
+        xf_data: (n, 6) array with one [A11, A12, A21, A22, DX, DY] row per tilt
+        pixel_size: pixel size in Angstrom
+
+    Returns:
+        x_tilt, z_rot, x_shift_angst, y_shift_angst as arrays of length n
     """
-    A11, A12, A21, A22, DX, DY = xf_row
-    # Build the full 3x3 transformation matrix
-    T = np.array([[A11, A12, DX],
-                  [A21, A22, DY],
-                  [0.0, 0.0, 1.0]])
+    xf_data = np.asarray(xf_data, dtype=float).reshape(-1, 6)
+    n = len(xf_data)
+    # Stack the full 3x3 transformation matrices
+    T = np.zeros((n, 3, 3))
+    T[:, 0, 0] = xf_data[:, 0]
+    T[:, 0, 1] = xf_data[:, 1]
+    T[:, 1, 0] = xf_data[:, 2]
+    T[:, 1, 1] = xf_data[:, 3]
+    T[:, 0, 2] = xf_data[:, 4]
+    T[:, 1, 2] = xf_data[:, 5]
+    T[:, 2, 2] = 1.0
     # Note: np.arctan2(A12, A11) gives the proper sign.
-    z_rot = np.degrees(np.arctan2(A12, A11))
-    
-    # Invert the full transformation matrix to get the corrected translation
+    z_rot = np.degrees(np.arctan2(xf_data[:, 1], xf_data[:, 0]))
+
+    # Invert the full transformation matrices to get the corrected translations, given by
+    # their third column (batched inversion gives the same values as one matrix at a time)
     T_inv = np.linalg.inv(T)
-    # The translation (shift) is given by the third column of the inverted matrix
-    x_shift_angst = T_inv[0, 2] * pixel_size
-    y_shift_angst = T_inv[1, 2] * pixel_size
+    x_shift_angst = T_inv[:, 0, 2] * pixel_size
+    y_shift_angst = T_inv[:, 1, 2] * pixel_size
 
-    x_tilt = 0.0  # by default
-    y_tilt = 0.0  # we populate this later
-    
-    return x_tilt, y_tilt, z_rot, x_shift_angst, y_shift_angst
+    x_tilt = np.zeros(n)  # by default
+    return x_tilt, z_rot, x_shift_angst, y_shift_angst
+
+def compute_tilt_alignment(xf_row, pixel_size):
+    """
+    Compute RELION tilt parameters from a single IMOD .xf row (see compute_tilt_alignments).
+    y_tilt is always 0.0, it is populated later.
+    """
+    x_tilt, z_rot, x_shift_angst, y_shift_angst = (float(v[0]) for v in compute_tilt_alignments(xf_row, pixel_size))
+    return x_tilt, 0.0, z_rot, x_shift_angst, y_shift_angst
+
+def match_nearest(values, reference):
+    """
+    Find the nearest reference value for each value, using a sorted copy of the
+    reference and searchsorted, i.e. in O(n log m) instead of O(n m).
+
+    Returns:
+        index: for each value, the index into reference of its nearest match (-1 if reference is empty)
+        distance: absolute difference to that match (inf if reference is empty)
+    """
+    values = np.asarray(values, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    if len(reference) == 0:
+        return np.full(len(values), -1), np.full(len(values), np.inf)
+    # Stable sort, so that ties go to the entry appearing first in the reference
+    order = np.argsort(reference, kind='stable')
+    sorted_reference = reference[order]
+    right = np.clip(np.searchsorted(sorted_reference, values, side='left'), 0, len(reference) - 1)
+    left = np.clip(right - 1, 0, len(reference) - 1)
+    left_distance = np.abs(values - sorted_reference[left])
+    right_distance = np.abs(values - sorted_reference[right])
+    use_left = left_distance <= right_distance
+    nearest = np.where(use_left, left, right)
+    distance = np.where(use_left, left_distance, right_distance)
+    return order[nearest], distance
+
+def match_ctf_to_tilts(ctf_data, tilt_angles, tolerance=0.1, allow_missing=False, log=print):
+    """
+    Match the nearest CTF entry to each tilt angle, by tilt angle (within tolerance deg) or,
+    for entries without a tilt angle, by frame number. Unmatched tilts raise a ValueError,
+    unless allow_missing is set, in which case they get zero defocus and are reported through log.
+
+    Returns:
+        defocus_u, defocus_v, astigmatism_angle as arrays with one value per tilt
+        ctf_match: index into ctf_data of the entry matched to each tilt (-1 if none)
+    """
+    tilt_angles = np.asarray(tilt_angles, dtype=float)
+    n_tilts = len(tilt_angles)
+    ctf_match = np.full(n_tilts, -1)
+
+    by_angle = [k for k, entry in enumerate(ctf_data) if entry.get('tilt_angle') is not None]
+    if by_angle:
+        nearest, distance = match_nearest(tilt_angles, [ctf_data[k]['tilt_angle'] for k in by_angle])
+        matched = distance < tolerance
+        ctf_match[matched] = np.asarray(by_angle)[nearest[matched]]
+
+    # if no tilt_angle field, attempt frame-based
+    by_frame = {entry['frame']: k for k, entry in reversed(list(enumerate(ctf_data))) if entry.get('tilt_angle') is None}
+    if by_frame:
+        for i in np.flatnonzero(ctf_match < 0):
+            ctf_match[i] = by_frame.get(i + 1, -1)
+
+    defocus_u = np.zeros(n_tilts)
+    defocus_v = np.zeros(n_tilts)
+    astigmatism_angle = np.zeros(n_tilts)
+    matched = ctf_match >= 0
+    if matched.any():
+        defocus_u[matched] = [ctf_data[k]['defocus_u'] for k in ctf_match[matched]]
+        defocus_v[matched] = [ctf_data[k]['defocus_v'] for k in ctf_match[matched]]
+        astigmatism_angle[matched] = [ctf_data[k]['astigmatism_angle'] for k in ctf_match[matched]]
+    if not matched.all():
+        unmatched = ", ".join(f"{t:.2f}" for t in tilt_angles[~matched])
+        if not allow_missing:
+            raise ValueError(f"No CTF entry found for tilt angles {unmatched}")
+        log(f"Warning: No CTF entry found for tilt angles {unmatched}. Their defocus is set to 0.0.")
+    return defocus_u, defocus_v, astigmatism_angle, ctf_match
 
 def read_acquisition_order_dose_star(tomos_dir, tomo_prefix):
     """
@@ -133,33 +353,262 @@ def read_acquisition_order_dose_star(tomos_dir, tomo_prefix):
     order_file = os.path.join(tomos_dir, f"{tomo_prefix}", "metadata", "tomolist", "collected_tilts.star")
     dose_file = os.path.join(tomos_dir, f"{tomo_prefix}", "metadata", "tomolist", "dose.star")
     removed_file = os.path.join(tomos_dir, f"{tomo_prefix}", "metadata", "tomolist", "removed_tilts.star")
-    acquisition_order = starfile.read(order_file)
-    dose = starfile.read(dose_file)
-    removed = starfile.read(removed_file)
-    if not os.path.exists(order_file):
-        raise FileNotFoundError(f"Acquisition order STAR file not found: {order_file}")
-
-    acquisition_data = []
-    k = 1
-    for i in np.arange(len(acquisition_order['collected_tilts'])):
-        excluded = False
-        for j in np.arange(len(removed['removed_tilts'])):
-            if np.isclose(acquisition_order.loc[i,'collected_tilts'], removed.loc[j,'removed_tilts']):
-                excluded = True
-                break
-        if not excluded:
-            acquisition_data.append((k, acquisition_order.loc[i,'collected_tilts'], dose.loc[i,'dose'] ))
-            k += 1
-
-    if not acquisition_data:
+    acquisition_order = read_star_loop(order_file)
+    dose = read_star_loop(dose_file)
+    removed = read_star_loop(removed_file)
+
+    # Exclude collected tilts whose nearest removed tilt is close enough
+    collected_tilts = acquisition_order['collected_tilts'].astype(float)
+    removed_tilts = removed['removed_tilts'].astype(float)
+    nearest, _ = match_nearest(collected_tilts, removed_tilts)
+    if len(removed_tilts):
+        excluded = np.isclose(collected_tilts, removed_tilts[nearest])
+    else:
+        excluded = np.zeros(len(collected_tilts), dtype=bool)
+    kept = np.flatnonzero(~excluded)
+    acquisition_data = np.column_stack((
+        np.arange(1, len(kept) + 1),
+        collected_tilts[kept],
+        dose['dose'].astype(float)[kept],
+    ))
+
+    if not len(acquisition_data):
         raise ValueError(f"No valid data found in acquisition order STAR file: {order_file}")
-    return np.array(acquisition_data)
+    return acquisition_data
 
-def create_softlinks(tomos_dir, output_dir, tomo_prefix, ctf3d_path, cryocare_path):
+def read_tomogram_metadata(tomos_dir, tomo_prefix):
     """
-    Create softlinks with .mrcs extension for .mrc files. This helps RELION treat them as stacks.
+    Read all metadata files of a tomogram.
+
+    Returns:
+        dict with tilt_angles, xf_data, ctf_data and acquisition_order (None if its STAR
+        files are missing)
+    """
+    # Probe all metadata files at once, so that all missing required files are reported
+    # together. The readers below don't check for their files again (a file removed
+    # meanwhile still raises FileNotFoundError when it is opened).
+    input_files = [os.path.join(tomos_dir, tomo_prefix, rel) for rel in tomogram_input_files(tomos_dir, tomo_prefix)]
+    with stage('probe_inputs', tomo_prefix):
+        exists = probe_paths(input_files)
+    missing = [path for path, found in zip(input_files[:3], exists) if not found]
+    if missing:
+        raise FileNotFoundError(f"Required files not found: {', '.join(missing)}")
+    metadata = {}
+    with stage('read_tlt', tomo_prefix):
+        metadata['tilt_angles'] = read_tlt_file(tomos_dir, tomo_prefix)
+    with stage('read_xf', tomo_prefix):
+        metadata['xf_data'] = read_xf_file(tomos_dir, tomo_prefix)
+    with stage('read_ctf', tomo_prefix):
+        metadata['ctf_data'] = read_ctf_file(tomos_dir, tomo_prefix)
+    metadata['acquisition_order'] = None
+    if all(exists[3:]):
+        try:
+            with stage('read_acquisition', tomo_prefix):
+                # metadata['acquisition_order'] = read_acquisition_order_csv(tomos_dir, tomo_prefix)
+                metadata['acquisition_order'] = read_acquisition_order_dose_star(tomos_dir, tomo_prefix)
+        except FileNotFoundError:
+            pass
+    return metadata
+
+# Per-stage instrumentation (--report), disabled unless enable_instrumentation() is called
+_stage_records = None
+_files_opened = 0
+_audit_hook_installed = False
+
+PROC_IO_PATH = '/proc/self/io'
+
+def _count_opens(event, args):
+    global _files_opened
+    # The reads of the I/O counters by stage itself are not part of any stage
+    if event == 'open' and _stage_records is not None and args[0] != PROC_IO_PATH:
+        _files_opened += 1
+
+def _io_counters(include_own_read=False):
+    """
+    Files opened so far and the I/O counters of this process (Linux only, else zeros).
+    The single read of /proc/self/io is only counted by the kernel after the values were
+    taken; include_own_read adds it, for the snapshot at the start of a stage.
+    """
+    counters = {'rchar': 0, 'wchar': 0, 'syscr': 0, 'syscw': 0}
+    try:
+        fd = os.open(PROC_IO_PATH, os.O_RDONLY)
+        try:
+            content = os.read(fd, 4096)
+        finally:
+            os.close(fd)
+    except OSError:
+        return (_files_opened, 0, 0, 0, 0)
+    own_bytes, own_syscalls = (len(content), 1) if include_own_read else (0, 0)
+    for line in content.decode().splitlines():
+        name, value = line.split(':')
+        if name in counters:
+            counters[name] = int(value)
+    return (_files_opened, counters['rchar'] + own_bytes, counters['wchar'], counters['syscr'] + own_syscalls, counters['syscw'])
+
+def enable_instrumentation():
+    """
+    Start recording the wall time, files opened, bytes read/written and read/write syscalls
+    of each stage (see stage). Files are counted with an audit hook, the other counters come
+    from /proc/self/io.
+
+    All counters are process-wide: a stage is charged with everything the process did while
+    it ran, including the work of the I/O thread pool on its behalf (e.g. hashing the inputs).
+    This is exact as long as a process runs one stage at a time, as the conversion does (also
+    with --jobs, each worker process converting one tomogram at a time). Stages overlapping in
+    threads of one process (e.g. TomogramConverter.convert_many) each count the I/O of the others.
+    """
+    global _stage_records, _audit_hook_installed
+    _stage_records = []
+    if not _audit_hook_installed:
+        sys.addaudithook(_count_opens)
+        _audit_hook_installed = True
+
+def take_stage_records():
+    """Return the stage records collected so far and start a new list."""
+    global _stage_records
+    records, _stage_records = _stage_records, ([] if _stage_records is not None else None)
+    return records or []
+
+def add_stage_records(records):
+    """Add stage records collected elsewhere (e.g. by a worker process)."""
+    if _stage_records is not None:
+        _stage_records.extend(records)
+
+@contextlib.contextmanager
+def stage(name, tomo_prefix=None):
+    """
+    Record a stage of the conversion of a tomogram, if instrumentation is enabled. Its counters
+    are the difference of the process-wide counters before and after it (see enable_instrumentation).
+    """
+    if _stage_records is None:
+        yield
+        return
+    before = _io_counters(include_own_read=True)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        delta = [b - a for a, b in zip(before, _io_counters())]
+        _stage_records.append({
+            'tomogram': tomo_prefix,
+            'stage': name,
+            'seconds': seconds,
+            'files_opened': delta[0],
+            'bytes_read': delta[1],
+            'bytes_written': delta[2],
+            'read_syscalls': delta[3],
+            'write_syscalls': delta[4],
+        })
+
+STAGE_COUNTERS = ['files_opened', 'bytes_read', 'bytes_written', 'read_syscalls', 'write_syscalls']
+COUNTER_SCOPE = ("I/O counters are process-wide: each stage includes all I/O of its process while it ran, "
+                 "including that of the I/O thread pool and of stages running concurrently in other threads")
+
+def summarize_stages(records):
+    """Per-stage count, total, mean and percentiles of the wall time, and totals of the counters."""
+    summary = {}
+    for name in dict.fromkeys(record['stage'] for record in records):
+        selected = [record for record in records if record['stage'] == name]
+        seconds = np.array([record['seconds'] for record in selected])
+        summary[name] = {
+            'count': len(selected),
+            'total_seconds': float(seconds.sum()),
+            'mean_seconds': float(seconds.mean()),
+            'p50_seconds': float(np.percentile(seconds, 50)),
+            'p90_seconds': float(np.percentile(seconds, 90)),
+            'p99_seconds': float(np.percentile(seconds, 99)),
+            'max_seconds': float(seconds.max()),
+        }
+        for counter in STAGE_COUNTERS:
+            summary[name][counter] = int(sum(record[counter] for record in selected))
+    return summary
+
+def write_run_report(report_path, records, wall_seconds):
+    """
+    Write the run report: as CSV (if the path ends in .csv) one row per stage with the
+    summary of summarize_stages; otherwise as JSON, with the summary and all stage records.
+    The I/O counters are process-wide (see enable_instrumentation), which both formats state
+    in their header.
+    """
+    summary = summarize_stages(records)
+    if report_path.endswith('.csv'):
+        fields = ['count', 'total_seconds', 'mean_seconds', 'p50_seconds', 'p90_seconds', 'p99_seconds', 'max_seconds'] + STAGE_COUNTERS
+        with open(report_path, 'w') as f:
+            f.write(f"# {COUNTER_SCOPE}\n")
+            f.write(",".join(['stage'] + fields) + "\n")
+            for name, values in summary.items():
+                f.write(",".join([name] + [f"{values[field]:.6f}" if isinstance(values[field], float) else str(values[field])
+                                           for field in fields]) + "\n")
+    else:
+        with open(report_path, 'w') as f:
+            json.dump({
+                'wall_seconds': wall_seconds,
+                'counter_scope': COUNTER_SCOPE,
+                'n_tomograms': len({record['tomogram'] for record in records if record['tomogram'] is not None}),
+                'stages': summary,
+                'records': records,
+            }, f, indent=1)
+    print(f"Wrote run report: {report_path}")
+    return report_path
+
+IO_THREADS = 8
+_io_pool = None
+
+def set_io_threads(n_threads):
+    """Set the maximum number of concurrent filesystem operations (probes, symlinks)."""
+    global IO_THREADS, _io_pool
+    IO_THREADS = max(1, n_threads)
+    if _io_pool is not None:
+        _io_pool.shutdown()
+    _io_pool = None
+
+def io_pool():
+    """
+    Thread pool for filesystem operations. On network storage each stat or symlink call
+    costs a round trip, so issuing them concurrently hides most of the latency.
+    """
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=IO_THREADS)
+    return _io_pool
+
+# Existence of files known without probing them (absolute path -> bool), e.g. from a catalog
+_known_paths = None
+
+def set_known_paths(known_paths):
+    """
+    Answer the os.path.exists probes of probe_paths from a dict of absolute path -> exists
+    (e.g. read from a catalog, see catalog_known_paths) instead of the filesystem, for the
+    paths it contains. None probes all paths again.
+    """
+    global _known_paths
+    _known_paths = known_paths
+
+def probe_paths(paths, probe=os.path.exists):
+    """
+    Run a filesystem probe (os.path.exists by default) on many paths concurrently.
+    Existence probes of paths set with set_known_paths are answered without a probe.
+
+    Returns:
+        List with the result of the probe for each path, in the same order.
+    """
+    paths = list(paths)
+    if probe is os.path.exists and _known_paths is not None:
+        known = [_known_paths.get(os.path.abspath(path)) for path in paths]
+        probed = iter(_probe_concurrently([path for path, exists in zip(paths, known) if exists is None], probe))
+        return [next(probed) if exists is None else exists for exists in known]
+    return _probe_concurrently(paths, probe)
+
+def _probe_concurrently(paths, probe):
+    if len(paths) <= 1:
+        return [probe(path) for path in paths]
+    return list(io_pool().map(probe, paths))
+
+def softlink_pairs(tomos_dir, output_dir, tomo_prefix):
+    """
+    Source stacks of a tomogram and the .mrcs softlinks pointing to them, as absolute paths.
     """
-    os.makedirs(os.path.join(output_dir, tomo_prefix) , exist_ok=True)
     abs_tomos_dir = os.path.abspath(tomos_dir)
     abs_output_dir = os.path.abspath(output_dir)
 
@@ -174,26 +623,83 @@ def create_softlinks(tomos_dir, output_dir, tomo_prefix, ctf3d_path, cryocare_pa
     odd_link = os.path.join(abs_output_dir, tomo_prefix, f"{tomo_prefix}_ODD.mrcs")
     ctf_link = os.path.join(abs_output_dir, tomo_prefix, f"{tomo_prefix}_CTF.mrcs")
 
-    links_created = []
-    for src, dst in [
+    return [
         (mrc_file, mrc_link),
         (evn_file, evn_link),
         (odd_file, odd_link),
         (ctf_file, ctf_link)
-    ]:
-        if os.path.exists(src):
-            if os.path.exists(dst):
-                os.remove(dst)
-            print(f"Creating softlink: {dst} -> {src}")
-            os.symlink(src, dst)
+    ]
+
+def _replace_symlink(pair):
+    src, dst = pair
+    try:
+        os.symlink(src, dst)
+    except FileExistsError:
+        os.remove(dst)
+        os.symlink(src, dst)
+
+def create_softlinks(tomos_dir, output_dir, tomo_prefix, ctf3d_path, cryocare_path, log=print):
+    """
+    Create softlinks with .mrcs extension for .mrc files. This helps RELION treat them as stacks.
+    Sources are probed and links created concurrently. Progress is reported through log.
+    """
+    os.makedirs(os.path.join(output_dir, tomo_prefix) , exist_ok=True)
+    pairs = softlink_pairs(tomos_dir, output_dir, tomo_prefix)
+
+    links_created = []
+    for (src, dst), exists in zip(pairs, probe_paths(src for src, _ in pairs)):
+        if exists:
+            log(f"Creating softlink: {dst} -> {src}")
             links_created.append((src, dst))
-            # print(f"Created softlink: {dst} -> {src}")
         else:
-            print(f"Warning: Source file not found: {src}")
+            log(f"Warning: Source file not found: {src}")
+    # Existing links are only removed (and re-created) when symlink reports a clash
+    probe_paths(links_created, _replace_symlink)
 
     return links_created
 
-def create_dummy_edf_file(output_dir, tomo_prefix):
+def plan_conversion(tomos_dir, output_dir, tomo_prefixes):
+    """
+    Work out, without touching the output directory, which softlinks would be created for
+    each tomogram and which of its source stacks and metadata files are missing. All paths
+    of all tomograms are probed in one concurrent batch.
+
+    Returns:
+        dict of prefix -> {'links': [(src, dst), ...], 'missing_stacks': [...], 'missing_inputs': [...]}
+    """
+    plan = {}
+    probes = []
+    for prefix in tomo_prefixes:
+        pairs = softlink_pairs(tomos_dir, output_dir, prefix)
+        inputs = [os.path.join(tomos_dir, prefix, rel) for rel in tomogram_input_files(tomos_dir, prefix)]
+        plan[prefix] = {'pairs': pairs, 'inputs': inputs}
+        probes += [src for src, _ in pairs] + inputs
+    exists = dict(zip(probes, probe_paths(probes)))
+    for prefix, entry in plan.items():
+        pairs, inputs = entry.pop('pairs'), entry.pop('inputs')
+        entry['links'] = [(src, dst) for src, dst in pairs if exists[src]]
+        entry['missing_stacks'] = [src for src, _ in pairs if not exists[src]]
+        entry['missing_inputs'] = [path for path in inputs if not exists[path]]
+    return plan
+
+def print_conversion_plan(plan):
+    """Report a plan made by plan_conversion."""
+    n_links = n_missing_stacks = n_incomplete = 0
+    for prefix, entry in plan.items():
+        print(f"{prefix}:")
+        for src, dst in entry['links']:
+            print(f"  Would create softlink: {dst} -> {src}")
+        for src in entry['missing_stacks']:
+            print(f"  Warning: Source file not found: {src}")
+        for path in entry['missing_inputs']:
+            print(f"  Warning: Metadata file not found: {path}")
+        n_links += len(entry['links'])
+        n_missing_stacks += len(entry['missing_stacks'])
+        n_incomplete += bool(entry['missing_inputs'])
+    print(f"Dry run: {len(plan)} tomograms, {n_links} softlinks would be created, "
+          f"{n_missing_stacks} source stacks missing, {n_incomplete} tomograms with missing metadata files.")
+
+def create_dummy_edf_file(output_dir, tomo_prefix, log=print):
     """
     Create a dummy ETOMO directive (.edf) file for the tomogram.
     """
@@ -205,41 +711,79 @@ def create_dummy_edf_file(output_dir, tomo_prefix):
         f.write(f"# Generated for tomogram: {tomo_prefix}\n")
         f.write("# This is a placeholder file\n")
     
-    print(f"Created dummy ETOMO directive file: {edf_file_path}")
+    log(f"Created dummy ETOMO directive file: {edf_file_path}")
     return edf_file_path
 
+def lookup_tomo_num(tomolist, tomo_prefix):
+    """
+    Look up the tomoman tomo_num of a stack directory in the correspondence table, given as
+    dict of stack_dir -> tomo_num (see tomolist_mapping).
+    """
+    try:
+        return tomolist[tomo_prefix]
+    except KeyError:
+        raise KeyError(f"{tomo_prefix} not found in the correspondence table") from None
+
+def tomolist_mapping(tomolist):
+    """Turn the correspondence table into a dict of stack_dir -> tomo_num for fast lookups."""
+    return dict(zip(tomolist['tomoman_stack_dir'], (int(n) for n in tomolist['tomoman_tomo_num'])))
+
+def tomogram_volume_files(tomo_num, ctf3d_path, cryocare_path):
+    """Paths of the ctf3d and cryo-CARE bin4 tomograms referenced in tomograms.star."""
+    vol_file = os.path.join(ctf3d_path, f"{tomo_num:d}.rec")
+    denoised_vol_file = os.path.join(cryocare_path, f"{tomo_num:d}.mrc")
+    return vol_file, denoised_vol_file
+
+# Acquisition and reconstruction parameters of the dataset
+VOLTAGE = 300.0
+CS = 2.7
+AMP_CONTRAST = 0.07
+PIXEL_SIZE = 1.96
+BIN_FACTOR = 4
+VOL_SIZE = [1024, 1024, 512]
+
 def collect_tomogram_data(tomos_dir, tomo_prefix, tomolist, ctf3d_path, cryocare_path,
                           nominal_tilt_axis = -85.00,
                           defHand = +1,
-                          voltage = 300.0,
-                          cs = 2.7,
-                          amp_contrast = 0.07,
-                          pixel_size = 1.96,
-                          bin_factor = 4,
-                          vol_size = [1024, 1024, 512],
+                          voltage = VOLTAGE,
+                          cs = CS,
+                          amp_contrast = AMP_CONTRAST,
+                          pixel_size = PIXEL_SIZE,
+                          bin_factor = BIN_FACTOR,
+                          vol_size = VOL_SIZE,
                           dose_per_tilt = 3.5,
-                          cosine_weighting = False
+                          cosine_weighting = False,
+                          allow_missing_ctf = False,
+                          metadata = None,
+                          log = print,
+                          raise_errors = False
                           ):
-    """Process a single tomogram and return its data"""
+    """
+    Process a single tomogram and return its data. The metadata parsed from its files
+    (see read_tomogram_metadata) can be given, e.g. from the metadata cache, in which case
+    the files are not read. Tilts without a CTF entry are an error, unless allow_missing_ctf
+    is set (their defocus is then 0). Progress messages go through log (print by default).
+    Errors are reported and None is returned, unless raise_errors is set.
+    """
     try:
     # session_data = read_session_json(tomos_dir, tomo_prefix)
-        sel = tomolist['tomoman_stack_dir'] == tomo_prefix
-        tomo_num = tomolist.loc[sel, 'tomoman_tomo_num'].iloc[0]
+        tomo_num = lookup_tomo_num(tomolist, tomo_prefix)
 
-        tilt_angles = read_tlt_file(tomos_dir, tomo_prefix)
-        print(f"Found {len(tilt_angles)} tilt angles")
+        if metadata is None:
+            metadata = read_tomogram_metadata(tomos_dir, tomo_prefix)
+        tilt_angles = metadata['tilt_angles']
+        log(f"Found {len(tilt_angles)} tilt angles")
 
-        xf_data = read_xf_file(tomos_dir, tomo_prefix)
-        print(f"Found {len(xf_data)} transformation matrices")
+        xf_data = metadata['xf_data']
+        log(f"Found {len(xf_data)} transformation matrices")
 
-        ctf_data = read_ctf_file(tomos_dir, tomo_prefix)
-        print(f"Found {len(ctf_data)} CTF entries")
+        ctf_data = metadata['ctf_data']
+        log(f"Found {len(ctf_data)} CTF entries")
 
         vol_size_x, vol_size_y, vol_size_z = vol_size[0], vol_size[1], vol_size[2]
         
         # Assume vol file path
-        vol_file = os.path.join(ctf3d_path, f"{tomo_num:d}.rec")
-        denoised_vol_file = os.path.join(cryocare_path, f"{tomo_num:d}.mrc")
+        vol_file, denoised_vol_file = tomogram_volume_files(tomo_num, ctf3d_path, cryocare_path)
         
         # Handle tilt series data
         # If the CTF entries do not have tilt_angle set, match them by frame index
@@ -249,72 +793,55 @@ def collect_tomogram_data(tomos_dir, tomo_prefix, tomolist, ctf3d_path, cryocare
                 if 0 <= frame_idx < len(tilt_angles):
                     entry['tilt_angle'] = tilt_angles[frame_idx]
 
-        # Attempt to read real acquisition order from STAR file
-        try:
-            # acquisition_order = read_acquisition_order_csv(tomos_dir, tomo_prefix)
-            acquisition_order = read_acquisition_order_dose_star(tomos_dir, tomo_prefix)
-            print(f"Found acquisition order data with {len(acquisition_order)} entries.")
+        # Real acquisition order from the STAR files, if they were found
+        acquisition_order = metadata['acquisition_order']
+        if acquisition_order is not None:
+            log(f"Found acquisition order data with {len(acquisition_order)} entries.")
             # exposures = calculate_cumulative_exposure(tilt_angles, acquisition_order, dose_per_tilt)
             exposures = acquisition_order[:,2]
-        except FileNotFoundError:
-            print("Warning: Acquisition order CSV file not found. Using default incremental exposure.")
+        else:
+            log("Warning: Acquisition order CSV file not found. Using default incremental exposure.")
             # Fallback: just do an incremental from 0, 1*dose, 2*dose, ...
             exposures = [i * dose_per_tilt for i in range(len(tilt_angles))]
             
-        # Create a tilt series data array
-        tilt_series_data = []
-        
-        # Loop through the tilt angles, in sorted order (the .tlt order)
-        for i, tilt_angle in enumerate(tilt_angles):
-            # pre-exposure from the computed exposures array
-            pre_exposure = exposures[i]
-
-            # Attempt to match a defocus from ctf_data by tilt angle
-            defocus_u = 0.0
-            defocus_v = 0.0
-            astigmatism_angle = 0.0
-            for ctf_entry in ctf_data:
-                if ctf_entry.get('tilt_angle') is not None:
-                    if abs(ctf_entry['tilt_angle'] - tilt_angle) < 0.1:
-                        defocus_u = ctf_entry['defocus_u']
-                        defocus_v = ctf_entry['defocus_v']
-                        astigmatism_angle = ctf_entry['astigmatism_angle']
-                        break
-                else:
-                    # if no tilt_angle field, attempt frame-based
-                    if ctf_entry['frame'] == (i + 1):
-                        defocus_u = ctf_entry['defocus_u']
-                        defocus_v = ctf_entry['defocus_v']
-                        astigmatism_angle = ctf_entry['astigmatism_angle']
-                        break
-
-            astigmatism = abs(defocus_u - defocus_v)
-            defocus_angle = astigmatism_angle
-
-            x_tilt, _, z_rot, x_shift_angst, y_shift_angst = compute_tilt_alignment(xf_data[i], pixel_size)
-            y_tilt = tilt_angle
-
-            # For typical single-tilt geometry, you might scale some factors with cos(tilt)
-            if cosine_weighting:
-                ctf_scalefactor = math.cos(math.radians(tilt_angle))
-            else:
-                ctf_scalefactor = 1.0
-            
-            tilt_series_data.append({
-                'index': i,
-                'tilt_angle': tilt_angle,
-                'pre_exposure': pre_exposure,
-                'defocus_u': defocus_u,
-                'defocus_v': defocus_v,
-                'astigmatism': astigmatism,
-                'defocus_angle': defocus_angle,
-                'x_tilt': x_tilt,
-                'y_tilt': y_tilt,
-                'z_rot': z_rot,
-                'x_shift_angst': x_shift_angst,
-                'y_shift_angst': y_shift_angst,
-                'ctf_scalefactor': ctf_scalefactor
-            })
+        # Build the tilt series table column by column, in sorted order (the .tlt order)
+        tilt_angles = np.asarray(tilt_angles, dtype=float)
+        n_tilts = len(tilt_angles)
+        rows = np.arange(n_tilts)
+
+        # pre-exposure from the computed exposures array
+        pre_exposure = np.asarray(exposures, dtype=float)[rows]
+
+        # Attempt to match a defocus from ctf_data by tilt angle
+        with stage('match_ctf', tomo_prefix):
+            defocus_u, defocus_v, astigmatism_angle, ctf_match = match_ctf_to_tilts(
+                ctf_data, tilt_angles, allow_missing=allow_missing_ctf, log=log)
+
+        with stage('compute_alignments', tomo_prefix):
+            x_tilt, z_rot, x_shift_angst, y_shift_angst = compute_tilt_alignments(np.asarray(xf_data, dtype=float)[rows], pixel_size)
+
+        # For typical single-tilt geometry, you might scale some factors with cos(tilt)
+        if cosine_weighting:
+            ctf_scalefactor = np.cos(np.radians(tilt_angles))
+        else:
+            ctf_scalefactor = np.ones(n_tilts)
+
+        tilt_series_data = {
+            'index': rows,
+            'tilt_angle': tilt_angles,
+            'pre_exposure': pre_exposure,
+            'defocus_u': defocus_u,
+            'defocus_v': defocus_v,
+            'astigmatism': np.abs(defocus_u - defocus_v),
+            'defocus_angle': astigmatism_angle,
+            'ctf_match': ctf_match,
+            'x_tilt': x_tilt,
+            'y_tilt': tilt_angles,
+            'z_rot': z_rot,
+            'x_shift_angst': x_shift_angst,
+            'y_shift_angst': y_shift_angst,
+            'ctf_scalefactor': ctf_scalefactor
+        }
         
         return {
             'prefix': tomo_prefix,
@@ -335,9 +862,59 @@ def collect_tomogram_data(tomos_dir, tomo_prefix, tomolist, ctf3d_path, cryocare
         }
     
     except Exception as e:
-        print(f"Error processing tomogram {tomo_prefix}: {str(e)}")
+        if raise_errors:
+            raise
+        log(f"Error processing tomogram {tomo_prefix}: {str(e)}")
         return None
 
+TOMOGRAMS_STAR_COLUMNS = [
+    "_rlnTomoName",
+    "_rlnVoltage",
+    "_rlnSphericalAberration",
+    "_rlnAmplitudeContrast",
+    "_rlnMicrographOriginalPixelSize",
+    "_rlnTomoHand",
+    "_rlnOpticsGroupName",
+    "_rlnTomoTiltSeriesPixelSize",
+    "_rlnTomoTiltSeriesStarFile",
+    "_rlnEtomoDirectiveFile",
+    "_rlnTomoTomogramBinning",
+    "_rlnTomoSizeX",
+    "_rlnTomoSizeY",
+    "_rlnTomoSizeZ",
+    "_rlnTomoReconstructedTomogram",
+    "_rlnTomoDenoisedTomogram",
+    "_tomoman_tomo_num",
+]
+
+def write_tomogram_star_header(f):
+    """
+    Write the header of the combined tomograms.star file (everything before the data rows).
+    """
+    f.write("# version 50001\n\n")
+    f.write("data_global\n\n")
+    f.write("loop_\n")
+    for i, column in enumerate(TOMOGRAMS_STAR_COLUMNS):
+        f.write(f"{column} #{i + 1}\n")
+
+def format_tomogram_star_row(data):
+    """
+    Format the tomograms.star row of a single tomogram.
+    """
+    tomo_prefix = data['prefix']
+    optics_group = "optics1"  # Default optics group
+
+    # Relative paths for star and etomo directive files
+    tilt_series_star_rel = data.get('tilt_series_star_file', f"{tomo_prefix}.star")
+    etomo_directive_rel = data.get('etomo_directive_file', f"{tomo_prefix}.edf")
+
+    return (
+        f"{tomo_prefix}   {data['voltage']:.6f}   {data['cs']:.6f}   {data['amp_contrast']:.6f}   "
+        f"{data['pixel_size']:.6f}   {data['hand']:.6f}   {optics_group}   {data['pixel_size']:.6f}   "
+        f"{tilt_series_star_rel}   {etomo_directive_rel}   {data['bin_factor']:.6f}   "
+        f"{data['vol_size_x']}   {data['vol_size_y']}   {data['vol_size_z']}   {data['vol_file']} {data['denoised_vol_file']} {data['tomo_num']}\n"
+    )
+
 def create_combined_tomogram_star(tomogram_data_list, output_dir):
     """
     Create a combined tomograms.star file for all tomograms.
@@ -345,182 +922,1706 @@ def create_combined_tomogram_star(tomogram_data_list, output_dir):
     tomogram_star_path = os.path.join(output_dir, 'tomograms.star')
     
     with open(tomogram_star_path, 'w') as f:
-        f.write("# version 50001\n\n")
-        f.write("data_global\n\n")
-        f.write("loop_\n")
-        f.write("_rlnTomoName #1\n")
-        f.write("_rlnVoltage #2\n")
-        f.write("_rlnSphericalAberration #3\n")
-        f.write("_rlnAmplitudeContrast #4\n")
-        f.write("_rlnMicrographOriginalPixelSize #5\n")
-        f.write("_rlnTomoHand #6\n")
-        f.write("_rlnOpticsGroupName #7\n")
-        f.write("_rlnTomoTiltSeriesPixelSize #8\n")
-        f.write("_rlnTomoTiltSeriesStarFile #9\n")
-        f.write("_rlnEtomoDirectiveFile #10\n")
-        f.write("_rlnTomoTomogramBinning #11\n")
-        f.write("_rlnTomoSizeX #12\n")
-        f.write("_rlnTomoSizeY #13\n")
-        f.write("_rlnTomoSizeZ #14\n")
-        f.write("_rlnTomoReconstructedTomogram #15\n")
-        f.write("_rlnTomoDenoisedTomogram #16\n")
-        f.write("_tomoman_tomo_num #17\n")
-
-        for data in tomogram_data_list:
-            if data is None:
-                continue
-                
-            tomo_prefix = data['prefix']
-            optics_group = "optics1"  # Default optics group
-            
-            # Relative paths for star and etomo directive files
-            tilt_series_star_rel = f"{tomo_prefix}.star"
-            etomo_directive_rel = f"{tomo_prefix}.edf"
-
-            f.write(
-                f"{tomo_prefix}   {data['voltage']:.6f}   {data['cs']:.6f}   {data['amp_contrast']:.6f}   "
-                f"{data['pixel_size']:.6f}   {data['hand']:.6f}   {optics_group}   {data['pixel_size']:.6f}   "
-                f"{tilt_series_star_rel}   {etomo_directive_rel}   {data['bin_factor']:.6f}   "
-                f"{data['vol_size_x']}   {data['vol_size_y']}   {data['vol_size_z']}   {data['vol_file']} {data['denoised_vol_file']} {data['tomo_num']}\n"
-            )
+        write_tomogram_star_header(f)
+        f.write("".join(format_tomogram_star_row(data) for data in tomogram_data_list if data is not None))
             
     print(f"Created combined tomogram star file: {tomogram_star_path}")
     return tomogram_star_path
 
-def create_individual_tilt_series_star(tomogram_data, output_dir):
+TILT_SERIES_STAR_COLUMNS = [
+    "_rlnMicrographMovieName",
+    "_rlnTomoTiltMovieFrameCount",
+    "_rlnTomoNominalStageTiltAngle",
+    "_rlnTomoNominalTiltAxisAngle",
+    "_rlnMicrographPreExposure",
+    "_rlnTomoNominalDefocus",
+    "_rlnCtfPowerSpectrum",
+    "_rlnMicrographNameEven",
+    "_rlnMicrographNameOdd",
+    "_rlnMicrographName",
+    "_rlnMicrographMetadata",
+    "_rlnAccumMotionTotal",
+    "_rlnAccumMotionEarly",
+    "_rlnAccumMotionLate",
+    "_rlnCtfImage",
+    "_rlnDefocusU",
+    "_rlnDefocusV",
+    "_rlnCtfAstigmatism",
+    "_rlnDefocusAngle",
+    "_rlnCtfFigureOfMerit",
+    "_rlnCtfMaxResolution",
+    "_rlnCtfIceRingDensity",
+    "_rlnTomoXTilt",
+    "_rlnTomoYTilt",
+    "_rlnTomoZRot",
+    "_rlnTomoXShiftAngst",
+    "_rlnTomoYShiftAngst",
+    "_rlnCtfScalefactor",
+]
+
+TILT_SERIES_STAR_HEADER = "# Exporting Chlamy dataset to RELION-5\n# Relion star file version 50001\n\n"
+
+def format_star_columns(row_format, columns):
     """
-    Create an individual tilt-series star file for a single tomogram.
+    Format the rows of a table from whole columns at once.
+
+    Args:
+        row_format: printf-style format of a single row, with one conversion per column
+        columns: sequence of equally long columns (arrays or lists)
+
+    Returns:
+        The formatted rows as a single string
+    """
+    return "".join(map(row_format.__mod__, zip(*columns)))
+
+def format_tilt_series_block(tomogram_data, output_dir):
+    """
+    Format the data_<prefix> block of a tilt-series star file for a single tomogram.
     """
     tomo_prefix = tomogram_data['prefix']
-    pixel_size = tomogram_data['pixel_size']
     tilt_axis = tomogram_data['tilt_axis']
     
     abs_output_dir = os.path.abspath(os.path.join(output_dir, tomo_prefix))
-    even_mrcs_file = os.path.join(abs_output_dir, f"{tomo_prefix}_EVN.mrcs")
-    odd_mrcs_file = os.path.join(abs_output_dir, f"{tomo_prefix}_ODD.mrcs")
-    aligned_mrcs_file = os.path.join(abs_output_dir, f"{tomo_prefix}.mrcs")
-    ctf_mrcs_file = os.path.join(abs_output_dir, f"{tomo_prefix}_CTF.mrcs")
-    
+    # Paths are baked into the row format, so escape them for printf-style formatting
+    even_mrcs_file = os.path.join(abs_output_dir, f"{tomo_prefix}_EVN.mrcs").replace('%', '%%')
+    odd_mrcs_file = os.path.join(abs_output_dir, f"{tomo_prefix}_ODD.mrcs").replace('%', '%%')
+    aligned_mrcs_file = os.path.join(abs_output_dir, f"{tomo_prefix}.mrcs").replace('%', '%%')
+    ctf_mrcs_file = os.path.join(abs_output_dir, f"{tomo_prefix}_CTF.mrcs").replace('%', '%%')
+
+    # Define the columns in the standard RELION tilt-series star format
+    header = f"data_{tomo_prefix}\n\nloop_\n" + "".join(f"{column}\n" for column in TILT_SERIES_STAR_COLUMNS) + "\n"
+
+    row_format = (
+        f"FileNotFound 1 %.6f {tilt_axis:.6f} %.6f 0.000000 FileNotFound "
+        f"%06d@{even_mrcs_file} %06d@{odd_mrcs_file} %d@{aligned_mrcs_file} FileNotFound 0 0 0 %d@{ctf_mrcs_file} "
+        f"%.6f %.6f %.6f %.6f 0 "
+        f"10.000000 0.010000 %.6f %.6f %.6f %.6f %.6f %.6f\n"
+    )
+    columns = tomogram_data['tilt_series_data']
+    image_numbers = columns['index'] + 1
+    rows = format_star_columns(row_format, (
+        columns['tilt_angle'], columns['pre_exposure'],
+        image_numbers, image_numbers, image_numbers, image_numbers,
+        columns['defocus_u'], columns['defocus_v'], columns['astigmatism'], columns['defocus_angle'],
+        columns['x_tilt'], columns['y_tilt'], columns['z_rot'],
+        columns['x_shift_angst'], columns['y_shift_angst'], columns['ctf_scalefactor'],
+    ))
+    return header + rows
+
+def create_individual_tilt_series_star(tomogram_data, output_dir, log=print):
+    """
+    Create an individual tilt-series star file for a single tomogram.
+    """
+    tomo_prefix = tomogram_data['prefix']
     tilt_series_star_path = os.path.join(output_dir, f"{tomo_prefix}.star")
     
     with open(tilt_series_star_path, 'w') as f:
-        f.write("# Exporting Chlamy dataset to RELION-5\n")
-        f.write("# Relion star file version 50001\n\n")
-        f.write(f"data_{tomo_prefix}\n\n")
+        f.write(TILT_SERIES_STAR_HEADER + format_tilt_series_block(tomogram_data, output_dir))
+    
+    log(f"Created individual tilt series star file: {tilt_series_star_path}")
+    return tilt_series_star_path
+
+MULTIBLOCK_STAR_FILENAME = 'tilt_series.star'
+MULTIBLOCK_EDF_FILENAME = 'tilt_series.edf'
+
+def read_multiblock_index(output_dir, star_filename=MULTIBLOCK_STAR_FILENAME):
+    """
+    Read the block-offset index of the multi-block tilt-series star file.
+
+    Returns:
+        dict of prefix -> (byte offset, byte length) of its data_<prefix> block
+    """
+    index_path = os.path.join(output_dir, star_filename + '.idx')
+    index = {}
+    if not os.path.exists(index_path):
+        return index
+    with open(index_path, 'r') as f:
+        for line in f:
+            prefix, offset, length = line.split()
+            index[prefix] = (int(offset), int(length))
+    return index
+
+def read_multiblock_star_block(output_dir, tomo_prefix, index=None, star_filename=MULTIBLOCK_STAR_FILENAME):
+    """
+    Read the data_<prefix> block of a single tomogram from the multi-block tilt-series
+    star file, seeking directly to it through the block-offset index.
+    """
+    if index is None:
+        index = read_multiblock_index(output_dir, star_filename)
+    offset, length = index[tomo_prefix]
+    with open(os.path.join(output_dir, star_filename), 'rb') as f:
+        f.seek(offset)
+        return f.read(length).decode()
+
+class MultiblockStarWriter:
+    """
+    Write the tilt-series tables of all tomograms into a single star file, one data_<prefix>
+    block each, plus an index with the byte offset and length of every block. Both files
+    replace the previous ones on close. Until then, each block is flushed to disk together
+    with its index line as it is written, so that an interrupted run can be recovered (see
+    recover_multiblock_star).
+    """
+    def __init__(self, output_dir, star_filename=MULTIBLOCK_STAR_FILENAME):
+        self.output_dir = output_dir
+        self.star_path = os.path.join(output_dir, star_filename)
+        self.index_path = self.star_path + '.idx'
+        self.index = {}
+        self._star = open(self.star_path + '.tmp', 'wb')
+        self._index = open(self.index_path + '.tmp', 'w')
+        self._star.write(TILT_SERIES_STAR_HEADER.encode())
+
+    def write_block(self, tomo_prefix, block):
+        data = block.encode()
+        self.index[tomo_prefix] = (self._star.tell(), len(data))
+        self._star.write(data)
+        self._star.write(b"\n")
+        # The block must be on disk before the index line (and the manifest entry) pointing to it
+        self._star.flush()
+        self._index.write(f"{tomo_prefix}\t{self.index[tomo_prefix][0]}\t{len(data)}\n")
+        self._index.flush()
+
+    def close(self):
+        self._star.close()
+        self._index.close()
+        os.replace(self.star_path + '.tmp', self.star_path)
+        os.replace(self.index_path + '.tmp', self.index_path)
+        print(f"Created multi-block tilt series star file: {self.star_path}")
+
+def recover_multiblock_star(output_dir, star_filename=MULTIBLOCK_STAR_FILENAME):
+    """
+    Fold the blocks written by an interrupted run (left in the .tmp files of
+    MultiblockStarWriter) into the multi-block star file and its index, so that the
+    tomograms it completed are not converted again. Blocks of the interrupted run take
+    precedence over those of the previous complete file.
+
+    Returns:
+        number of recovered blocks
+    """
+    star_path = os.path.join(output_dir, star_filename)
+    tmp_star_path, tmp_index_path = star_path + '.tmp', star_path + '.idx.tmp'
+    if not (os.path.exists(tmp_star_path) and os.path.exists(tmp_index_path)):
+        return 0
+    tmp_size = os.path.getsize(tmp_star_path)
+    recovered = {}
+    with open(tmp_index_path, 'r') as f:
+        for line in f:
+            # The last line may be truncated, and blocks must be complete
+            fields = line.split()
+            if not line.endswith("\n") or len(fields) != 3:
+                continue
+            offset, length = int(fields[1]), int(fields[2])
+            if offset + length <= tmp_size:
+                recovered[fields[0]] = (offset, length)
+    if recovered:
+        previous_index = read_multiblock_index(output_dir, star_filename)
+        writer = MultiblockStarWriter(output_dir, star_filename + '.recovered')
+        for prefix in previous_index:
+            if prefix not in recovered:
+                writer.write_block(prefix, read_multiblock_star_block(output_dir, prefix, previous_index, star_filename))
+        with open(tmp_star_path, 'rb') as f:
+            for prefix, (offset, length) in recovered.items():
+                f.seek(offset)
+                writer.write_block(prefix, f.read(length).decode())
+        writer.close()
+        os.replace(writer.star_path, star_path)
+        os.replace(writer.index_path, star_path + '.idx')
+        print(f"Recovered {len(recovered)} blocks of an interrupted run into {star_path}")
+    os.remove(tmp_star_path)
+    os.remove(tmp_index_path)
+    return len(recovered)
+
+
+MANIFEST_FILENAME = 'manifest.jsonl'
+MANIFEST_VERSION = 1
+
+def tomogram_input_files(tomos_dir, tomo_prefix):
+    """
+    Metadata files read for a tomogram, relative to its folder. Their content fully
+    determines the tilt-series star file written for it.
+    """
+    return [
+        os.path.join("AreTomo", f"{tomo_prefix}_dose-filt.tlt"),
+        os.path.join("AreTomo", f"{tomo_prefix}_dose-filt.xf"),
+        os.path.join("tiltctf", "ctfphaseflip_tiltctf.txt"),
+        os.path.join("metadata", "tomolist", "collected_tilts.star"),
+        os.path.join("metadata", "tomolist", "dose.star"),
+        os.path.join("metadata", "tomolist", "removed_tilts.star"),
+    ]
+
+def tomogram_stack_files(tomo_prefix):
+    """
+    Stacks softlinked for a tomogram, relative to its folder. Only their presence matters.
+    """
+    return [
+        f"{tomo_prefix}.st",
+        f"{tomo_prefix}_EVN.st",
+        f"{tomo_prefix}_ODD.st",
+        os.path.join("tiltctf", f"diagnostic_{tomo_prefix}_dose-filt_tiltctf_ps.mrc"),
+    ]
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_fingerprint(path):
+    """Size, mtime and content hash of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': _sha256(path)}
+
+def file_unchanged(path, fingerprint):
+    """
+    Check a file against its recorded fingerprint. The content is only hashed when
+    size and mtime alone cannot tell (e.g. the file was touched or copied).
+
+    Returns:
+        (unchanged, fingerprint): whether the content is unchanged, and the fingerprint to
+        record, with the new mtime if only that changed so that the file is not hashed again
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return fingerprint is None, fingerprint
+    if fingerprint is None or st.st_size != fingerprint['size']:
+        return False, fingerprint
+    if st.st_mtime_ns == fingerprint['mtime_ns']:
+        return True, fingerprint
+    if _sha256(path) != fingerprint['sha256']:
+        return False, fingerprint
+    return True, dict(fingerprint, mtime_ns=st.st_mtime_ns)
+
+def tomogram_manifest_entry(tomos_dir, tomo_prefix, options, metadata_cache=None):
+    """
+    Fingerprint the inputs of a tomogram together with the options used to convert it.
+    When converting from a metadata cache, its digest of the tomogram stands for the metadata files.
+    """
+    tomo_dir = os.path.join(tomos_dir, tomo_prefix)
+    stacks = tomogram_stack_files(tomo_prefix)
+    if metadata_cache is not None:
+        inputs = {'metadata_cache': metadata_cache.digest(tomo_prefix) if tomo_prefix in metadata_cache else None}
+    else:
+        input_files = tomogram_input_files(tomos_dir, tomo_prefix)
+        inputs = dict(zip(input_files, probe_paths((os.path.join(tomo_dir, rel) for rel in input_files), file_fingerprint)))
+    return {
+        'version': MANIFEST_VERSION,
+        'prefix': tomo_prefix,
+        'options': options,
+        'inputs': inputs,
+        'stacks': dict(zip(stacks, probe_paths(os.path.join(tomo_dir, rel) for rel in stacks))),
+    }
+
+def tomogram_up_to_date(entry, tomos_dir, output_dir, tomo_prefix, options, metadata_cache=None):
+    """
+    Check whether the outputs recorded in a manifest entry are still valid, i.e. the
+    options and inputs did not change and the output files and softlinks are still in place.
+
+    Returns:
+        The entry if up to date (a copy with refreshed fingerprints if some input files were
+        only touched), else None
+    """
+    if entry is None or entry.get('version') != MANIFEST_VERSION or entry['options'] != options:
+        return None
+    # The blocks of the multi-block star file are checked against its index by the caller
+    outputs = [] if options['multiblock'] else [os.path.join(output_dir, f"{tomo_prefix}{ext}") for ext in ('.star', '.edf')]
+    # A softlink was created for each stack that was present
+    outputs += [link for (_, link), present in zip(softlink_pairs(tomos_dir, output_dir, tomo_prefix), entry['stacks'].values()) if present]
+    if not all(probe_paths(outputs, os.path.lexists)):
+        return None
+    tomo_dir = os.path.join(tomos_dir, tomo_prefix)
+    stacks_present = probe_paths(os.path.join(tomo_dir, rel) for rel in entry['stacks'])
+    if stacks_present != list(entry['stacks'].values()):
+        return None
+    if metadata_cache is not None:
+        if tomo_prefix in metadata_cache and entry['inputs'] == {'metadata_cache': metadata_cache.digest(tomo_prefix)}:
+            return entry
+        return None
+    inputs = list(entry['inputs'].items())
+    checked = probe_paths(inputs, lambda item: file_unchanged(os.path.join(tomo_dir, item[0]), item[1]))
+    if not all(unchanged for unchanged, _ in checked):
+        return None
+    fingerprints = {rel: fingerprint for (rel, _), (_, fingerprint) in zip(inputs, checked)}
+    return entry if fingerprints == entry['inputs'] else dict(entry, inputs=fingerprints)
+
+def read_manifest(output_dir, filename=MANIFEST_FILENAME):
+    """
+    Read the manifest of previous runs as a dict of prefix -> entry. The manifest is
+    appended to as tomograms are converted, so later lines take precedence and a line
+    truncated by an interrupted run is ignored.
+    """
+    manifest_path = os.path.join(output_dir, filename)
+    entries = {}
+    if not os.path.exists(manifest_path):
+        return entries
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[entry['prefix']] = entry
+    return entries
+
+def write_manifest(output_dir, entries, filename=MANIFEST_FILENAME):
+    """Rewrite the manifest with a single line per tomogram."""
+    manifest_path = os.path.join(output_dir, filename)
+    with open(manifest_path + '.tmp', 'w') as f:
+        for prefix in sorted(entries):
+            f.write(json.dumps(entries[prefix]) + "\n")
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+TOMOGRAMS_STAR_FILENAME = 'tomograms.star'
+SHARD_FILENAME_PATTERN = re.compile(r'^tomograms\.shard(\d+)of(\d+)\.star$')
+
+def parse_shard(value):
+    """Parse a --shard argument "i/N" (1 <= i <= N) into (i, N)."""
+    match = re.match(r'^(\d+)/(\d+)$', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected i/N with 1 <= i <= N (e.g. 1/4)")
+    return int(match.group(1)), int(match.group(2))
+
+def shard_of(tomo_prefix, n_shards):
+    """
+    Shard (1 to n_shards) a tomogram belongs to. It only depends on the prefix, so that shards
+    started at different times agree even if they list a different set of folders.
+    """
+    return int(hashlib.sha1(tomo_prefix.encode()).hexdigest(), 16) % n_shards + 1
+
+def shard_filename(filename, shard):
+    """Name of the partial output of a shard, e.g. tomograms.star -> tomograms.shard2of4.star."""
+    if shard is None:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.shard{shard[0]}of{shard[1]}{ext}"
+
+def read_tomogram_star_rows(star_path):
+    """Data rows of a tomograms.star file written by this script, as raw lines."""
+    columns, rows = [], []
+    with open(star_path, 'r') as f:
+        for line in f:
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#') or stripped.startswith('data_') or stripped == 'loop_':
+                continue
+            if stripped.startswith('_'):
+                columns.append(stripped.split()[0])
+            else:
+                rows.append(line if line.endswith("\n") else line + "\n")
+    if columns != TOMOGRAMS_STAR_COLUMNS:
+        raise ValueError(f"Unexpected columns in {star_path}, not written by this script?")
+    return rows
+
+def merge_shards(output_dir):
+    """
+    Combine the partial tomograms.star files and manifests written by the shards of a
+    sharded conversion (--shard i/N) into tomograms.star and manifest.jsonl.
+
+    All N partial files must be present, and no tomogram name or tomo_num may appear twice.
+    Rows are ordered by tomogram name, as in a single-process conversion.
+
+    Returns:
+        the number of merged rows
+    """
+    shards = sorted((int(m.group(1)), int(m.group(2))) for m in map(SHARD_FILENAME_PATTERN.match, os.listdir(output_dir)) if m)
+    if not shards:
+        raise ValueError(f"No partial tomograms.star files (tomograms.shard<i>of<N>.star) found in {output_dir}")
+    shard_counts = sorted({n for _, n in shards})
+    if len(shard_counts) > 1:
+        raise ValueError(f"Partial outputs of runs with different shard counts ({', '.join(map(str, shard_counts))}) found, remove the stale ones")
+    n_shards = shard_counts[0]
+    missing = sorted(set(range(1, n_shards + 1)) - {i for i, _ in shards})
+    if missing:
+        raise ValueError(f"Partial outputs of shards {', '.join(f'{i}/{n_shards}' for i in missing)} are missing")
+
+    name_col = TOMOGRAMS_STAR_COLUMNS.index('_rlnTomoName')
+    num_col = TOMOGRAMS_STAR_COLUMNS.index('_tomoman_tomo_num')
+    rows, names, nums = [], {}, {}
+    problems = []
+    for shard in shards:
+        for row in read_tomogram_star_rows(os.path.join(output_dir, shard_filename(TOMOGRAMS_STAR_FILENAME, shard))):
+            fields = row.split()
+            name, num = fields[name_col], fields[num_col]
+            if name in names:
+                problems.append(f"_rlnTomoName {name} in shards {names[name]} and {shard[0]}")
+            if num in nums:
+                problems.append(f"tomo_num {num} of {name} (shard {shard[0]}) already used by {nums[num]}")
+            names.setdefault(name, shard[0])
+            nums.setdefault(num, name)
+            rows.append((name, row))
+    if problems:
+        raise ValueError("Duplicate tomograms in the partial outputs:\n  " + "\n  ".join(problems))
+
+    tomogram_star_path = os.path.join(output_dir, TOMOGRAMS_STAR_FILENAME)
+    with open(tomogram_star_path + '.tmp', 'w') as f:
+        write_tomogram_star_header(f)
+        for _, row in sorted(rows, key=lambda item: item[0]):
+            f.write(row)
+    os.replace(tomogram_star_path + '.tmp', tomogram_star_path)
+
+    # Merge the manifests too, so that later runs (sharded or not) stay incremental
+    manifest = read_manifest(output_dir)
+    for shard in shards:
+        manifest.update(read_manifest(output_dir, shard_filename(MANIFEST_FILENAME, shard)))
+    write_manifest(output_dir, manifest)
+    print(f"Merged {len(rows)} tomograms from {n_shards} shards into {tomogram_star_path}")
+    return len(rows)
 
-        # Define the columns in the standard RELION tilt-series star format
+def merge_main(argv):
+    parser = argparse.ArgumentParser(prog='chlamydataset2relion5.py merge',
+                                     description='Combine the partial outputs of a sharded conversion (--shard i/N) into tomograms.star.')
+    parser.add_argument('--output_dir', type=str, required=True, help='Output directory shared by all shards')
+    args = parser.parse_args(argv)
+    try:
+        merge_shards(args.output_dir)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+CATALOG_VERSION = 2
+CATALOG_ARTIFACTS = [
+    'tlt', 'xf', 'ctf', 'collected_tilts', 'dose', 'removed_tilts',
+    'stack', 'stack_even', 'stack_odd', 'ctf_diagnostic',
+]
+
+def tomogram_artifacts(tomos_dir, tomo_prefix):
+    """All files of a tomogram folder used by the conversion, as dict of name -> relative path."""
+    return dict(zip(CATALOG_ARTIFACTS, tomogram_input_files(tomos_dir, tomo_prefix) + tomogram_stack_files(tomo_prefix)))
+
+def scan_tomogram_folder(tomos_dir, tomo_prefix):
+    """
+    Scan a tomogram folder with os.scandir, one directory listing per subfolder instead of
+    one stat call per file.
+
+    Returns:
+        dict of artifact name -> (size, mtime_ns) for the artifacts present, and the tilt count
+        (number of angles in the .tlt file, None if missing)
+    """
+    tomo_dir = os.path.join(tomos_dir, tomo_prefix)
+    artifacts = tomogram_artifacts(tomos_dir, tomo_prefix)
+    found = {}
+    for subdir in sorted({os.path.dirname(rel) for rel in artifacts.values()}):
+        try:
+            with os.scandir(os.path.join(tomo_dir, subdir)) as it:
+                for entry in it:
+                    if entry.is_file():
+                        st = entry.stat()
+                        found[os.path.join(subdir, entry.name)] = (st.st_size, st.st_mtime_ns)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    present = {name: found[rel] for name, rel in artifacts.items() if rel in found}
+    n_tilts = None
+    if 'tlt' in present:
+        with open(os.path.join(tomo_dir, artifacts['tlt']), 'r') as f:
+            n_tilts = sum(1 for line in f if line.strip())
+    return present, n_tilts
+
+def build_catalog(tomos_dir, correspondence_star, catalog_path, threads=16):
+    """
+    Scan all tomogram folders of tomos_dir in parallel and store what was found in a SQLite
+    catalog: one row per tomogram (prefix, tomo_num, tilt count, whether all metadata needed
+    for the conversion is present) and one row per artifact present (size and mtime).
+    """
+    tomo_nums = tomolist_mapping(read_star_loop(correspondence_star))
+    with os.scandir(tomos_dir) as it:
+        prefixes = sorted(entry.name for entry in it if entry.is_dir())
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        scans = list(pool.map(lambda prefix: scan_tomogram_folder(tomos_dir, prefix), prefixes))
+
+    # Only these are required by the conversion, the acquisition files are optional
+    required = set(CATALOG_ARTIFACTS[:3])
+    if os.path.exists(catalog_path):
+        os.remove(catalog_path)
+    con = sqlite3.connect(catalog_path)
+    with con:
+        con.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE tomograms (
+                prefix TEXT PRIMARY KEY,
+                tomo_num INTEGER,
+                n_tilts INTEGER,
+                complete INTEGER NOT NULL
+            );
+            CREATE TABLE artifacts (
+                prefix TEXT NOT NULL REFERENCES tomograms(prefix),
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                PRIMARY KEY (prefix, name)
+            );
+            CREATE INDEX tomograms_tomo_num ON tomograms(tomo_num);
+        """)
+        con.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ('version', str(CATALOG_VERSION)),
+            ('tomos_dir', os.path.abspath(tomos_dir)),
+            ('correspondence_star', os.path.abspath(correspondence_star)),
+        ])
+        con.executemany("INSERT INTO tomograms VALUES (?, ?, ?, ?)", [
+            (prefix, tomo_nums.get(prefix), n_tilts, int(required <= set(present)))
+            for prefix, (present, n_tilts) in zip(prefixes, scans)
+        ])
+        con.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?)", [
+            (prefix, name, size, mtime_ns)
+            for prefix, (present, _) in zip(prefixes, scans)
+            for name, (size, mtime_ns) in present.items()
+        ])
+    con.close()
+    n_complete = sum(required <= set(present) for present, _ in scans)
+    print(f"Catalogued {len(prefixes)} tomogram folders ({n_complete} with complete metadata) in {catalog_path}")
+    return catalog_path
+
+def query_catalog(catalog_path, include=None, exclude=None):
+    """
+    Select tomograms from the catalog, filtered by include/exclude prefix patterns exactly
+    as filter_prefixes does for a directory listing. Tomograms whose metadata was incomplete
+    when the catalog was built are skipped.
+
+    Returns:
+        tomos_dir recorded in the catalog, the sorted list of selected prefixes and a dict of
+        prefix -> tomo_num for them
+    """
+    con = sqlite3.connect(f"file:{catalog_path}?mode=ro", uri=True)
+    meta = dict(con.execute("SELECT key, value FROM meta").fetchall())
+    if meta.get('version') != str(CATALOG_VERSION):
+        con.close()
+        raise ValueError(f"Catalog {catalog_path} was written by another version of this script, re-run the catalog command")
+    rows = con.execute("SELECT prefix, tomo_num, complete FROM tomograms ORDER BY prefix").fetchall()
+    con.close()
+    tomo_nums = {prefix: tomo_num for prefix, tomo_num, _ in rows if tomo_num is not None}
+    complete = {prefix: bool(flag) for prefix, _, flag in rows}
+    selected = filter_prefixes([prefix for prefix, _, _ in rows], include, exclude)
+    incomplete = [prefix for prefix in selected if not complete[prefix]]
+    for prefix in incomplete:
+        print(f"Warning: Skipping tomogram {prefix}, its metadata files were incomplete when catalogued")
+    tomo_prefixes = [prefix for prefix in selected if complete[prefix]]
+    return meta['tomos_dir'], tomo_prefixes, {prefix: tomo_nums[prefix] for prefix in tomo_prefixes if prefix in tomo_nums}
+
+def catalog_known_paths(catalog_path, tomo_prefixes):
+    """
+    Existence of all artifacts of tomograms as recorded in the catalog, as a dict of absolute
+    path -> exists for set_known_paths, so that the conversion does not probe them again.
+    """
+    con = sqlite3.connect(f"file:{catalog_path}?mode=ro", uri=True)
+    tomos_dir = con.execute("SELECT value FROM meta WHERE key = 'tomos_dir'").fetchone()[0]
+    present = set(con.execute("SELECT prefix, name FROM artifacts").fetchall())
+    con.close()
+    known_paths = {}
+    for prefix in tomo_prefixes:
+        for name, rel in tomogram_artifacts(tomos_dir, prefix).items():
+            known_paths[os.path.join(tomos_dir, prefix, rel)] = (prefix, name) in present
+    return known_paths
+
+METADATA_CACHE_MAGIC = b'CHLAMYMD'
+METADATA_CACHE_VERSION = 1
+METADATA_CACHE_ALIGN = 64
+
+def metadata_columns(metadata):
+    """Flatten the metadata of a tomogram (see read_tomogram_metadata) into arrays."""
+    ctf_data = metadata['ctf_data']
+    acquisition_order = metadata['acquisition_order']
+    xf = np.asarray(metadata['xf_data'], dtype=np.float64)
+    if xf.size and (xf.ndim != 2 or xf.shape[1] != 6):
+        raise ValueError("Transformation matrices without 6 values per line in the .xf file")
+    return {
+        'tilt_angles': np.asarray(metadata['tilt_angles'], dtype=np.float64),
+        'xf': xf.reshape(-1, 6),
+        'ctf_frame': np.array([entry['frame'] for entry in ctf_data], dtype=np.int64),
+        'ctf_tilt_angle': np.array([entry['tilt_angle'] for entry in ctf_data], dtype=np.float64),
+        'ctf_defocus_u': np.array([entry['defocus_u'] for entry in ctf_data], dtype=np.float64),
+        'ctf_defocus_v': np.array([entry['defocus_v'] for entry in ctf_data], dtype=np.float64),
+        'ctf_astigmatism_angle': np.array([entry['astigmatism_angle'] for entry in ctf_data], dtype=np.float64),
+        'acquisition_order': (np.zeros((0, 3)) if acquisition_order is None
+                              else np.asarray(acquisition_order, dtype=np.float64).reshape(-1, 3)),
+    }
+
+# Arrays sharing the same per-tomogram offsets
+METADATA_CACHE_GROUPS = {
+    'tlt': ['tilt_angles'],
+    'xf': ['xf'],
+    'ctf': ['ctf_frame', 'ctf_tilt_angle', 'ctf_defocus_u', 'ctf_defocus_v', 'ctf_astigmatism_angle'],
+    'acquisition': ['acquisition_order'],
+}
+
+def _read_metadata_for_cache(tomos_dir, tomo_prefix):
+    try:
+        metadata = read_tomogram_metadata(tomos_dir, tomo_prefix)
+        return metadata_columns(metadata), metadata['acquisition_order'] is not None, None
+    except Exception as e:
+        return None, False, str(e)
+
+def build_metadata_cache(tomos_dir, tomo_prefixes, cache_path, threads=16):
+    """
+    Parse the metadata files (.tlt, .xf, CTF and tomolist STAR files) of all tomograms once
+    and store them in a single binary file: for each kind of table, one flat array with the
+    rows of all tomograms and an array of per-tomogram offsets into it.
+
+    The file starts with a magic string, the length of a JSON header and the header itself
+    (prefixes, array dtypes/shapes/offsets, per-tomogram content digests and errors),
+    followed by the raw arrays, so that it can be loaded with a memory map (MetadataCache).
+    """
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda prefix: _read_metadata_for_cache(tomos_dir, prefix), tomo_prefixes))
+
+    tomograms = {}
+    parts = {name: [] for names in METADATA_CACHE_GROUPS.values() for name in names}
+    counts = {group: [] for group in METADATA_CACHE_GROUPS}
+    for prefix, (columns, has_acquisition, error) in zip(tomo_prefixes, results):
+        if columns is None:
+            print(f"Warning: Could not read metadata of {prefix}: {error}")
+            columns = metadata_columns({'tilt_angles': [], 'xf_data': [], 'ctf_data': [], 'acquisition_order': None})
+        digest = hashlib.sha256()
+        for name, values in columns.items():
+            parts[name].append(values)
+            digest.update(name.encode() + values.tobytes())
+        digest.update(bytes([has_acquisition]))
+        for group, names in METADATA_CACHE_GROUPS.items():
+            counts[group].append(len(columns[names[0]]))
+        tomograms[prefix] = {'acquisition': has_acquisition, 'error': error, 'sha256': digest.hexdigest()}
+
+    arrays = {name: np.concatenate(values) if values else np.zeros(0) for name, values in parts.items()}
+    arrays['xf'] = arrays['xf'].reshape(-1, 6)
+    arrays['acquisition_order'] = arrays['acquisition_order'].reshape(-1, 3)
+    for group, group_counts in counts.items():
+        arrays[f'{group}_offsets'] = np.concatenate(([0], np.cumsum(group_counts, dtype=np.int64))).astype(np.int64)
+
+    layout, offset = {}, 0
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        arrays[name] = values
+        layout[name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset}
+        offset += -(-values.nbytes // METADATA_CACHE_ALIGN) * METADATA_CACHE_ALIGN
+    header = json.dumps({
+        'version': METADATA_CACHE_VERSION,
+        'tomos_dir': os.path.abspath(tomos_dir),
+        'prefixes': list(tomo_prefixes),
+        'tomograms': tomograms,
+        'arrays': layout,
+    }).encode()
+    data_start = -(-(len(METADATA_CACHE_MAGIC) + 8 + len(header)) // METADATA_CACHE_ALIGN) * METADATA_CACHE_ALIGN
+
+    with open(cache_path + '.tmp', 'wb') as f:
+        f.write(METADATA_CACHE_MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, values in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(values.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(cache_path + '.tmp', cache_path)
+    n_errors = sum(entry['error'] is not None for entry in tomograms.values())
+    print(f"Cached the metadata of {len(tomo_prefixes) - n_errors} tomograms ({n_errors} with errors) in {cache_path}")
+    return cache_path
+
+class MetadataCache:
+    """
+    Read-only view of a metadata cache written by build_metadata_cache. The arrays are
+    memory-mapped, so loading is immediate and only the rows of the tomograms accessed
+    are read from disk.
+    """
+    def __init__(self, cache_path):
+        self.path = cache_path
+        with open(cache_path, 'rb') as f:
+            if f.read(len(METADATA_CACHE_MAGIC)) != METADATA_CACHE_MAGIC:
+                raise ValueError(f"Not a metadata cache: {cache_path}")
+            (header_size,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_size))
+        if header.get('version') != METADATA_CACHE_VERSION:
+            raise ValueError(f"Unsupported metadata cache version in {cache_path}, rebuild it with build-cache")
+        self.tomos_dir = header['tomos_dir']
+        self.prefixes = header['prefixes']
+        self.tomograms = header['tomograms']
+        self._position = {prefix: i for i, prefix in enumerate(self.prefixes)}
+        data_start = -(-(len(METADATA_CACHE_MAGIC) + 8 + header_size) // METADATA_CACHE_ALIGN) * METADATA_CACHE_ALIGN
+        buffer = np.memmap(cache_path, dtype=np.uint8, mode='r')
+        self.arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            start = data_start + spec['offset']
+            nbytes = int(np.prod(spec['shape'], dtype=np.int64)) * dtype.itemsize
+            self.arrays[name] = buffer[start:start + nbytes].view(dtype).reshape(spec['shape'])
+
+    def __contains__(self, tomo_prefix):
+        return tomo_prefix in self._position
+
+    def digest(self, tomo_prefix):
+        """Content hash of the cached metadata of a tomogram."""
+        return self.tomograms[tomo_prefix]['sha256']
+
+    def _rows(self, group, i):
+        offsets = self.arrays[f'{group}_offsets']
+        return slice(offsets[i], offsets[i + 1])
+
+    def metadata(self, tomo_prefix):
+        """Metadata of a tomogram, in the format returned by read_tomogram_metadata."""
+        if tomo_prefix not in self._position:
+            raise ValueError(f"{tomo_prefix} is not in the metadata cache {self.path}")
+        entry = self.tomograms[tomo_prefix]
+        if entry['error'] is not None:
+            raise ValueError(entry['error'])
+        i = self._position[tomo_prefix]
+        ctf = self._rows('ctf', i)
+        ctf_data = [
+            {'frame': int(frame), 'tilt_angle': float(tilt_angle), 'defocus_u': float(defocus_u),
+             'defocus_v': float(defocus_v), 'astigmatism_angle': float(astigmatism_angle)}
+            for frame, tilt_angle, defocus_u, defocus_v, astigmatism_angle in zip(
+                self.arrays['ctf_frame'][ctf], self.arrays['ctf_tilt_angle'][ctf], self.arrays['ctf_defocus_u'][ctf],
+                self.arrays['ctf_defocus_v'][ctf], self.arrays['ctf_astigmatism_angle'][ctf])
+        ]
+        return {
+            'tilt_angles': self.arrays['tilt_angles'][self._rows('tlt', i)].tolist(),
+            'xf_data': np.array(self.arrays['xf'][self._rows('xf', i)]),
+            'ctf_data': ctf_data,
+            'acquisition_order': (np.array(self.arrays['acquisition_order'][self._rows('acquisition', i)])
+                                  if entry['acquisition'] else None),
+        }
+
+MRC_HEADER_SIZE = 1024
+# Bytes per voxel for each MRC mode (mode 101 is 4-bit, packed two voxels per byte)
+MRC_MODE_BYTES = {0: 1, 1: 2, 2: 4, 3: 4, 4: 8, 6: 2, 12: 2, 101: 0.5}
+
+def read_mrc_header(path):
+    """
+    Read the dimensions and pixel size of an MRC file from its 1024-byte header only,
+    never touching the voxel data.
+
+    Returns:
+        dict with nx, ny, nz, mode, pixel_size (Angstrom, from cell size / sampling), the
+        extended header size (nsymbt), the file size and the expected data size
+    """
+    with open(path, 'rb') as f:
+        header = f.read(MRC_HEADER_SIZE)
+        file_size = os.fstat(f.fileno()).st_size
+    if len(header) < MRC_HEADER_SIZE:
+        raise ValueError(f"File too small for an MRC header ({len(header)} bytes)")
+    # The machine stamp tells the byte order (0x11 0x11 for big-endian)
+    byteorder = '>' if header[212] == 0x11 else '<'
+    nx, ny, nz, mode = struct.unpack(byteorder + '4i', header[0:16])
+    mx, my, mz = struct.unpack(byteorder + '3i', header[28:40])
+    xlen, ylen, zlen = struct.unpack(byteorder + '3f', header[40:52])
+    nsymbt, = struct.unpack(byteorder + 'i', header[92:96])
+    if mode not in MRC_MODE_BYTES:
+        raise ValueError(f"Unsupported MRC mode {mode}")
+    return {
+        'nx': nx,
+        'ny': ny,
+        'nz': nz,
+        'mode': mode,
+        'pixel_size': xlen / mx if mx > 0 else 0.0,
+        'nsymbt': nsymbt,
+        'file_size': file_size,
+        'data_size': int(MRC_HEADER_SIZE + nsymbt + math.ceil(nx * ny * nz * MRC_MODE_BYTES[mode])),
+    }
+
+def validate_tomogram_stacks(tomos_dir, tomo_prefix, pixel_size=PIXEL_SIZE, pixel_size_tolerance=0.01):
+    """
+    Check the tilt stacks of a tomogram against its .tlt file, reading only the MRC headers:
+    the number of sections must match the tilt count, the header pixel size must match
+    pixel_size and the file must hold all the data announced by the header. The EVN/ODD
+    stacks are optional (they are not needed for most RELION-5 jobs) and only checked if present.
+
+    Returns:
+        List of problems found (empty if the stacks are valid)
+    """
+    problems = []
+    try:
+        n_tilts = len(read_tlt_file(tomos_dir, tomo_prefix))
+    except (FileNotFoundError, ValueError) as e:
+        return [str(e)]
+
+    tomo_dir = os.path.join(tomos_dir, tomo_prefix)
+    for stack, required in [(f"{tomo_prefix}.st", True), (f"{tomo_prefix}_EVN.st", False), (f"{tomo_prefix}_ODD.st", False)]:
+        path = os.path.join(tomo_dir, stack)
+        try:
+            header = read_mrc_header(path)
+        except FileNotFoundError:
+            if required:
+                problems.append(f"{stack}: not found")
+            continue
+        except ValueError as e:
+            problems.append(f"{stack}: {e}")
+            continue
+        if header['nz'] != n_tilts:
+            problems.append(f"{stack}: {header['nz']} sections but {n_tilts} tilt angles in the .tlt file")
+        if abs(header['pixel_size'] - pixel_size) > pixel_size_tolerance:
+            problems.append(f"{stack}: pixel size {header['pixel_size']:.4f} A in header, expected {pixel_size:.4f} A")
+        if header['file_size'] < header['data_size']:
+            problems.append(f"{stack}: truncated, {header['file_size']} bytes but header announces {header['data_size']}")
+    return problems
+
+def validate_tomograms(tomos_dir, tomo_prefixes, pixel_size=PIXEL_SIZE):
+    """
+    Validate the tilt stacks of many tomograms concurrently (see validate_tomogram_stacks).
+
+    Returns:
+        dict of prefix -> list of problems, only for tomograms with problems
+    """
+    results = probe_paths(tomo_prefixes, lambda prefix: validate_tomogram_stacks(tomos_dir, prefix, pixel_size))
+    invalid = {prefix: problems for prefix, problems in zip(tomo_prefixes, results) if problems}
+    for prefix, problems in invalid.items():
+        for problem in problems:
+            print(f"Warning: {prefix}: {problem}")
+    print(f"Validated tilt stacks of {len(tomo_prefixes)} tomograms: {len(invalid)} with problems.")
+    return invalid
+
+def validate_main(argv):
+    parser = argparse.ArgumentParser(prog='chlamydataset2relion5.py validate',
+                                     description='Check the tilt stacks of each tomogram against its .tlt file (section count, pixel size, '
+                                                 'file size), reading only the MRC headers.')
+    parser.add_argument('--tomos_dir', type=str, required=True, help='Directory containing tomogram folders')
+    parser.add_argument('--include', type=str, nargs='+', default=None,
+                        help='Include only these tomogram prefixes (e.g., Position_1 Position_2)')
+    parser.add_argument('--exclude', type=str, nargs='+', default=None,
+                        help='Exclude these tomogram prefixes (e.g., Position_3 Position_4)')
+    parser.add_argument('--pixel_size', type=float, default=PIXEL_SIZE, help=f'Expected pixel size of the tilt stacks in Angstrom (default: {PIXEL_SIZE})')
+    parser.add_argument('--io_threads', type=int, default=32, help='Number of tomograms validated concurrently (default: 32)')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.tomos_dir):
+        print(f"Error: AreTomo3 directory not found: {args.tomos_dir}", file=sys.stderr)
+        sys.exit(1)
+    with os.scandir(args.tomos_dir) as it:
+        all_prefixes = sorted(entry.name for entry in it if entry.is_dir())
+    set_io_threads(args.io_threads)
+    invalid = validate_tomograms(args.tomos_dir, filter_prefixes(all_prefixes, args.include, args.exclude), args.pixel_size)
+    sys.exit(1 if invalid else 0)
+
+def catalog_main(argv):
+    parser = argparse.ArgumentParser(prog='chlamydataset2relion5.py catalog',
+                                     description='Scan the tomogram folders once and write a SQLite catalog used by later conversions (--catalog).')
+    parser.add_argument('--tomos_dir', type=str, required=True, help='Directory containing tomogram folders')
+    parser.add_argument('--correspondence_star', type=str, required=True, help='STAR file with correspondence between tomo_num and stack_dir.')
+    parser.add_argument('--catalog', type=str, default='catalog.sqlite', help='Path of the catalog to write (default: catalog.sqlite)')
+    parser.add_argument('--threads', type=int, default=16, help='Number of folders scanned concurrently (default: 16)')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.tomos_dir):
+        print(f"Error: AreTomo3 directory not found: {args.tomos_dir}", file=sys.stderr)
+        sys.exit(1)
+    build_catalog(args.tomos_dir, args.correspondence_star, args.catalog, args.threads)
+
+def build_cache_main(argv):
+    parser = argparse.ArgumentParser(prog='chlamydataset2relion5.py build-cache',
+                                     description='Parse the metadata files of all tomograms once into a single memory-mapped cache used by '
+                                                 'later conversions (--metadata_cache).')
+    parser.add_argument('--tomos_dir', type=str, required=True, help='Directory containing tomogram folders')
+    parser.add_argument('--cache', type=str, default='metadata_cache.bin', help='Path of the cache to write (default: metadata_cache.bin)')
+    parser.add_argument('--include', type=str, nargs='+', default=None,
+                        help='Include only these tomogram prefixes (e.g., Position_1 Position_2)')
+    parser.add_argument('--exclude', type=str, nargs='+', default=None,
+                        help='Exclude these tomogram prefixes (e.g., Position_3 Position_4)')
+    parser.add_argument('--threads', type=int, default=16, help='Number of tomograms read concurrently (default: 16)')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.tomos_dir):
+        print(f"Error: AreTomo3 directory not found: {args.tomos_dir}", file=sys.stderr)
+        sys.exit(1)
+    with os.scandir(args.tomos_dir) as it:
+        all_prefixes = sorted(entry.name for entry in it if entry.is_dir())
+    build_metadata_cache(args.tomos_dir, filter_prefixes(all_prefixes, args.include, args.exclude), args.cache, args.threads)
+
+def tomogram_record(data):
+    """
+    The tomograms.star row of a tomogram as a dict of column label (without leading underscore,
+    as in starfile.read) -> value, with the values written by format_tomogram_star_row.
+    """
+    tomo_prefix = data['prefix']
+    return {
+        'rlnTomoName': tomo_prefix,
+        'rlnVoltage': data['voltage'],
+        'rlnSphericalAberration': data['cs'],
+        'rlnAmplitudeContrast': data['amp_contrast'],
+        'rlnMicrographOriginalPixelSize': data['pixel_size'],
+        'rlnTomoHand': data['hand'],
+        'rlnOpticsGroupName': 'optics1',
+        'rlnTomoTiltSeriesPixelSize': data['pixel_size'],
+        'rlnTomoTiltSeriesStarFile': data.get('tilt_series_star_file', f"{tomo_prefix}.star"),
+        'rlnEtomoDirectiveFile': data.get('etomo_directive_file', f"{tomo_prefix}.edf"),
+        'rlnTomoTomogramBinning': data['bin_factor'],
+        'rlnTomoSizeX': data['vol_size_x'],
+        'rlnTomoSizeY': data['vol_size_y'],
+        'rlnTomoSizeZ': data['vol_size_z'],
+        'rlnTomoReconstructedTomogram': data['vol_file'],
+        'rlnTomoDenoisedTomogram': data['denoised_vol_file'],
+        'tomoman_tomo_num': data['tomo_num'],
+    }
+
+def tilt_series_table(data, output_dir):
+    """
+    The tilt-series table of a tomogram as a dict of column label (without leading underscore,
+    as in starfile.read) -> array, with the values written by format_tilt_series_block (at
+    full precision). Image paths point to the softlinks in output_dir.
+    """
+    tomo_prefix = data['prefix']
+    columns = data['tilt_series_data']
+    n_tilts = len(columns['index'])
+    image_numbers = columns['index'] + 1
+    abs_output_dir = os.path.abspath(os.path.join(output_dir, tomo_prefix))
+
+    def constant(value):
+        return np.full(n_tilts, value)
+
+    def images(path, number_format='%d'):
+        return np.array([f"{number_format % number}@{path}" for number in image_numbers], dtype=object)
+
+    return {
+        'rlnMicrographMovieName': constant('FileNotFound'),
+        'rlnTomoTiltMovieFrameCount': constant(1),
+        'rlnTomoNominalStageTiltAngle': columns['tilt_angle'],
+        'rlnTomoNominalTiltAxisAngle': constant(float(data['tilt_axis'])),
+        'rlnMicrographPreExposure': columns['pre_exposure'],
+        'rlnTomoNominalDefocus': constant(0.0),
+        'rlnCtfPowerSpectrum': constant('FileNotFound'),
+        'rlnMicrographNameEven': images(os.path.join(abs_output_dir, f"{tomo_prefix}_EVN.mrcs"), '%06d'),
+        'rlnMicrographNameOdd': images(os.path.join(abs_output_dir, f"{tomo_prefix}_ODD.mrcs"), '%06d'),
+        'rlnMicrographName': images(os.path.join(abs_output_dir, f"{tomo_prefix}.mrcs")),
+        'rlnMicrographMetadata': constant('FileNotFound'),
+        'rlnAccumMotionTotal': constant(0),
+        'rlnAccumMotionEarly': constant(0),
+        'rlnAccumMotionLate': constant(0),
+        'rlnCtfImage': images(os.path.join(abs_output_dir, f"{tomo_prefix}_CTF.mrcs")),
+        'rlnDefocusU': columns['defocus_u'],
+        'rlnDefocusV': columns['defocus_v'],
+        'rlnCtfAstigmatism': columns['astigmatism'],
+        'rlnDefocusAngle': columns['defocus_angle'],
+        'rlnCtfFigureOfMerit': constant(0),
+        'rlnCtfMaxResolution': constant(10.0),
+        'rlnCtfIceRingDensity': constant(0.01),
+        'rlnTomoXTilt': columns['x_tilt'],
+        'rlnTomoYTilt': columns['y_tilt'],
+        'rlnTomoZRot': columns['z_rot'],
+        'rlnTomoXShiftAngst': columns['x_shift_angst'],
+        'rlnTomoYShiftAngst': columns['y_shift_angst'],
+        'rlnCtfScalefactor': columns['ctf_scalefactor'],
+    }
+
+class TomogramConverter:
+    """
+    In-process conversion of tomograms, returning the tomograms.star record and the tilt-series
+    table of each tomogram as Python objects instead of writing and re-reading STAR files:
+
+        converter = TomogramConverter('chlamy_visual_proteomics', 'tomolist_num_dir.star')
+        record, tilts = converter.convert('01082023_BrnoKrios_Arctis_WebUI_Position_8')
+        for prefix, record, tilts in converter.convert_many(prefixes):
+            ...
+
+    The record is a dict and the tilt-series table a dict of arrays (a DataFrame with
+    as_dataframe), labelled as in the STAR files (see tomogram_record and tilt_series_table).
+    Softlinks, tilt-series STAR and .edf files are only written on request. The
+    correspondence table and metadata cache are loaded once, for use from a long-lived process.
+    """
+    def __init__(self, tomos_dir=None, correspondence_star=None, output_dir='relion_star_files', ctf3d_path='ctf3d_bin4',
+                 cryocare_path='cryocare_bin4', cosine_weighting=False, metadata_cache=None, tomolist=None,
+                 as_dataframe=False, verbose=False, allow_missing_ctf=False):
+        """
+        Args:
+            tomos_dir: directory containing the tomogram folders (may be omitted with a metadata_cache)
+            correspondence_star: STAR file with the correspondence between tomo_num and stack_dir,
+                or tomolist: the correspondence as dict of stack_dir -> tomo_num
+            output_dir: directory the image paths of the tilt-series tables point to, and where
+                the sinks write their files
+            metadata_cache: path of a metadata cache (see build_metadata_cache) or MetadataCache
+            as_dataframe: return the tilt-series tables as pandas DataFrames
+            verbose: print the progress messages of the conversion (only this converter's
+                messages are affected, sys.stdout is left alone)
+            allow_missing_ctf: convert tomograms with tilts that have no CTF entry (with zero
+                defocus) instead of failing them
+        """
+        if tomolist is None:
+            if correspondence_star is None:
+                raise ValueError("Either correspondence_star or tomolist is required")
+            tomolist = tomolist_mapping(read_star_loop(correspondence_star))
+        if isinstance(metadata_cache, str):
+            metadata_cache = MetadataCache(metadata_cache)
+        self.tomolist = tomolist
+        self.metadata_cache = metadata_cache
+        self.tomos_dir = tomos_dir if tomos_dir is not None or metadata_cache is None else metadata_cache.tomos_dir
+        self.output_dir = output_dir
+        self.ctf3d_path = ctf3d_path
+        self.cryocare_path = cryocare_path
+        self.cosine_weighting = cosine_weighting
+        self.allow_missing_ctf = allow_missing_ctf
+        self.as_dataframe = as_dataframe
+        self.verbose = verbose
+        self._log = print if verbose else (lambda message: None)
+
+    def _collect(self, tomo_prefix):
+        if tomo_prefix not in self.tomolist:
+            raise KeyError(f"Tomogram {tomo_prefix} is not in the correspondence table")
+        if self.metadata_cache is not None:
+            metadata = self.metadata_cache.metadata(tomo_prefix)
+        else:
+            metadata = read_tomogram_metadata(self.tomos_dir, tomo_prefix)
+        return collect_tomogram_data(self.tomos_dir, tomo_prefix, self.tomolist, self.ctf3d_path, self.cryocare_path,
+                                     cosine_weighting=self.cosine_weighting, allow_missing_ctf=self.allow_missing_ctf,
+                                     metadata=metadata, log=self._log, raise_errors=True)
+
+    def _convert(self, tomo_prefix, softlinks=False, star=False, edf=False):
+        data = self._collect(tomo_prefix)
+        if softlinks or star or edf:
+            os.makedirs(self.output_dir, exist_ok=True)
+            if softlinks:
+                create_softlinks(self.tomos_dir, self.output_dir, tomo_prefix, self.ctf3d_path, self.cryocare_path, log=self._log)
+            if star:
+                create_individual_tilt_series_star(data, self.output_dir, log=self._log)
+            if edf:
+                create_dummy_edf_file(self.output_dir, tomo_prefix, log=self._log)
+        table = tilt_series_table(data, self.output_dir)
+        if self.as_dataframe:
+            import pandas as pd
+            table = pd.DataFrame(table)
+        return tomogram_record(data), table
+
+    def collect(self, tomo_prefix):
+        """
+        Collect the data of a tomogram (as collect_tomogram_data), raising the original
+        exception (e.g. KeyError, FileNotFoundError, ValueError) instead of returning None on errors.
+        """
+        return self._collect(tomo_prefix)
+
+    def convert(self, tomo_prefix, softlinks=False, star=False, edf=False):
+        """
+        Convert a single tomogram.
+
+        Args:
+            softlinks: create the .mrcs softlinks to its stacks in output_dir
+            star: write its tilt-series STAR file to output_dir
+            edf: write its dummy .edf file to output_dir
+
+        Returns:
+            the tomograms.star record (dict) and the tilt-series table (dict of arrays or DataFrame)
+        """
+        return self._convert(tomo_prefix, softlinks, star, edf)
+
+    def convert_many(self, tomo_prefixes, threads=8, skip_errors=True, **sinks):
+        """
+        Convert many tomograms, reading their metadata files concurrently, and yield
+        (prefix, record, table) in the given order. Tomograms that cannot be converted are
+        reported and skipped, or raise their original exception with skip_errors=False. The
+        sinks are as in convert.
+        """
+        tomo_prefixes = list(tomo_prefixes)
+        # Convert in chunks, so that finished results don't pile up while the caller handles them
+        chunk_size = 4 * threads
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for start in range(0, len(tomo_prefixes), chunk_size):
+                chunk = tomo_prefixes[start:start + chunk_size]
+                futures = [pool.submit(self._convert, prefix, **sinks) for prefix in chunk]
+                for prefix, future in zip(chunk, futures):
+                    try:
+                        record, table = future.result()
+                    except Exception as e:
+                        if not skip_errors:
+                            raise
+                        print(f"Warning: Skipping tomogram {prefix}: {type(e).__name__}: {e}")
+                        continue
+                    yield prefix, record, table
+
+def convert_tomogram(tomos_dir, output_dir, tomo_prefix, tomolist, ctf3d_path, cryocare_path, cosine_weighting=False,
+                     multiblock=False, metadata_cache=None, allow_missing_ctf=False):
+    """
+    Convert a single tomogram: create its softlinks, collect its metadata and write its
+    tilt-series star and dummy .edf files. With multiblock, the tilt-series star block is
+    returned in the record (as 'star_block') instead, to be written to the multi-block file.
+    With a metadata_cache (MetadataCache), the metadata is taken from it instead of the files.
+
+    Returns:
+        The tomogram-level record needed for tomograms.star (without the per-tilt data),
+        or None if the tomogram could not be converted.
+    """
+    # Create softlinks for the current tomogram
+    try:
+        with stage('softlinks', tomo_prefix):
+            create_softlinks(tomos_dir, output_dir, tomo_prefix, ctf3d_path, cryocare_path)
+    except Exception as e:
+        print(f"Warning: Could not create softlinks for {tomo_prefix}: {e}")
+        return None
+    metadata = None
+    if metadata_cache is not None:
+        try:
+            with stage('read_metadata_cache', tomo_prefix):
+                metadata = metadata_cache.metadata(tomo_prefix)
+        except ValueError as e:
+            print(f"Error processing tomogram {tomo_prefix}: {str(e)}")
+            print(f"Skipping tomogram {tomo_prefix} due to errors.")
+            return None
+    data = collect_tomogram_data(tomos_dir, tomo_prefix, tomolist, ctf3d_path, cryocare_path, cosine_weighting=cosine_weighting,
+                                 allow_missing_ctf=allow_missing_ctf, metadata=metadata)
+    if data is None:
+        print(f"Skipping tomogram {tomo_prefix} due to errors.")
+        return None
+
+    if multiblock:
+        with stage('format_tilt_series', tomo_prefix):
+            data['star_block'] = format_tilt_series_block(data, output_dir)
+        data['tilt_series_star_file'] = MULTIBLOCK_STAR_FILENAME
+        data['etomo_directive_file'] = MULTIBLOCK_EDF_FILENAME
+    else:
+        # Create an individual tilt-series star file for this tomogram
+        with stage('write_tilt_series', tomo_prefix):
+            create_individual_tilt_series_star(data, output_dir)
+
+        with stage('write_edf', tomo_prefix):
+            create_dummy_edf_file(output_dir, tomo_prefix)
+
+    # The per-tilt data is already on disk, only keep what tomograms.star needs
+    data.pop('tilt_series_data')
+    return data
+
+def convert_tomogram_incremental(tomos_dir, output_dir, tomo_prefix, tomolist, ctf3d_path, cryocare_path,
+                                 cosine_weighting=False, previous_entry=None, multiblock=False, metadata_cache=None,
+                                 allow_missing_ctf=False):
+    """
+    Convert a single tomogram unless its manifest entry shows it is up to date.
+
+    Returns:
+        (data, entry): the tomogram-level record and the new manifest entry, which is
+        None when the tomogram could not be converted or was skipped with its entry unchanged.
+    """
+    options = {
+        'tomos_dir': os.path.abspath(tomos_dir),
+        'output_dir': os.path.abspath(output_dir),
+        'cosine_weighting': cosine_weighting,
+        'multiblock': multiblock,
+    }
+    if metadata_cache is not None:
+        options['metadata_cache'] = os.path.abspath(metadata_cache.path)
+    if allow_missing_ctf:
+        options['allow_missing_ctf'] = True
+    with stage('check_manifest', tomo_prefix):
+        current_entry = tomogram_up_to_date(previous_entry, tomos_dir, output_dir, tomo_prefix, options, metadata_cache)
+    if current_entry is not None:
+        print(f"Skipping unchanged tomogram {tomo_prefix}")
+        # tomograms.star is always regenerated, so take the volume paths from this run
+        data = dict(previous_entry['record'])
+        data['tomo_num'] = lookup_tomo_num(tomolist, tomo_prefix)
+        data['vol_file'], data['denoised_vol_file'] = tomogram_volume_files(data['tomo_num'], ctf3d_path, cryocare_path)
+        # Record refreshed fingerprints, so that touched inputs are not hashed on every run
+        return data, (current_entry if current_entry is not previous_entry else None)
+
+    # Fingerprint before converting, so that inputs changing meanwhile are picked up next time
+    with stage('fingerprint_inputs', tomo_prefix):
+        entry = tomogram_manifest_entry(tomos_dir, tomo_prefix, options, metadata_cache)
+    data = convert_tomogram(tomos_dir, output_dir, tomo_prefix, tomolist, ctf3d_path, cryocare_path, cosine_weighting,
+                            multiblock, metadata_cache, allow_missing_ctf)
+    if data is None:
+        return None, None
+    entry['record'] = {k: v for k, v in data.items() if k not in ('tomo_num', 'vol_file', 'denoised_vol_file', 'star_block')}
+    return data, entry
+
+_worker_tomolist = None
+_worker_metadata_cache = None
+
+def _init_worker(tomolist, io_threads, metadata_cache_path=None, instrument=False, known_paths=None):
+    global _worker_tomolist, _worker_metadata_cache
+    _worker_tomolist = tomolist
+    set_known_paths(known_paths)
+    if instrument:
+        enable_instrumentation()
+    # Each worker maps the cache itself, pages are shared through the page cache
+    _worker_metadata_cache = MetadataCache(metadata_cache_path) if metadata_cache_path else None
+    # A forked worker must not reuse the parent's I/O thread pool, whose threads it lacks
+    set_io_threads(io_threads)
+
+def _convert_tomogram_worker(index, tomos_dir, output_dir, tomo_prefix, ctf3d_path, cryocare_path, cosine_weighting,
+                             previous_entry, multiblock, allow_missing_ctf):
+    try:
+        data, entry = convert_tomogram_incremental(tomos_dir, output_dir, tomo_prefix, _worker_tomolist, ctf3d_path,
+                                                   cryocare_path, cosine_weighting, previous_entry, multiblock,
+                                                   _worker_metadata_cache, allow_missing_ctf)
+    except Exception as e:
+        print(f"Error processing tomogram {tomo_prefix}: {str(e)}")
+        data, entry = None, None
+    # Worker output is block-buffered when redirected, don't let it get lost
+    sys.stdout.flush()
+    return index, tomo_prefix, (data, entry), take_stage_records()
+
+def iter_converted_tomograms(tomo_prefixes, tomos_dir, output_dir, tomolist, ctf3d_path, cryocare_path,
+                             cosine_weighting=False, jobs=1, manifest=None, multiblock=False, metadata_cache=None,
+                             allow_missing_ctf=False):
+    """
+    Convert tomograms, optionally in a pool of worker processes. Tomograms recorded as
+    up to date in the manifest (dict of prefix -> entry) are not converted again.
+
+    Results are yielded as (prefix, (data, entry)) in the order of tomo_prefixes, as soon
+    as all preceding tomograms are done. data is None for tomograms that failed and entry
+    is the new manifest entry of tomograms that were (re-)converted or whose fingerprints
+    were refreshed.
+    """
+    manifest = manifest or {}
+    if jobs <= 1:
+        for prefix in tomo_prefixes:
+            try:
+                result = convert_tomogram_incremental(tomos_dir, output_dir, prefix, tomolist, ctf3d_path, cryocare_path,
+                                                      cosine_weighting, manifest.get(prefix), multiblock, metadata_cache,
+                                                      allow_missing_ctf)
+            except Exception as e:
+                print(f"Error processing tomogram {prefix}: {str(e)}")
+                result = (None, None)
+            yield prefix, result
+        return
+
+    pending = {}
+    next_index = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(tomolist, IO_THREADS, metadata_cache.path if metadata_cache is not None else None,
+                                       _stage_records is not None, _known_paths)) as pool:
+        futures = [
+            pool.submit(_convert_tomogram_worker, i, tomos_dir, output_dir, prefix, ctf3d_path, cryocare_path, cosine_weighting,
+                        manifest.get(prefix), multiblock, allow_missing_ctf)
+            for i, prefix in enumerate(tomo_prefixes)
+        ]
+        for future in as_completed(futures):
+            index, prefix, result, records = future.result()
+            add_stage_records(records)
+            pending[index] = (prefix, result)
+            # Release results in input order, keeping only out-of-order ones in memory
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+
+PARTICLES_STAR_COLUMNS = [
+    "_rlnTomoName",
+    "_rlnTomoParticleName",
+    "_rlnCenteredCoordinateXAngst",
+    "_rlnCenteredCoordinateYAngst",
+    "_rlnCenteredCoordinateZAngst",
+    "_rlnAngleRot",
+    "_rlnAngleTilt",
+    "_rlnAnglePsi",
+    "_rlnOpticsGroup",
+]
+
+def wrap_euler_angles(rot, tilt, psi):
+    """
+    Bring ZYZ Euler angles (degrees) into the ranges used by RELION, rot and psi in
+    (-180, 180] and tilt in [0, 180], using (rot, tilt, psi) == (rot + 180, -tilt, psi + 180).
+    """
+    rot, tilt, psi = (np.asarray(a, dtype=float) for a in (rot, tilt, psi))
+    tilt = (tilt + 180.0) % 360.0 - 180.0
+    flip = tilt < 0
+    tilt = np.abs(tilt)
+    rot = np.where(flip, rot + 180.0, rot)
+    psi = np.where(flip, psi + 180.0, psi)
+    rot = 180.0 - (180.0 - rot) % 360.0
+    psi = 180.0 - (180.0 - psi) % 360.0
+    return rot, tilt, psi
+
+def annotations_to_relion5(particles, tomolist, pixel_size=PIXEL_SIZE, vol_size=VOL_SIZE, bin_factor=BIN_FACTOR):
+    """
+    Convert annotated particles (unbinned pixel coordinates, _rlnTomoName like tomo_0022) to
+    RELION-5 particles, all at once with array operations.
+
+    Args:
+        particles: DataFrame with rlnTomoName, rlnCoordinateX/Y/Z and rlnAngleRot/Tilt/Psi columns
+        tomolist: correspondence table, as dict of stack_dir -> tomo_num (see tomolist_mapping)
+        pixel_size, vol_size, bin_factor: as used for the tomograms in collect_tomogram_data
+
+    Returns:
+        DataFrame with the columns of PARTICLES_STAR_COLUMNS (without leading underscore),
+        with rlnTomoName set to the stack directory prefix used in tomograms.star. Particles
+        of tomograms missing in tomolist are dropped, the others keep their index.
+    """
+    import pandas as pd
+
+    # Map the (few) distinct tomogram names rather than every particle
+    prefix_of_num = {num: prefix for prefix, num in tomolist.items()}
+    codes, names = pd.factorize(particles['rlnTomoName'].astype(str))
+    name_prefixes = []
+    for name in names:
+        match = re.search(r'(\d+)$', name)
+        name_prefixes.append(prefix_of_num.get(int(match.group(1))) if match else None)
+    known_names = np.array([prefix is not None for prefix in name_prefixes], dtype=bool)
+    known = known_names[codes]
+    if not known.all():
+        unknown = [name for name, ok in zip(names, known_names) if not ok]
+        print(f"Warning: Dropping {np.count_nonzero(~known)} particles of tomograms not found in the correspondence table: {', '.join(sorted(unknown))}")
+    particles = particles[known]
+    codes = codes[known]
+    prefixes = np.array(name_prefixes, dtype=object)[codes]
+
+    # Coordinates are relative to the tomogram centre, in Angstrom
+    coords = particles[['rlnCoordinateX', 'rlnCoordinateY', 'rlnCoordinateZ']].to_numpy(dtype=float)
+    centre = np.asarray(vol_size, dtype=float) * bin_factor / 2.0
+    centered = (coords - centre) * pixel_size
+
+    rot, tilt, psi = wrap_euler_angles(particles['rlnAngleRot'], particles['rlnAngleTilt'], particles['rlnAnglePsi'])
+
+    # Particles are numbered from 1 within each tomogram
+    particle_number = pd.Series(codes).groupby(codes, sort=False).cumcount().to_numpy() + 1
+    return pd.DataFrame({
+        'rlnTomoName': prefixes,
+        'rlnTomoParticleName': [f"{prefix}/{n}" for prefix, n in zip(prefixes, particle_number)],
+        'rlnCenteredCoordinateXAngst': centered[:, 0],
+        'rlnCenteredCoordinateYAngst': centered[:, 1],
+        'rlnCenteredCoordinateZAngst': centered[:, 2],
+        'rlnAngleRot': rot,
+        'rlnAngleTilt': tilt,
+        'rlnAnglePsi': psi,
+        'rlnOpticsGroup': np.ones(len(prefixes), dtype=int),
+    }, index=particles.index)
+
+def write_relion5_particles_star(particles, star_path, pixel_size=PIXEL_SIZE, voltage=VOLTAGE, cs=CS, amp_contrast=AMP_CONTRAST):
+    """
+    Write RELION-5 particles (as returned by annotations_to_relion5) to a particles.star file
+    for 2D-stack subtomograms, formatting whole columns at once.
+    """
+    with open(star_path, 'w') as f:
+        f.write("# version 50001\n\n")
+        f.write("data_general\n\n")
+        f.write("_rlnTomoSubTomosAre2DStacks                       1\n\n\n")
+        f.write("data_optics\n\n")
         f.write("loop_\n")
-        f.write("_rlnMicrographMovieName\n")
-        f.write("_rlnTomoTiltMovieFrameCount\n")
-        f.write("_rlnTomoNominalStageTiltAngle\n")
-        f.write("_rlnTomoNominalTiltAxisAngle\n")
-        f.write("_rlnMicrographPreExposure\n")
-        f.write("_rlnTomoNominalDefocus\n")
-        f.write("_rlnCtfPowerSpectrum\n")
-        f.write("_rlnMicrographNameEven\n")
-        f.write("_rlnMicrographNameOdd\n")
-        f.write("_rlnMicrographName\n")
-        f.write("_rlnMicrographMetadata\n")
-        f.write("_rlnAccumMotionTotal\n")
-        f.write("_rlnAccumMotionEarly\n")
-        f.write("_rlnAccumMotionLate\n")
-        f.write("_rlnCtfImage\n")
-        f.write("_rlnDefocusU\n")
-        f.write("_rlnDefocusV\n")
-        f.write("_rlnCtfAstigmatism\n")
-        f.write("_rlnDefocusAngle\n")
-        f.write("_rlnCtfFigureOfMerit\n")
-        f.write("_rlnCtfMaxResolution\n")
-        f.write("_rlnCtfIceRingDensity\n")
-        f.write("_rlnTomoXTilt\n")
-        f.write("_rlnTomoYTilt\n")
-        f.write("_rlnTomoZRot\n")
-        f.write("_rlnTomoXShiftAngst\n")
-        f.write("_rlnTomoYShiftAngst\n")
-        f.write("_rlnCtfScalefactor\n\n")
-        
-        # For each tilt image in this tomogram:
-        for entry in tomogram_data['tilt_series_data']:
-            # Extract parameters from the tilt series data structure
-            i = entry['index']
-            tilt_angle = entry['tilt_angle']
-            pre_exposure = entry['pre_exposure']
-            defocus_u = entry['defocus_u']
-            defocus_v = entry['defocus_v']
-            astigmatism = entry['astigmatism']
-            defocus_angle = entry['defocus_angle']
-            x_tilt = entry['x_tilt']
-            y_tilt = entry['y_tilt']
-            z_rot = entry['z_rot']
-            x_shift_angst = entry['x_shift_angst']
-            y_shift_angst = entry['y_shift_angst']
-            ctf_scalefactor = entry['ctf_scalefactor']
-            
-            even_entry = f"{(i+1):06d}@{even_mrcs_file}"
-            odd_entry = f"{(i+1):06d}@{odd_mrcs_file}"
-            aligned_entry = f"{i+1}@{aligned_mrcs_file}"
-            ctf_entry_str = f"{i+1}@{ctf_mrcs_file}"
-            
-            # Write the row
-            f.write(
-                f"FileNotFound 1 {tilt_angle:.6f} {tilt_axis:.6f} {pre_exposure:.6f} 0.000000 FileNotFound "
-                f"{even_entry} {odd_entry} {aligned_entry} FileNotFound 0 0 0 {ctf_entry_str} "
-                f"{defocus_u:.6f} {defocus_v:.6f} {astigmatism:.6f} {defocus_angle:.6f} 0 "
-                f"10.000000 0.010000 {x_tilt:.6f} {y_tilt:.6f} {z_rot:.6f} {x_shift_angst:.6f} {y_shift_angst:.6f} {ctf_scalefactor:.6f}\n"
-            )
+        f.write("_rlnOpticsGroup #1\n")
+        f.write("_rlnOpticsGroupName #2\n")
+        f.write("_rlnSphericalAberration #3\n")
+        f.write("_rlnVoltage #4\n")
+        f.write("_rlnTomoTiltSeriesPixelSize #5\n")
+        f.write("_rlnAmplitudeContrast #6\n")
+        f.write(f"1   optics1   {cs:.6f}   {voltage:.6f}   {pixel_size:.6f}   {amp_contrast:.6f}\n\n\n")
+        f.write("data_particles\n\n")
+        f.write("loop_\n")
+        for i, column in enumerate(PARTICLES_STAR_COLUMNS):
+            f.write(f"{column} #{i + 1}\n")
+        f.write(format_star_columns("%s %s %.6f %.6f %.6f %.6f %.6f %.6f %d\n",
+                                    [particles[column[1:]].to_numpy() for column in PARTICLES_STAR_COLUMNS]))
+    print(f"Created particles star file with {len(particles)} particles: {star_path}")
+    return star_path
+
+def particles_main(argv):
+    from annotations import find_annotation_stars, read_annotation_star
+    parser = argparse.ArgumentParser(prog='chlamydataset2relion5.py particles',
+                                     description='Export particle annotation STAR files (unbinned pixel coordinates, tomo_NNNN names) to RELION-5 '
+                                                 'particles.star files referencing the tomograms of tomograms.star.')
+    parser.add_argument('--correspondence_star', type=str, required=True, help='STAR file with correspondence between tomo_num and stack_dir.')
+    parser.add_argument('--output_dir', type=str, default='relion_star_files', help='Output directory for the particles_<species>.star files')
+    parser.add_argument('--star_files', type=str, nargs='+', default=None,
+                        help='Annotation STAR files to export (default: all annotation STAR files of this repository)')
+    parser.add_argument('--species', type=str, nargs='+', default=None,
+                        help='Only export these species, by STAR file name (e.g. rubisco nucleosome)')
+    parser.add_argument('--tomograms_star', type=str, default=None,
+                        help='Only export particles of tomograms listed in this tomograms.star (e.g. the output of a conversion with --include)')
+    args = parser.parse_args(argv)
+
+    if args.star_files:
+        star_files = {os.path.splitext(os.path.basename(path))[0]: path for path in args.star_files}
+    else:
+        star_files = find_annotation_stars()
+    if args.species is not None:
+        star_files = {species: path for species, path in star_files.items() if species in args.species}
+    if not star_files:
+        print("No annotation STAR files found matching the criteria.", file=sys.stderr)
+        sys.exit(1)
+
+    tomolist = tomolist_mapping(read_star_loop(args.correspondence_star))
+    if args.tomograms_star is not None:
+        exported = set(read_star_loop(args.tomograms_star)['rlnTomoName'])
+        tomolist = {prefix: num for prefix, num in tomolist.items() if prefix in exported}
+
+    # Each species is its own particles table, numbered from 1 in each tomogram
+    os.makedirs(args.output_dir, exist_ok=True)
+    for species, path in star_files.items():
+        converted = annotations_to_relion5(read_annotation_star(path), tomolist)
+        write_relion5_particles_star(converted, os.path.join(args.output_dir, f"particles_{species}.star"))
+
+def convert_tomograms(args, tomo_prefixes, tomolist, metadata_cache=None, known=None):
+    """
+    Convert tomograms with the options of the command line and write tomograms.star (or the
+    partial file of a shard), the manifest and, with --multiblock_star, the multi-block
+    tilt-series star file.
+
+    Args:
+        known: dict of prefix -> record (as returned) of tomograms converted earlier by the
+            same process, e.g. in watch mode, which are included without checking them again
+
+    Returns:
+        dict of prefix -> tomogram-level record of the tomograms in tomograms.star
+    """
+    # Shards write partial outputs of their own, so that they don't need to coordinate
+    manifest_filename = shard_filename(MANIFEST_FILENAME, args.shard)
+    multiblock_filename = shard_filename(MULTIBLOCK_STAR_FILENAME, args.shard)
+    multiblock_edf_filename = shard_filename(MULTIBLOCK_EDF_FILENAME, args.shard)
+
+    # Tomograms converted by previous (possibly interrupted) runs are only re-converted if
+    # their inputs or options changed. The manifest is always read, so that the entries of
+    # tomograms not selected by this run (or forced) are kept when it is rewritten.
+    manifest = read_manifest(args.output_dir, manifest_filename)
+    if args.shard is not None:
+        # Also pick up the entries of this shard from a merged manifest
+        merged = read_manifest(args.output_dir)
+        manifest = {**{prefix: merged[prefix] for prefix in tomo_prefixes if prefix in merged}, **manifest}
+
+    # --force only bypasses the up-to-date check
+    previous = {} if args.force else dict(manifest)
+
+    multiblock_writer = None
+    if args.multiblock_star:
+        # Blocks of unchanged tomograms are copied over from the previous multi-block file,
+        # including those written by an interrupted run
+        recover_multiblock_star(args.output_dir, multiblock_filename)
+        previous_index = read_multiblock_index(args.output_dir, multiblock_filename)
+        previous = {prefix: entry for prefix, entry in previous.items() if prefix in previous_index}
+        multiblock_writer = MultiblockStarWriter(args.output_dir, multiblock_filename)
+
+    known = known or {}
+    converted = iter_converted_tomograms([prefix for prefix in tomo_prefixes if prefix not in known], args.tomos_dir,
+                                         args.output_dir, tomolist, args.ctf3d, args.cryocare, cosine_weighting=args.cosine_weight,
+                                         jobs=args.jobs, manifest=previous, multiblock=args.multiblock_star,
+                                         metadata_cache=metadata_cache, allow_missing_ctf=args.allow_missing_ctf)
+
+    def results():
+        for prefix in tomo_prefixes:
+            yield (prefix, (dict(known[prefix]), None)) if prefix in known else next(converted)
+
+    # Process each tomogram folder and stream its row into a combined tomograms.star file
+    # (including all tomograms), which only replaces the previous one once complete.
+    # Manifest entries are appended as soon as a tomogram is done, so that a new run can
+    # resume where an interrupted one stopped.
+    tomogram_star_path = os.path.join(args.output_dir, shard_filename(TOMOGRAMS_STAR_FILENAME, args.shard))
+    tmp_star_path = tomogram_star_path + '.tmp'
+    records = {}
+    with open(tmp_star_path, 'w') as f, open(os.path.join(args.output_dir, manifest_filename), 'a') as manifest_file:
+        write_tomogram_star_header(f)
+        for prefix, (data, entry) in results():
+            if data is None:
+                manifest.pop(prefix, None)
+                continue
+            if multiblock_writer is not None:
+                block = data.pop('star_block', None)
+                with stage('write_multiblock', prefix):
+                    if block is None:
+                        block = read_multiblock_star_block(args.output_dir, prefix, previous_index, multiblock_filename)
+                    multiblock_writer.write_block(prefix, block)
+                data['tilt_series_star_file'] = multiblock_filename
+                data['etomo_directive_file'] = multiblock_edf_filename
+            with stage('write_tomograms_star', prefix):
+                f.write(format_tomogram_star_row(data))
+            records[prefix] = data
+            if entry is not None:
+                manifest[prefix] = entry
+                with stage('write_manifest', prefix):
+                    manifest_file.write(json.dumps(entry) + "\n")
+                    manifest_file.flush()
+
+    if multiblock_writer is not None:
+        multiblock_writer.close()
+        create_dummy_edf_file(args.output_dir, os.path.splitext(multiblock_edf_filename)[0])
+    write_manifest(args.output_dir, manifest, manifest_filename)
+
+    if records or args.shard is not None:
+        os.replace(tmp_star_path, tomogram_star_path)
+        print(f"Created combined tomogram star file: {tomogram_star_path}")
+    else:
+        os.remove(tmp_star_path)
+        print("No valid tomogram data was collected.", file=sys.stderr)
     
-    print(f"Created individual tilt series star file: {tilt_series_star_path}")
-    return tilt_series_star_path
+    return records
+
+WATCH_INTERVAL = 30.0
+
+def tomogram_watch_files(tomos_dir, tomo_prefix):
+    """
+    Files that must be present before a tomogram is converted in watch mode (AreTomo, tiltctf
+    and tomolist outputs, and the tilt stack), relative to its folder.
+    """
+    return tomogram_input_files(tomos_dir, tomo_prefix) + tomogram_stack_files(tomo_prefix)[:1]
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def tomogram_signatures(tomos_dir, tomo_prefixes):
+    """
+    Sizes and mtimes of the watched files of each tomogram (None while any is missing), all
+    probed concurrently.
+    """
+    files = [[os.path.join(tomos_dir, prefix, rel) for rel in tomogram_watch_files(tomos_dir, prefix)] for prefix in tomo_prefixes]
+    probed = iter(probe_paths([path for paths in files for path in paths], _file_signature))
+    signatures = {}
+    for prefix, paths in zip(tomo_prefixes, files):
+        signature = tuple(next(probed) for _ in paths)
+        signatures[prefix] = None if None in signature else signature
+    return signatures
+
+def wait_for_changes(paths, timeout):
+    """
+    Wait for timeout seconds. With inotify_simple installed (Linux), return as soon as a file
+    is created, moved or written in one of the directories given.
+    """
+    try:
+        from inotify_simple import INotify, flags
+    except ImportError:
+        time.sleep(timeout)
+        return
+    with INotify() as inotify:
+        for path in paths:
+            try:
+                inotify.add_watch(path, flags.CREATE | flags.MOVED_TO | flags.CLOSE_WRITE)
+            except OSError:
+                continue
+        inotify.read(timeout=int(timeout * 1000))
+
+def watch_tomograms(args):
+    """
+    Keep watching tomos_dir and convert each new tomogram once all its files are present and
+    did not change between two polls, rewriting tomograms.star (atomically) with the new rows.
+    Tomograms without tomo_num wait for the correspondence table to be updated.
+    """
+    os.makedirs(args.output_dir, exist_ok=True)
+    set_io_threads(args.io_threads)
+    tomolist, tomolist_mtime = {}, None
+    signatures = {}  # last signature of the tomograms not converted yet
+    finished = set()  # tomograms converted (or which failed) in this run
+    records = {}
+    print(f"Watching {args.tomos_dir} for new tilt-series every {args.watch_interval:g} s (press Ctrl-C to stop)")
+    try:
+        while True:
+            # New tilt-series get their tomo_num in the correspondence table, reload it when it changes
+            mtime = os.stat(args.correspondence_star).st_mtime_ns
+            if mtime != tomolist_mtime:
+                tomolist = tomolist_mapping(read_star_loop(args.correspondence_star))
+                tomolist_mtime = mtime
+
+            with os.scandir(args.tomos_dir) as it:
+                all_prefixes = sorted(entry.name for entry in it if entry.is_dir())
+            candidates = [prefix for prefix in filter_prefixes(all_prefixes, args.include, args.exclude)
+                          if prefix not in finished and prefix in tomolist]
+            if args.shard is not None:
+                candidates = [prefix for prefix in candidates if shard_of(prefix, args.shard[1]) == args.shard[0]]
+
+            # Only convert tomograms whose files are complete and no longer being written
+            current = tomogram_signatures(args.tomos_dir, candidates)
+            ready = [prefix for prefix in candidates if current[prefix] is not None and signatures.get(prefix) == current[prefix]]
+            signatures = {prefix: signature for prefix, signature in current.items() if prefix not in ready}
+
+            if ready and args.validate:
+                invalid = validate_tomograms(args.tomos_dir, ready)
+                finished.update(invalid)
+                ready = [prefix for prefix in ready if prefix not in invalid]
+            if ready:
+                print(f"New tilt-series ready: {', '.join(ready)}")
+                records = convert_tomograms(args, sorted(set(records) | set(ready)), tomolist, known=records)
+                finished.update(ready)
+                failed = [prefix for prefix in ready if prefix not in records]
+                if failed:
+                    print(f"Warning: Could not convert {', '.join(failed)}, they are not retried until restart.")
+                print(f"{len(records)} tilt-series in tomograms.star, watching for more...")
+                sys.stdout.flush()
+
+            # Wake up early on changes of the folder or of the tomograms still incomplete
+            pending = [os.path.join(args.tomos_dir, prefix, os.path.dirname(rel)) for prefix in signatures
+                       for rel in tomogram_watch_files(args.tomos_dir, prefix)]
+            wait_for_changes([args.tomos_dir] + sorted(set(pending)), args.watch_interval)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+SUBCOMMANDS = {
+    'catalog': catalog_main,
+    'build-cache': build_cache_main,
+    'validate': validate_main,
+    'merge': merge_main,
+    'particles': particles_main,
+}
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     args = parse_args()
-    
-    if not os.path.exists(args.tomos_dir):
+    if args.report is not None:
+        enable_instrumentation()
+    start = time.perf_counter()
+    if args.profile is not None:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.runcall(run, args)
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        print(f"Saved profile: {args.profile}")
+    else:
+        run(args)
+    if args.report is not None:
+        write_run_report(args.report, take_stage_records(), time.perf_counter() - start)
+
+def run(args):
+    """Run a conversion (or watch) with the parsed command line arguments."""
+
+    if args.catalog is not None:
+        # Find and filter tomogram prefixes with indexed queries on the catalog
+        try:
+            catalog_tomos_dir, tomo_prefixes, tomolist = query_catalog(args.catalog, args.include, args.exclude)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        if args.tomos_dir is None:
+            args.tomos_dir = catalog_tomos_dir
+        # The files found when cataloguing are not probed again (only for the catalogued tree)
+        if os.path.abspath(args.tomos_dir) == catalog_tomos_dir:
+            set_known_paths(catalog_known_paths(args.catalog, tomo_prefixes))
+
+    metadata_cache = None
+    if args.metadata_cache is not None:
+        metadata_cache = MetadataCache(args.metadata_cache)
+        if args.tomos_dir is None:
+            args.tomos_dir = metadata_cache.tomos_dir
+
+    if args.tomos_dir is None or not os.path.exists(args.tomos_dir):
         print(f"Error: AreTomo3 directory not found: {args.tomos_dir}", file=sys.stderr)
         sys.exit(1)
-    
-    os.makedirs(args.output_dir, exist_ok=True)
 
-    tomolist = starfile.read(args.correspondence_star)
-    
-    # Find and filter tomogram prefixes
-    # all_prefixes = find_all_tomo_prefixes(args.tomos_dir)
-    all_prefixes = os.listdir(args.tomos_dir)
-    tomo_prefixes = filter_prefixes(all_prefixes, args.include, args.exclude)
+    if args.watch:
+        watch_tomograms(args)
+        return
+
+    if args.catalog is None:
+        tomolist = tomolist_mapping(read_star_loop(args.correspondence_star))
+
+        # Find and filter tomogram prefixes
+        # all_prefixes = find_all_tomo_prefixes(args.tomos_dir)
+        if metadata_cache is not None:
+            all_prefixes = sorted(metadata_cache.prefixes)
+        else:
+            all_prefixes = sorted(os.listdir(args.tomos_dir))
+        tomo_prefixes = filter_prefixes(all_prefixes, args.include, args.exclude)
+
+    try:
+        if args.composition is not None:
+            tomo_prefixes = select_by_composition(tomo_prefixes, args.composition, args.composition_summary)
+        if args.particle_counts is not None:
+            tomo_prefixes = select_by_particle_counts(tomo_prefixes, args.particle_counts, tomolist)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
     
     if not tomo_prefixes:
         print("No tomogram prefixes found matching the criteria.", file=sys.stderr)
         sys.exit(1)
     
+    if args.shard is not None:
+        tomo_prefixes = [prefix for prefix in tomo_prefixes if shard_of(prefix, args.shard[1]) == args.shard[0]]
+        print(f"Shard {args.shard[0]}/{args.shard[1]}: {len(tomo_prefixes)} tomograms")
+
+    set_io_threads(args.io_threads)
+    if args.validate:
+        invalid = validate_tomograms(args.tomos_dir, tomo_prefixes)
+        tomo_prefixes = [prefix for prefix in tomo_prefixes if prefix not in invalid]
+        # A shard writes its partial output even if empty, for the merge to be complete
+        if not tomo_prefixes and args.shard is None:
+            print("No tomograms with valid tilt stacks left.", file=sys.stderr)
+            sys.exit(1)
+
+    if args.dry_run:
+        print_conversion_plan(plan_conversion(args.tomos_dir, args.output_dir, tomo_prefixes))
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
     print("Processing tomograms:")
     for prefix in tomo_prefixes:
         print(f"  {prefix}")
     
-    # Process each tomogram folder and collect data into a list
-    tomogram_data_list = []
-    for prefix in tomo_prefixes:
-        # Create softlinks for the current tomogram
-        try:
-            create_softlinks(args.tomos_dir, args.output_dir, prefix, args.ctf3d, args.cryocare)
-        except Exception as e:
-            print(f"Warning: Could not create softlinks for {prefix}: {e}")
-            continue
-        data = collect_tomogram_data(args.tomos_dir, prefix, tomolist, args.ctf3d, args.cryocare, cosine_weighting=args.cosine_weight)
-        if data is None:
-            print(f"Skipping tomogram {prefix} due to errors.")
-            continue
-        tomogram_data_list.append(data)
-        
-        # Create an individual tilt-series star file for this tomogram
-        create_individual_tilt_series_star(data, args.output_dir)
-
-        create_dummy_edf_file(args.output_dir, prefix)
-    
-    # Create a combined tomogram.star file (including all tomograms)
-    if tomogram_data_list:
-        create_combined_tomogram_star(tomogram_data_list, args.output_dir)
-    else:
-        print("No valid tomogram data was collected.", file=sys.stderr)
+    convert_tomograms(args, tomo_prefixes, tomolist, metadata_cache)
     
     print("Processing completed.")
 
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Selection of tomograms by their composition, from the dataset summary of the comprehensive
+segmentation of the Chlamy dataset (10.1101-2025.01.16.633326/summary.xlsx), which lists for
+each of the 1829 tomograms the share (in %) of its volume occupied by each of 25 segmented
+features (e.g. Mitochondrion, ATP synthase, RuBisCo, Pyrenoid).
+
+The spreadsheet is parsed once (without openpyxl: an .xlsx file is a zip of XML files) into a
+columnar table stored next to it (<file>.xlsx.npz), so that threshold queries such as
+
+    table = load_summary()
+    prefixes = table.select(["Mitochondrion>=5", "ATP synthase>=0.5"])
+
+take milliseconds. Tomograms are identified by their stack prefix (the tomogram name of the
+summary without its _bin2 suffix), as in tomolist_num_dir.star.
+"""
+import os
+import re
+import sys
+import zipfile
+import argparse
+import posixpath
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from cache import source_signature, write_cache
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUMMARY_XLSX = os.path.join(REPO_DIR, '10.1101-2025.01.16.633326', 'summary.xlsx')
+
+CACHE_SUFFIX = '.npz'
+CACHE_VERSION = 1
+
+# Suffix of the tomogram names of the summary (segmentations were done on bin 2 tomograms)
+TOMOGRAM_SUFFIX = '_bin2'
+
+XLSX_NS = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+XLSX_RELATIONSHIP_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+QUERY_PATTERN = re.compile(r'^\s*(.+?)\s*(>=|<=|==|>|<)\s*([-+0-9.eE]+)\s*$')
+QUERY_OPERATORS = {
+    '>=': np.greater_equal,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '<': np.less,
+    '==': np.equal,
+}
+
+def _column_index(cell_ref):
+    """0-based column of a cell reference (e.g. 'AB12' -> 27)."""
+    index = 0
+    for char in cell_ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord('A') + 1
+    return index - 1
+
+def _first_sheet_path(archive):
+    """Path in the archive of the first worksheet of the workbook."""
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find('main:sheets/main:sheet', XLSX_NS)
+    rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.findall('rel:Relationship', XLSX_NS):
+        if rel.get('Id') == sheet.get(XLSX_RELATIONSHIP_ID):
+            target = rel.get('Target')
+            return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    raise ValueError("No worksheet found in workbook")
+
+def read_xlsx_rows(xlsx_path):
+    """
+    Read the cells of the first worksheet of an .xlsx file.
+
+    Returns:
+        list of rows, each a list of cell values (str, float or None for empty cells)
+    """
+    with zipfile.ZipFile(xlsx_path) as archive:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in archive.namelist():
+            for item in ET.fromstring(archive.read('xl/sharedStrings.xml')).findall('main:si', XLSX_NS):
+                shared_strings.append(''.join(text.text or '' for text in item.iter(f"{{{XLSX_NS['main']}}}t")))
+        rows = []
+        with archive.open(_first_sheet_path(archive)) as f:
+            for _, element in ET.iterparse(f):
+                if element.tag != f"{{{XLSX_NS['main']}}}row":
+                    continue
+                row = []
+                for cell in element.findall('main:c', XLSX_NS):
+                    column = _column_index(cell.get('r')) if cell.get('r') else len(row)
+                    row.extend([None] * (column + 1 - len(row)))
+                    kind = cell.get('t')
+                    value = cell.find('main:v', XLSX_NS)
+                    if kind == 'inlineStr':
+                        row[column] = ''.join(text.text or '' for text in cell.iter(f"{{{XLSX_NS['main']}}}t"))
+                    elif value is None or value.text is None:
+                        continue
+                    elif kind == 's':
+                        row[column] = shared_strings[int(value.text)]
+                    elif kind in ('str', 'e'):
+                        row[column] = value.text
+                    else:
+                        row[column] = float(value.text)
+                rows.append(row)
+                element.clear()
+    return rows
+
+def read_summary_xlsx(xlsx_path=SUMMARY_XLSX):
+    """
+    Parse the dataset summary: a header row, then one row per tomogram with its name in the
+    first column and the share of each feature in the others.
+
+    Returns:
+        list of stack prefixes, list of feature names and the (tomograms x features) float array
+        (NaN for empty cells)
+    """
+    rows = read_xlsx_rows(xlsx_path)
+    if not rows:
+        raise ValueError(f"Empty summary: {xlsx_path}")
+    header = rows[0]
+    features = [str(name) for name in header[1:] if name is not None]
+    prefixes = []
+    values = np.full((len(rows) - 1, len(features)), np.nan)
+    for i, row in enumerate(rows[1:]):
+        name = str(row[0]) if row and row[0] is not None else ''
+        prefixes.append(name[:-len(TOMOGRAM_SUFFIX)] if name.endswith(TOMOGRAM_SUFFIX) else name)
+        for j, value in enumerate(row[1:len(features) + 1]):
+            if isinstance(value, float):
+                values[i, j] = value
+    keep = [i for i, prefix in enumerate(prefixes) if prefix]
+    return [prefixes[i] for i in keep], features, values[keep]
+
+class CompositionTable:
+    """
+    Columnar table of the composition of each tomogram, with one float column per feature.
+
+        table = load_summary()
+        table.column('Mitochondrion')                   # share of each tomogram, in table.prefixes order
+        table.select(['Mitochondrion>=5', 'ATP synthase>=0.5'])
+    """
+    def __init__(self, prefixes, features, values):
+        self.prefixes = np.asarray(prefixes, dtype=str)
+        self.features = list(features)
+        self.values = np.asarray(values, dtype=float)
+        self._feature_index = {name.lower(): i for i, name in enumerate(self.features)}
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def column(self, feature):
+        """Values of a feature (case-insensitive name) for all tomograms."""
+        try:
+            return self.values[:, self._feature_index[feature.strip().lower()]]
+        except KeyError:
+            raise ValueError(f"Unknown feature '{feature}', expected one of: {', '.join(self.features)}")
+
+    def mask(self, queries):
+        """
+        Tomograms matching all queries, each a threshold on a feature such as 'Mitochondrion>=5'
+        (operators >=, <=, >, < and ==). Tomograms without a value for a feature never match.
+        """
+        selected = np.ones(len(self), dtype=bool)
+        for query in queries:
+            match = QUERY_PATTERN.match(query)
+            if match is None:
+                raise ValueError(f"Invalid composition query '{query}', expected e.g. 'Mitochondrion>=5'")
+            feature, operator, threshold = match.groups()
+            selected &= QUERY_OPERATORS[operator](self.column(feature), float(threshold))
+        return selected
+
+    def select(self, queries):
+        """Stack prefixes of the tomograms matching all queries (see mask), in table order."""
+        return self.prefixes[self.mask(queries)].tolist()
+
+def save_summary_cache(table, cache_path, source):
+    """Store a composition table with the signature of its spreadsheet (see cache.source_signature)."""
+    np.savez(cache_path, version=CACHE_VERSION, source=np.array(source, dtype=np.int64),
+             prefixes=table.prefixes, features=np.asarray(table.features, dtype=str), values=table.values)
+
+def load_summary(xlsx_path=SUMMARY_XLSX, cache_path=None):
+    """
+    Load the composition table of a dataset summary from its cache, (re)building the cache
+    if missing or outdated (see cache.py).
+    """
+    cache_path = cache_path or xlsx_path + CACHE_SUFFIX
+    source = source_signature(xlsx_path)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            if int(cache['version']) == CACHE_VERSION and cache['source'].tolist() == source:
+                return CompositionTable(cache['prefixes'], cache['features'].tolist(), cache['values'])
+    table = CompositionTable(*read_summary_xlsx(xlsx_path))
+    # np.savez appends .npz to names without it
+    write_cache(cache_path, lambda path: save_summary_cache(table, path, source), cache_path + '.tmp.npz')
+    return table
+
+def main():
+    parser = argparse.ArgumentParser(description='Select tomograms by their composition in the dataset summary and print their stack prefixes, '
+                                                 'e.g. to pass them to chlamydataset2relion5.py --include.')
+    parser.add_argument('queries', type=str, nargs='*',
+                        help="Thresholds on the share (in %%) of features, all of which must hold, e.g. 'Mitochondrion>=5' 'ATP synthase>=0.5'")
+    parser.add_argument('--summary', type=str, default=SUMMARY_XLSX, help='Dataset summary spreadsheet (default: the summary.xlsx of this repository)')
+    parser.add_argument('--features', action='store_true', default=False, help='List the features of the summary with their median and maximum share')
+    parser.add_argument('--output', type=str, default=None, help='Write the selected prefixes to this file instead, one per line')
+    args = parser.parse_args()
+
+    table = load_summary(args.summary)
+    if args.features:
+        for feature in table.features:
+            column = table.column(feature)
+            print(f"{feature:<24} median {np.nanmedian(column):8.3f} %  max {np.nanmax(column):8.3f} %")
+        return
+    try:
+        prefixes = table.select(args.queries)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.writelines(f"{prefix}\n" for prefix in prefixes)
+        print(f"Selected {len(prefixes)} of {len(table)} tomograms, written to {args.output}")
+    else:
+        print("\n".join(prefixes))
+
+if __name__ == "__main__":
+    main()
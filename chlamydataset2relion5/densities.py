@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Access to the subtomogram averages deposited in this repository
+(e.g. 10.1126-science.ads8738/densities/*.mrc), used as templates and references.
+
+The MRC files are memory-mapped, so that volumes are zero-copy NumPy views of the files.
+Operations on several maps (resampling to a common pixel size and box size, normalization,
+pairwise cross-correlation) are batched, and the Fourier transforms they need are computed
+once per map and kept, so that preparing or comparing the same templates again does not
+re-read or re-transform them:
+
+    maps = DensityMaps.from_repository()
+    templates = maps.stack(pixel_size=7.84, box_size=64)       # (n, 64, 64, 64) float32
+    cc, shifts = maps.cross_correlation()
+"""
+import os
+import glob
+import argparse
+import numpy as np
+
+from chlamydataset2relion5 import MRC_HEADER_SIZE, read_mrc_header
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Folders of this repository holding subtomogram averages in MRC format
+DENSITY_DIRS = [
+    os.path.join(REPO_DIR, '10.1126-science.ads8738', 'densities'),
+]
+
+# NumPy types of the MRC modes that can be mapped directly (mode 101, 4-bit, cannot)
+MRC_MODE_DTYPES = {0: np.int8, 1: np.int16, 2: np.float32, 6: np.uint16, 12: np.float16}
+
+def find_densities(density_dirs=None):
+    """
+    Find the density maps of the repository.
+
+    Returns:
+        dict of map name (file name without extension, e.g. 'atpase') -> MRC file path
+    """
+    densities = {}
+    for density_dir in (density_dirs or DENSITY_DIRS):
+        for path in sorted(glob.glob(os.path.join(density_dir, '*.mrc'))):
+            densities[os.path.splitext(os.path.basename(path))[0]] = path
+    return densities
+
+def map_mrc(path):
+    """
+    Memory-map the data of an MRC file.
+
+    Returns:
+        read-only (nz, ny, nx) array backed by the file, and the header (see read_mrc_header)
+    """
+    header = read_mrc_header(path)
+    if header['mode'] not in MRC_MODE_DTYPES:
+        raise ValueError(f"MRC mode {header['mode']} of {path} cannot be memory-mapped")
+    if header['file_size'] < header['data_size']:
+        raise ValueError(f"Truncated MRC file {path}: {header['file_size']} bytes but header announces {header['data_size']}")
+    with open(path, 'rb') as f:
+        f.seek(212)
+        byteorder = '>' if f.read(1) == b'\x11' else '<'
+    dtype = np.dtype(MRC_MODE_DTYPES[header['mode']]).newbyteorder(byteorder)
+    volume = np.memmap(path, dtype=dtype, mode='r', offset=MRC_HEADER_SIZE + header['nsymbt'],
+                       shape=(header['nz'], header['ny'], header['nx']))
+    return volume, header
+
+def center_crop_or_pad(array, shape):
+    """
+    Crop or zero-pad an array to shape, keeping the element at index n // 2 of each axis (the
+    box center, or the zero frequency of an fftshift-ed spectrum) at index m // 2.
+    """
+    result = np.zeros(shape, dtype=array.dtype)
+    source, target = [], []
+    for n, m in zip(array.shape, shape):
+        offset = m // 2 - n // 2
+        source.append(slice(max(0, -offset), max(0, -offset) + min(n, m)))
+        target.append(slice(max(0, offset), max(0, offset) + min(n, m)))
+    result[tuple(target)] = array[tuple(source)]
+    return result
+
+def normalize_volume(volume, mask=None):
+    """Scale a volume to zero mean and unit standard deviation (computed inside mask, if given)."""
+    values = volume[mask] if mask is not None else volume
+    std = values.std()
+    return (volume - values.mean()) / (std if std > 0 else 1.0)
+
+class DensityMaps:
+    """
+    Memory-mapped density maps with cached Fourier transforms.
+
+    Volumes are (nz, ny, nx) arrays, as stored in the files. Resampled, normalized volumes and
+    their transforms are cached per map and sampling, so repeated calls with the same
+    pixel_size and box_size only compute what was not needed before.
+    """
+    def __init__(self, paths):
+        """
+        Args:
+            paths: dict of map name -> MRC file path
+        """
+        self.paths = dict(paths)
+        self._maps = {}
+        self._spectra = {}
+        self._prepared = {}
+        self._prepared_ffts = {}
+
+    @classmethod
+    def from_repository(cls, names=None):
+        """The density maps of this repository (optionally only some of them)."""
+        paths = find_densities()
+        if names is not None:
+            paths = {name: path for name, path in paths.items() if name in names}
+        return cls(paths)
+
+    @property
+    def names(self):
+        return list(self.paths)
+
+    def _map(self, name):
+        if name not in self._maps:
+            self._maps[name] = map_mrc(self.paths[name])
+        return self._maps[name]
+
+    def volume(self, name):
+        """Zero-copy view of the volume of a map, backed by its file."""
+        return self._map(name)[0]
+
+    def header(self, name):
+        return self._map(name)[1]
+
+    def pixel_size(self, name):
+        return self.header(name)['pixel_size']
+
+    def box_size(self, name):
+        return self.volume(name).shape
+
+    def common_sampling(self, names=None):
+        """
+        Sampling all maps can be brought to without losing information: the largest pixel size,
+        and the box size (even) holding the largest map at that pixel size.
+        """
+        names = names or self.names
+        pixel_size = max(self.pixel_size(name) for name in names)
+        extent = max(max(self.box_size(name)) * self.pixel_size(name) for name in names)
+        box_size = int(np.ceil(extent / pixel_size))
+        return pixel_size, box_size + box_size % 2
+
+    def sampling(self, names=None, pixel_size=None, box_size=None):
+        """
+        The given pixel size and box size, completed from common_sampling: by default the box
+        holds the largest map at the pixel size.
+        """
+        default_pixel_size, default_box_size = self.common_sampling(names)
+        if pixel_size is None:
+            pixel_size = default_pixel_size
+        if box_size is None:
+            box_size = int(np.ceil(default_box_size * default_pixel_size / pixel_size))
+        return pixel_size, box_size
+
+    def spectrum(self, name):
+        """Centered (fftshift-ed) Fourier transform of the original volume of a map, computed once."""
+        if name not in self._spectra:
+            self._spectra[name] = np.fft.fftshift(np.fft.fftn(np.asarray(self.volume(name), dtype=np.float32)))
+        return self._spectra[name]
+
+    def resample(self, name, pixel_size=None, box_size=None):
+        """
+        Resample a map to a pixel size by cropping or zero-padding its Fourier transform (so the
+        grid is rescaled by an integer number of voxels, and the actual pixel size may differ
+        slightly from the requested one), then crop or pad it to a cubic box size in real space.
+
+        Returns:
+            float32 volume and its actual pixel size
+        """
+        shape = np.array(self.box_size(name))
+        original_pixel_size = self.pixel_size(name)
+        if pixel_size is None or np.isclose(pixel_size, original_pixel_size):
+            volume, actual_pixel_size = np.asarray(self.volume(name), dtype=np.float32), original_pixel_size
+        else:
+            new_shape = tuple(int(n) for n in np.maximum(1, np.round(shape * original_pixel_size / pixel_size)))
+            spectrum = center_crop_or_pad(self.spectrum(name), new_shape)
+            volume = np.fft.ifftn(np.fft.ifftshift(spectrum)).real.astype(np.float32) * (np.prod(new_shape) / np.prod(shape))
+            actual_pixel_size = original_pixel_size * shape[0] / new_shape[0]
+        if box_size is not None:
+            volume = center_crop_or_pad(volume, (box_size,) * 3)
+        return volume, actual_pixel_size
+
+    def prepare(self, name, pixel_size=None, box_size=None, normalize=True, mask_radius=None):
+        """
+        A map resampled to pixel_size and box_size (see resample) and, with normalize, scaled to
+        zero mean and unit standard deviation (inside a sphere of mask_radius voxels, if given).
+        The result is cached, do not modify it in place.
+        """
+        key = (name, pixel_size, box_size, normalize, mask_radius)
+        if key not in self._prepared:
+            volume, _ = self.resample(name, pixel_size, box_size)
+            if normalize:
+                mask = None
+                if mask_radius is not None:
+                    grid = np.indices(volume.shape) - (np.array(volume.shape) // 2)[:, None, None, None]
+                    mask = (grid ** 2).sum(axis=0) <= mask_radius ** 2
+                volume = normalize_volume(volume, mask).astype(np.float32)
+            self._prepared[key] = volume
+        return self._prepared[key]
+
+    def stack(self, names=None, pixel_size=None, box_size=None, normalize=True, mask_radius=None):
+        """
+        Maps resampled to a common pixel size and box size (default: common_sampling), as one
+        (n, box_size, box_size, box_size) float32 array, in the order of names.
+        """
+        names = names or self.names
+        pixel_size, box_size = self.sampling(names, pixel_size, box_size)
+        return np.stack([self.prepare(name, pixel_size, box_size, normalize, mask_radius) for name in names])
+
+    def prepared_fft(self, name, pixel_size, box_size, mask_radius=None):
+        """Real-input Fourier transform of a normalized prepared map (see prepare), computed once."""
+        key = (name, pixel_size, box_size, mask_radius)
+        if key not in self._prepared_ffts:
+            self._prepared_ffts[key] = np.fft.rfftn(self.prepare(name, pixel_size, box_size, True, mask_radius))
+        return self._prepared_ffts[key]
+
+    def cross_correlation(self, names=None, pixel_size=None, box_size=None, mask_radius=None):
+        """
+        Pairwise normalized cross-correlation of maps over all translations, at a common
+        sampling (default: common_sampling), from their cached Fourier transforms. Rotations
+        are not searched, the maps are compared in their deposited orientation.
+
+        Returns:
+            (n, n) matrix of the maximum correlation coefficient of each pair (1 on the diagonal
+            for maps without a mask), and (n, n, 3) array of the (z, y, x) shift in voxels at
+            which it is reached, to apply to the map of the column to overlay it on the map of the row
+        """
+        names = names or self.names
+        pixel_size, box_size = self.sampling(names, pixel_size, box_size)
+        ffts = np.stack([self.prepared_fft(name, pixel_size, box_size, mask_radius) for name in names])
+        n_voxels = box_size ** 3
+        shape = (box_size,) * 3
+        cc = np.zeros((len(names), len(names)))
+        shifts = np.zeros((len(names), len(names), 3), dtype=int)
+        for i in range(len(names)):
+            # Correlate one map with all others (and itself) in a single batched inverse transform
+            correlation = np.fft.irfftn(ffts[i][None] * np.conj(ffts), s=shape, axes=(1, 2, 3)) / n_voxels
+            flat = correlation.reshape(len(names), -1)
+            best = flat.argmax(axis=1)
+            cc[i] = flat[np.arange(len(names)), best]
+            peaks = np.stack(np.unravel_index(best, shape), axis=1)
+            # Shifts beyond half the box wrap around to negative shifts
+            shifts[i] = np.where(peaks > box_size // 2, peaks - box_size, peaks)
+        return cc, shifts
+
+def main():
+    parser = argparse.ArgumentParser(description='List the density maps of this repository and compare them by pairwise cross-correlation '
+                                                 'at a common sampling.')
+    parser.add_argument('--maps', type=str, nargs='+', default=None, help='Only these maps, by file name (e.g. atpase hsp60)')
+    parser.add_argument('--pixel_size', type=float, default=None, help='Common pixel size in Angstrom (default: the largest pixel size)')
+    parser.add_argument('--box_size', type=int, default=None, help='Common box size in voxels (default: holding the largest map)')
+    args = parser.parse_args()
+
+    maps = DensityMaps.from_repository(args.maps)
+    if not maps.names:
+        print("No density maps found.")
+        return
+    for name in maps.names:
+        header = maps.header(name)
+        print(f"{name}: {header['nx']} x {header['ny']} x {header['nz']} voxels, {header['pixel_size']:.3f} A/voxel ({maps.paths[name]})")
+    pixel_size, box_size = maps.sampling(pixel_size=args.pixel_size, box_size=args.box_size)
+    cc, _ = maps.cross_correlation(pixel_size=pixel_size, box_size=box_size)
+    print(f"\nCross-correlation at {pixel_size:.3f} A/voxel, box size {box_size}:")
+    width = max(len(name) for name in maps.names)
+    print(" " * width + "".join(f" {name:>{width}}" for name in maps.names))
+    for name, row in zip(maps.names, cc):
+        print(f"{name:<{width}}" + "".join(f" {value:>{width}.3f}" for value in row))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Per-tomogram statistics of the particle annotations of the Chlamy dataset, across all
+annotation STAR files of the repository (rubisco.star, nucleosome.star, atpase.star, ...).
+
+For each species and tomogram, the table holds the particle count, the bounding box of the
+coordinates (unbinned pixels) and a summary of the orientations, keyed by both the tomogram
+name of the annotations (tomo_NNNN) and the stack prefix of tomolist_num_dir.star. It is
+built once and cached (particle_stats.npz); only species whose STAR file changed since are
+recomputed, so that queries such as
+
+    stats = load_particle_stats()
+    prefixes = stats.select(["respirasome>=100", "mitoribosome>=1"])
+
+are instant instead of parsing all annotation files and grouping the particles again.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import numpy as np
+
+from cache import source_signature, write_cache
+from annotations import find_annotation_stars
+from composition import QUERY_PATTERN, QUERY_OPERATORS
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOMOLIST_STAR = os.path.join(SCRIPT_DIR, 'tomolist_num_dir.star')
+PARTICLE_STATS_CACHE = os.path.join(SCRIPT_DIR, 'particle_stats.npz')
+CACHE_VERSION = 1
+
+STAT_COLUMNS = ['count', 'x_min', 'x_max', 'y_min', 'y_max', 'z_min', 'z_max', 'tilt_mean', 'alignment']
+
+def tomo_num_of_name(tomo_name):
+    """tomo_num of an annotation tomogram name (e.g. 'tomo_0022' -> 22), or None."""
+    match = re.search(r'(\d+)$', tomo_name)
+    return int(match.group(1)) if match else None
+
+def species_stats(star_path):
+    """
+    Group the particles of an annotation STAR file by tomogram.
+
+    Returns:
+        dict with the tomogram names and, per tomogram, the columns of STAT_COLUMNS: the
+        particle count, the bounding box of the coordinates and, from the Euler angles, the mean
+        tilt angle and the alignment of the particle z axes (length of their mean unit vector:
+        1 if all particles point the same way, close to 0 for random orientations)
+    """
+    from annotations import read_annotation_star
+    particles = read_annotation_star(star_path)
+    names, codes = np.unique(particles['rlnTomoName'].to_numpy(dtype=str), return_inverse=True)
+    counts = np.bincount(codes, minlength=len(names))
+    stats = {'tomo_name': names, 'count': counts}
+
+    # Sort once by tomogram, so that min/max are taken over contiguous segments
+    order = np.argsort(codes, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    for axis in 'XYZ':
+        coordinates = particles[f'rlnCoordinate{axis}'].to_numpy(dtype=float)[order]
+        stats[f'{axis.lower()}_min'] = np.minimum.reduceat(coordinates, starts) if len(names) else np.zeros(0)
+        stats[f'{axis.lower()}_max'] = np.maximum.reduceat(coordinates, starts) if len(names) else np.zeros(0)
+
+    rot = np.radians(particles['rlnAngleRot'].to_numpy(dtype=float))
+    tilt = np.radians(particles['rlnAngleTilt'].to_numpy(dtype=float))
+    directions = np.column_stack((np.cos(rot) * np.sin(tilt), np.sin(rot) * np.sin(tilt), np.cos(tilt)))
+    mean_direction = np.column_stack([np.bincount(codes, weights=directions[:, i], minlength=len(names)) for i in range(3)]) / counts[:, None]
+    stats['tilt_mean'] = np.degrees(np.bincount(codes, weights=tilt, minlength=len(names)) / counts)
+    stats['alignment'] = np.linalg.norm(mean_direction, axis=1)
+    return stats
+
+def _source_signature(path):
+    return [os.path.abspath(path)] + source_signature(path)
+
+class ParticleStats:
+    """
+    Per-tomogram particle statistics, one row per species and tomogram with particles, as
+    columns of arrays: species, tomo_name (tomo_NNNN), prefix (stack prefix, '' if not in the
+    correspondence table) and those of STAT_COLUMNS.
+
+        stats = load_particle_stats()
+        stats.counts()                          # tomograms x species count matrix
+        stats.select(['rubisco>=100'])          # stack prefixes, e.g. for --include
+    """
+    def __init__(self, columns, sources):
+        self.columns = columns
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.columns['species'])
+
+    @property
+    def species(self):
+        return list(self.sources)
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns)
+
+    def counts(self, key='prefix'):
+        """
+        Particle counts of each tomogram (by stack prefix, or by tomo_name with key='tomo_name')
+        and species.
+
+        Returns:
+            list of tomograms, list of species and the (tomograms x species) count matrix
+        """
+        tomograms, rows = np.unique(self.columns[key], return_inverse=True)
+        species = self.species
+        species_index = {name: i for i, name in enumerate(species)}
+        matrix = np.zeros((len(tomograms), len(species)), dtype=np.int64)
+        matrix[rows, [species_index[name] for name in self.columns['species']]] = self.columns['count']
+        keep = tomograms != ''
+        return tomograms[keep].tolist(), species, matrix[keep]
+
+    def select(self, queries, key='prefix'):
+        """
+        Tomograms (stack prefixes, or tomo_names with key='tomo_name') matching all queries, each
+        a threshold on the particle count of a species, e.g. 'atpase>=20' or 'rubisco==0'.
+        Tomograms without particles of any species are not part of the table and never match.
+        """
+        tomograms, species, matrix = self.counts(key)
+        selected = np.ones(len(tomograms), dtype=bool)
+        for query in queries:
+            match = QUERY_PATTERN.match(query)
+            if match is None:
+                raise ValueError(f"Invalid particle query '{query}', expected e.g. 'atpase>=20'")
+            name, operator, threshold = match.groups()
+            if name not in species:
+                raise ValueError(f"Unknown species '{name}', expected one of: {', '.join(species)}")
+            selected &= QUERY_OPERATORS[operator](matrix[:, species.index(name)], float(threshold))
+        return [tomogram for tomogram, ok in zip(tomograms, selected) if ok]
+
+def load_particle_stats(star_files=None, correspondence_star=TOMOLIST_STAR, cache_path=PARTICLE_STATS_CACHE, tomolist=None):
+    """
+    Load the particle statistics of the annotation STAR files (default: all annotation STAR
+    files of this repository) from the cache, recomputing the species whose STAR file changed
+    (size or modification time) since it was written (see cache.py). The cache only holds
+    tomo_NNNN names: stack prefixes are looked up on every load, in tomolist (dict of
+    stack_dir -> tomo_num) if given, else in the correspondence_star file.
+    """
+    from chlamydataset2relion5 import read_star_loop, tomolist_mapping
+    star_files = star_files or find_annotation_stars()
+    sources = {species: _source_signature(path) for species, path in star_files.items()}
+
+    cached = {}
+    cached_species = set()
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            header = json.loads(str(cache['header']))
+            if header['version'] == CACHE_VERSION:
+                cached_species = set(header['sources'])
+                for species, signature in header['sources'].items():
+                    if sources.get(species) == signature:
+                        cached[species] = {column: cache[f'{species}/{column}'] for column in ['tomo_name'] + STAT_COLUMNS}
+
+    changed = [species for species in star_files if species not in cached]
+    for species in changed:
+        # Progress goes to stderr, stdout may be a list of prefixes
+        print(f"Computing particle statistics of {species} ({star_files[species]})", file=sys.stderr)
+        cached[species] = species_stats(star_files[species])
+
+    if tomolist is None:
+        tomolist = tomolist_mapping(read_star_loop(correspondence_star))
+    prefix_of_num = {num: prefix for prefix, num in tomolist.items()}
+    per_species = [cached[species] for species in star_files]
+    columns = {
+        'species': np.concatenate([np.full(len(stats['tomo_name']), species) for species, stats in zip(star_files, per_species)]),
+        'tomo_name': np.concatenate([stats['tomo_name'] for stats in per_species]),
+    }
+    columns['prefix'] = np.array([prefix_of_num.get(tomo_num_of_name(name), '') for name in columns['tomo_name']], dtype=str)
+    for column in STAT_COLUMNS:
+        columns[column] = np.concatenate([stats[column] for stats in per_species])
+
+    if changed or cached_species != set(sources):
+        header = {'version': CACHE_VERSION, 'sources': sources}
+        arrays = {f'{species}/{column}': cached[species][column] for species in star_files for column in ['tomo_name'] + STAT_COLUMNS}
+        # np.savez appends .npz to names without it
+        write_cache(cache_path, lambda path: np.savez(path, header=json.dumps(header), **arrays), cache_path + '.tmp.npz')
+    return ParticleStats(columns, sources)
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-tomogram particle counts of the annotation STAR files: print the stack prefixes of the '
+                                                 'tomograms matching count thresholds (e.g. for chlamydataset2relion5.py --include), or a summary table.')
+    parser.add_argument('queries', type=str, nargs='*', help="Thresholds on the particle counts, all of which must hold, e.g. 'atpase>=20' 'rubisco>=100'")
+    parser.add_argument('--correspondence_star', type=str, default=TOMOLIST_STAR,
+                        help='STAR file with correspondence between tomo_num and stack_dir (default: tomolist_num_dir.star of this folder)')
+    parser.add_argument('--cache', type=str, default=PARTICLE_STATS_CACHE, help=f'Path of the statistics cache (default: {PARTICLE_STATS_CACHE})')
+    parser.add_argument('--tomo_names', action='store_true', default=False, help='Print tomo_NNNN names instead of stack prefixes')
+    parser.add_argument('--table', action='store_true', default=False, help='Print the count of each species in the selected tomograms')
+    parser.add_argument('--output', type=str, default=None, help='Write the selected tomograms to this file instead, one per line')
+    args = parser.parse_args()
+
+    stats = load_particle_stats(correspondence_star=args.correspondence_star, cache_path=args.cache)
+    key = 'tomo_name' if args.tomo_names else 'prefix'
+    try:
+        selected = stats.select(args.queries, key)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.table:
+        tomograms, species, matrix = stats.counts(key)
+        rows = {tomogram: row for tomogram, row in zip(tomograms, matrix)}
+        print("\t".join(['tomogram'] + species))
+        for tomogram in selected:
+            print("\t".join([tomogram] + [str(count) for count in rows[tomogram]]))
+    elif args.output is not None:
+        with open(args.output, 'w') as f:
+            f.writelines(f"{tomogram}\n" for tomogram in selected)
+        print(f"Selected {len(selected)} tomograms, written to {args.output}")
+    else:
+        print("\n".join(selected))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Spatial queries over the particle annotations of the Chlamy dataset.
+
+One KD-tree is built per species and tomogram (_rlnTomoName) from the annotated coordinates,
+in Angstrom, so that neighbourhood questions (e.g. ATP synthase within 30 nm of a respirasome,
+duplicate picks, neighbour counts per species) are answered in O(n log n) instead of
+comparing all pairs of particles.
+
+Requires scipy (pip install scipy).
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from annotations import AnnotationStar, find_annotation_stars
+
+PIXEL_SIZE = 1.96
+
+class SpatialIndex:
+    """
+    KD-trees over the particles of several species, one per species and tomogram.
+
+    Particles are identified by their row number in their species' STAR file (0-based, in
+    file order, as in the DataFrame returned by starfile.read). Trees are built on first use.
+
+        index = SpatialIndex.from_repository()
+        pairs = index.pairs_within('atpase', 'respirasome', radius=300.0)
+    """
+    def __init__(self, star_files, pixel_size=PIXEL_SIZE):
+        """
+        Args:
+            star_files: dict of species name -> annotation STAR file path
+            pixel_size: pixel size of the annotated coordinates, in Angstrom
+        """
+        self.pixel_size = pixel_size
+        self.stars = {species: AnnotationStar(path) for species, path in star_files.items()}
+        self._trees = {}
+
+    @classmethod
+    def from_repository(cls, species=None, pixel_size=PIXEL_SIZE):
+        """Index the annotation STAR files of this repository (optionally only some species)."""
+        star_files = find_annotation_stars()
+        if species is not None:
+            star_files = {name: path for name, path in star_files.items() if name in species}
+        return cls(star_files, pixel_size)
+
+    def close(self):
+        for star in self.stars.values():
+            star.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def species(self):
+        return list(self.stars)
+
+    def tomo_names(self, *species):
+        """Tomograms with particles of all the given species (of any species if none given)."""
+        names = [set(self.stars[s].tomo_names) for s in (species or self.species)]
+        common = set.intersection(*names) if species else set.union(*names)
+        return sorted(common)
+
+    def tree(self, species, tomo_name):
+        """
+        KD-tree over the particles of a species in a tomogram.
+
+        Returns:
+            the cKDTree (coordinates in Angstrom) and the row numbers of its points
+        """
+        key = (species, tomo_name)
+        if key not in self._trees:
+            star = self.stars[species]
+            particles = star.read_tomo(tomo_name)
+            coords = particles[['rlnCoordinateX', 'rlnCoordinateY', 'rlnCoordinateZ']].to_numpy(dtype=float) * self.pixel_size
+            self._trees[key] = (cKDTree(coords.reshape(-1, 3)), star.row_numbers(tomo_name))
+        return self._trees[key]
+
+    def pairs_within(self, query_species, target_species, radius, tomo_names=None):
+        """
+        All pairs of a query and a target particle closer than radius (Angstrom), tomogram
+        by tomogram. For query_species == target_species, each pair is reported once and a
+        particle is not paired with itself.
+
+        Returns:
+            DataFrame with rlnTomoName, query_row, target_row and distance (Angstrom)
+        """
+        same = query_species == target_species
+        tables = []
+        for tomo_name in (tomo_names or self.tomo_names(query_species, target_species)):
+            query_tree, query_rows = self.tree(query_species, tomo_name)
+            target_tree, target_rows = self.tree(target_species, tomo_name)
+            if same:
+                ij = query_tree.query_pairs(radius, output_type='ndarray')
+                i, j = ij[:, 0], ij[:, 1]
+                distance = np.linalg.norm(query_tree.data[i] - query_tree.data[j], axis=1)
+            else:
+                sparse = query_tree.sparse_distance_matrix(target_tree, radius, output_type='ndarray')
+                i, j, distance = sparse['i'], sparse['j'], sparse['v']
+            tables.append(pd.DataFrame({
+                'rlnTomoName': tomo_name,
+                'query_row': query_rows[i],
+                'target_row': target_rows[j],
+                'distance': distance,
+            }))
+        if not tables:
+            return pd.DataFrame({'rlnTomoName': [], 'query_row': [], 'target_row': [], 'distance': []})
+        return pd.concat(tables, ignore_index=True).sort_values(['query_row', 'distance'], ignore_index=True)
+
+    def count_within(self, query_species, target_species, radius, tomo_names=None):
+        """
+        Number of target particles closer than radius (Angstrom) to each query particle
+        (itself not included when both species are the same).
+
+        Returns:
+            DataFrame with rlnTomoName, query_row and count, for all query particles
+        """
+        tables = []
+        for tomo_name in (tomo_names or self.stars[query_species].tomo_names):
+            query_tree, query_rows = self.tree(query_species, tomo_name)
+            if tomo_name in self.stars[target_species].index['tomos']:
+                target_tree, _ = self.tree(target_species, tomo_name)
+                counts = np.array([len(n) for n in target_tree.query_ball_point(query_tree.data, radius)], dtype=int)
+                if query_species == target_species:
+                    counts -= 1
+            else:
+                counts = np.zeros(len(query_rows), dtype=int)
+            tables.append(pd.DataFrame({'rlnTomoName': tomo_name, 'query_row': query_rows, 'count': counts}))
+        return pd.concat(tables, ignore_index=True)
+
+    def nearest(self, query_species, target_species, k=1, tomo_names=None, max_distance=np.inf):
+        """
+        k nearest target particles of each query particle (excluding itself when both species
+        are the same). Missing neighbours (fewer than k targets within max_distance) have
+        target_row -1 and infinite distance.
+
+        Returns:
+            DataFrame with rlnTomoName, query_row, k (1-based rank), target_row and distance
+        """
+        same = query_species == target_species
+        tables = []
+        for tomo_name in (tomo_names or self.stars[query_species].tomo_names):
+            query_tree, query_rows = self.tree(query_species, tomo_name)
+            n_query = len(query_rows)
+            if tomo_name in self.stars[target_species].index['tomos']:
+                target_tree, target_rows = self.tree(target_species, tomo_name)
+                kk = k + 1 if same else k
+                distance, j = target_tree.query(query_tree.data, k=kk, distance_upper_bound=max_distance)
+                distance, j = distance.reshape(n_query, kk), j.reshape(n_query, kk)
+                if same:
+                    # Drop each particle itself, which need not come first when picks coincide,
+                    # or the last neighbour if more than k coincident picks pushed it out
+                    is_self = j == np.arange(n_query)[:, None]
+                    is_self[~is_self.any(axis=1), -1] = True
+                    distance, j = distance[~is_self].reshape(n_query, k), j[~is_self].reshape(n_query, k)
+                found = j < target_tree.n
+                target = np.where(found, target_rows[np.minimum(j, target_tree.n - 1)], -1)
+            else:
+                distance = np.full((n_query, k), np.inf)
+                target = np.full((n_query, k), -1)
+            tables.append(pd.DataFrame({
+                'rlnTomoName': tomo_name,
+                'query_row': np.repeat(query_rows, k),
+                'k': np.tile(np.arange(1, k + 1), n_query),
+                'target_row': target.ravel(),
+                'distance': distance.ravel(),
+            }))
+        return pd.concat(tables, ignore_index=True)
+
+    def remove_duplicates(self, species, radius, tomo_names=None):
+        """
+        Find duplicate picks: going through the particles in file order, a particle is dropped
+        if a particle kept before it lies closer than radius (Angstrom).
+
+        Returns:
+            sorted array of the row numbers of the particles to keep
+        """
+        keep = []
+        for tomo_name in (tomo_names or self.stars[species].tomo_names):
+            tree, rows = self.tree(species, tomo_name)
+            pairs = tree.query_pairs(radius, output_type='ndarray')
+            if len(pairs) == 0:
+                keep.append(rows)
+                continue
+            # Neighbours of each point that come earlier in file order
+            first = np.where(rows[pairs[:, 0]] < rows[pairs[:, 1]], pairs[:, 0], pairs[:, 1])
+            second = np.where(rows[pairs[:, 0]] < rows[pairs[:, 1]], pairs[:, 1], pairs[:, 0])
+            earlier = pd.Series(first).groupby(second).agg(list).to_dict()
+            kept = np.ones(len(rows), dtype=bool)
+            for point in np.argsort(rows, kind='stable'):
+                if any(kept[other] for other in earlier.get(point, ())):
+                    kept[point] = False
+            keep.append(rows[kept])
+        return np.sort(np.concatenate(keep)) if keep else np.zeros(0, dtype=int)
+
+def main():
+    parser = argparse.ArgumentParser(description='Count, per tomogram, the query particles having target particles within a radius.')
+    parser.add_argument('--query', type=str, required=True, help='Query species (annotation STAR file name, e.g. atpase)')
+    parser.add_argument('--target', type=str, required=True, help='Target species (e.g. respirasome)')
+    parser.add_argument('--radius', type=float, required=True, help='Radius in Angstrom (e.g. 300 for 30 nm)')
+    args = parser.parse_args()
+
+    with SpatialIndex.from_repository([args.query, args.target]) as index:
+        counts = index.count_within(args.query, args.target, args.radius)
+    summary = counts.groupby('rlnTomoName')['count'].agg(particles='size', with_neighbours=lambda c: int((c > 0).sum()))
+    print(summary.to_string())
+    print(f"{int((counts['count'] > 0).sum())} of {len(counts)} {args.query} particles have {args.target} within {args.radius} A")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+# The scripts are not a package, import them from their folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import generate_tree, TREE_DIRNAME, CORRESPONDENCE_FILENAME
+
+@pytest.fixture(scope='session')
+def synthetic_tree(tmp_path_factory):
+    """A small synthetic tilt-series tree (see benchmark.generate_tree): tomos_dir and correspondence STAR file."""
+    root = str(tmp_path_factory.mktemp('tree'))
+    generate_tree(root, n_tomograms=12, n_tilts=9)
+    return os.path.join(root, TREE_DIRNAME), os.path.join(root, CORRESPONDENCE_FILENAME)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from annotations import AnnotationStar, parse_star_rows, read_annotation_star
+
+STAR = """# Created by the starfile Python package
+
+data_
+
+loop_
+_rlnCoordinateX #1
+_rlnClassNumber #2
+_rlnTomoName #3
+1.5\t3\ttomo_0002
+# a comment between rows
+2.0\t4\ttomo_0002
+nan\t1\ttomo_0010
+"""
+
+def test_parse_star_rows_types():
+    columns = parse_star_rows(b"1.5 3 tomo_0002\n2 4 tomo_0002\n", ['x', 'n', 'name'])
+    assert columns['x'].dtype == np.float64 and columns['x'].tolist() == [1.5, 2.0]
+    assert columns['n'].dtype == np.int64 and columns['n'].tolist() == [3, 4]
+    assert columns['name'].dtype == object and columns['name'].tolist() == ['tomo_0002', 'tomo_0002']
+    # A column is only int if all of its values are
+    assert parse_star_rows(b"1\n2.5\n", ['x'])['x'].tolist() == [1.0, 2.5]
+    assert len(parse_star_rows(b"\n", ['x', 'y'])['y']) == 0
+    with pytest.raises(ValueError, match='do not fill rows'):
+        parse_star_rows(b"1 2\n3\n", ['x', 'y'])
+
+def test_whole_file_and_indexed_reads_agree(tmp_path):
+    star_path = str(tmp_path / 'species.star')
+    with open(star_path, 'w') as f:
+        f.write(STAR)
+    particles = read_annotation_star(star_path)
+    assert list(particles.columns) == ['rlnCoordinateX', 'rlnClassNumber', 'rlnTomoName']
+    assert particles['rlnClassNumber'].tolist() == [3, 4, 1]
+    assert np.isnan(particles['rlnCoordinateX'][2])
+    with AnnotationStar(star_path) as star:
+        assert star.tomo_names == ['tomo_0002', 'tomo_0010']
+        assert star.read_tomo('tomo_0002')['rlnCoordinateX'].tolist() == [1.5, 2.0]
+        assert star.read_tomos(star.tomo_names).equals(particles)
+        assert list(star.read_tomo('tomo_9999').columns) == list(particles.columns)
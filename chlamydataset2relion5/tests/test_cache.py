@@ -0,0 +1,36 @@
+import os
+
+from cache import source_signature, write_cache
+from annotations import AnnotationStar
+
+def test_write_cache_replaces_atomically(tmp_path):
+    cache_path = str(tmp_path / 'data.cache')
+
+    def write(path):
+        assert not os.path.exists(cache_path) or open(cache_path).read() == 'old'
+        with open(path, 'w') as f:
+            f.write('new')
+    with open(cache_path, 'w') as f:
+        f.write('old')
+    assert write_cache(cache_path, write)
+    assert open(cache_path).read() == 'new' and os.listdir(tmp_path) == ['data.cache']
+
+def test_unwritable_cache_only_warns(tmp_path, capsys):
+    star_path = tmp_path / 'species.star'
+    star_path.write_text("data_\n\nloop_\n_rlnCoordinateX #1\n_rlnTomoName #2\n1.0 tomo_0001\n2.0 tomo_0002\n")
+    index_path = str(tmp_path / 'missing_folder' / 'species.star.idx')
+    with AnnotationStar(str(star_path), index_path=index_path) as star:
+        assert star.tomo_names == ['tomo_0001', 'tomo_0002']
+    captured = capsys.readouterr()
+    assert captured.out == '' and f"Could not write cache {index_path}" in captured.err
+    assert not write_cache(index_path, lambda path: open(path, 'w').close())
+
+def test_source_signature_follows_changes(tmp_path):
+    path = tmp_path / 'source'
+    path.write_text('a')
+    signature = source_signature(str(path))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert source_signature(str(path)) != signature
+    path.write_text('ab')
+    assert source_signature(str(path))[0] == 2
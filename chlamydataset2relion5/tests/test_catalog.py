@@ -0,0 +1,41 @@
+import os
+import shutil
+import pytest
+
+from chlamydataset2relion5 import (build_catalog, query_catalog, catalog_known_paths, filter_prefixes, probe_paths,
+                                   set_known_paths, tomogram_input_files)
+
+@pytest.mark.parametrize('include, exclude', [
+    (None, None),
+    (['*lam1*'], None),
+    (['*_pos[34]', '*lam2_pos1*'], None),
+    (['*LAM1*'], None),
+    (None, ['*pos1?', '01122021_BrnoKrios_arctis_lam1_pos3']),
+])
+def test_catalog_selects_like_directory_scan(synthetic_tree, tmp_path, include, exclude):
+    tomos_dir, correspondence_star = synthetic_tree
+    catalog_path = build_catalog(tomos_dir, correspondence_star, str(tmp_path / 'catalog.sqlite'))
+    _, selected, _ = query_catalog(catalog_path, include, exclude)
+    assert selected == filter_prefixes(sorted(os.listdir(tomos_dir)), include, exclude)
+
+def test_catalog_skips_incomplete_and_answers_probes(synthetic_tree, tmp_path):
+    tomos_dir, correspondence_star = synthetic_tree
+    tree_copy = str(tmp_path / 'tree')
+    shutil.copytree(tomos_dir, tree_copy)
+    prefixes = sorted(os.listdir(tree_copy))
+    tlt, xf = tomogram_input_files(tree_copy, prefixes[0])[:2]
+    os.remove(os.path.join(tree_copy, prefixes[0], xf))
+    catalog_path = build_catalog(tree_copy, correspondence_star, str(tmp_path / 'catalog.sqlite'))
+    _, selected, tomo_nums = query_catalog(catalog_path)
+    assert selected == prefixes[1:]
+    assert set(tomo_nums) == set(selected)
+
+    # Probes are answered from the catalog, even once the files are gone
+    known_paths = catalog_known_paths(catalog_path, prefixes)
+    shutil.rmtree(tree_copy)
+    set_known_paths(known_paths)
+    try:
+        paths = [os.path.join(tree_copy, prefixes[0], rel) for rel in (tlt, xf)]
+        assert probe_paths(paths) == [True, False]
+    finally:
+        set_known_paths(None)
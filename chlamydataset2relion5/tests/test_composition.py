@@ -0,0 +1,94 @@
+import os
+import zipfile
+import numpy as np
+import pytest
+
+import composition
+from composition import read_xlsx_rows, read_summary_xlsx, load_summary
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+          xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="summary" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>"""
+
+SHARED_STRINGS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<si><t>Tomogram</t></si>
+<si><t>Mitochondrion</t></si>
+<si><r><t>ATP </t></r><r><t>synthase</t></r></si>
+<si><t>Position_1_bin2</t></si>
+<si><t>Position_2_bin2</t></si>
+</sst>"""
+
+# Position_2 has no Mitochondrion cell at all, Position_3 (an inline string) an empty ATP synthase cell
+SHEET = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetData>
+<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>2</v></c></row>
+<row r="2"><c r="A2" t="s"><v>3</v></c><c r="B2"><v>6.5</v></c><c r="C2"><v>0.25</v></c></row>
+<row r="3"><c r="A3" t="s"><v>4</v></c><c r="C3"><v>1e-1</v></c></row>
+<row r="4"><c r="A4" t="inlineStr"><is><t>Position_3</t></is></c><c r="B4"><v>2</v></c><c r="C4"/></row>
+<row r="5"/>
+</sheetData>
+</worksheet>"""
+
+@pytest.fixture
+def summary_xlsx(tmp_path):
+    path = str(tmp_path / 'summary.xlsx')
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('xl/workbook.xml', WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        archive.writestr('xl/sharedStrings.xml', SHARED_STRINGS)
+        archive.writestr('xl/worksheets/sheet1.xml', SHEET)
+    return path
+
+def test_read_xlsx_rows(summary_xlsx):
+    assert read_xlsx_rows(summary_xlsx) == [
+        ['Tomogram', 'Mitochondrion', 'ATP synthase'],
+        ['Position_1_bin2', 6.5, 0.25],
+        ['Position_2_bin2', None, 0.1],
+        ['Position_3', 2.0, None],
+        [],
+    ]
+
+def test_read_summary_xlsx(summary_xlsx):
+    prefixes, features, values = read_summary_xlsx(summary_xlsx)
+    assert prefixes == ['Position_1', 'Position_2', 'Position_3']
+    assert features == ['Mitochondrion', 'ATP synthase']
+    np.testing.assert_array_equal(values, [[6.5, 0.25], [np.nan, 0.1], [2.0, np.nan]])
+
+def test_load_summary_cache(summary_xlsx):
+    table = load_summary(summary_xlsx)
+    assert os.path.exists(summary_xlsx + '.npz')
+    # Empty cells never match
+    assert table.select(['mitochondrion>=2']) == ['Position_1', 'Position_3']
+    assert table.select(['Mitochondrion<100', 'ATP synthase>0']) == ['Position_1']
+
+    cached = load_summary(summary_xlsx)
+    assert cached.prefixes.tolist() == table.prefixes.tolist() and cached.features == table.features
+    np.testing.assert_array_equal(cached.values, table.values)
+    with pytest.raises(ValueError, match='Unknown feature'):
+        cached.select(['Ribosome>1'])
+
+def test_cache_is_rebuilt_when_the_summary_changes(summary_xlsx, monkeypatch):
+    load_summary(summary_xlsx)
+    read_summary = composition.read_summary_xlsx
+
+    def not_parsed(path):
+        raise AssertionError("the summary was parsed again")
+    monkeypatch.setattr(composition, 'read_summary_xlsx', not_parsed)
+    assert len(load_summary(summary_xlsx)) == 3
+
+    st = os.stat(summary_xlsx)
+    os.utime(summary_xlsx, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    parsed = []
+    monkeypatch.setattr(composition, 'read_summary_xlsx', lambda path: parsed.append(path) or read_summary(path))
+    assert len(load_summary(summary_xlsx)) == 3
+    assert parsed == [summary_xlsx]
@@ -0,0 +1,81 @@
+import os
+import threading
+import numpy as np
+import pytest
+
+import chlamydataset2relion5 as converter_module
+from chlamydataset2relion5 import TomogramConverter, read_star_loop, tomolist_mapping
+
+def test_convert_many_leaves_stdout_of_other_threads_alone(synthetic_tree, tmp_path, capsys):
+    tomos_dir, correspondence_star = synthetic_tree
+    prefixes = sorted(os.listdir(tomos_dir))
+    converter = TomogramConverter(tomos_dir, correspondence_star, output_dir=str(tmp_path))
+    done = threading.Event()
+
+    def other_thread():
+        n = 0
+        while not done.is_set() or n == 0:
+            print("other thread")
+            n += 1
+        print(f"printed {n}")
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    try:
+        converted = [prefix for prefix, _, _ in converter.convert_many(prefixes, threads=4, star=True)]
+    finally:
+        done.set()
+        thread.join()
+    assert converted == prefixes
+    out = capsys.readouterr().out
+    n = int(out.rsplit("printed ", 1)[1])
+    # All messages of the other thread made it, none of the (quiet) converter's
+    assert out.count("other thread") == n
+    assert "Found" not in out and "Created" not in out
+
+def test_convert_tables_match_written_star_files(synthetic_tree, tmp_path):
+    tomos_dir, correspondence_star = synthetic_tree
+    prefix = sorted(os.listdir(tomos_dir))[0]
+    converter = TomogramConverter(tomos_dir, correspondence_star, output_dir=str(tmp_path))
+    record, table = converter.convert(prefix, star=True)
+    written = read_star_loop(str(tmp_path / f"{prefix}.star"), prefix)
+    assert set(table) == set(written)
+    for label, values in table.items():
+        if np.asarray(values).dtype.kind in 'fi':
+            np.testing.assert_allclose(np.asarray(values, dtype=float), np.asarray(written[label], dtype=float), atol=1e-6)
+        else:
+            assert list(map(str, values)) == list(map(str, written[label]))
+
+def test_errors_keep_their_original_exception(synthetic_tree, tmp_path, capsys):
+    tomos_dir, correspondence_star = synthetic_tree
+    prefixes = sorted(os.listdir(tomos_dir))[:2]
+    tomolist = dict(tomolist_mapping(read_star_loop(correspondence_star)), missing_tomogram=9999)
+    converter = TomogramConverter(tomos_dir, tomolist=tomolist, output_dir=str(tmp_path))
+    with pytest.raises(FileNotFoundError, match='Required files not found'):
+        converter.collect('missing_tomogram')
+    with pytest.raises(FileNotFoundError):
+        list(converter.convert_many(prefixes + ['missing_tomogram'], threads=2, skip_errors=False))
+    converted = [prefix for prefix, _, _ in converter.convert_many(prefixes + ['missing_tomogram'], threads=2)]
+    assert converted == prefixes
+    assert "Skipping tomogram missing_tomogram: FileNotFoundError: Required files not found" in capsys.readouterr().out
+
+def test_metadata_files_are_only_probed_once(synthetic_tree, monkeypatch):
+    tomos_dir, _ = synthetic_tree
+    prefix = sorted(os.listdir(tomos_dir))[0]
+    probed, checked = [], []
+
+    def probe_concurrently(paths, probe):
+        probed.extend(paths)
+        return [probe(path) for path in paths]
+
+    def exists(path, exists=os.path.exists):
+        checked.append(path)
+        return exists(path)
+
+    monkeypatch.setattr(converter_module, '_probe_concurrently', probe_concurrently)
+    monkeypatch.setattr(os.path, 'exists', exists)
+    metadata = converter_module.read_tomogram_metadata(tomos_dir, prefix)
+    assert metadata['acquisition_order'] is not None
+    # The concurrent probe of all inputs (with the original os.path.exists) is the only existence check
+    assert len(probed) == len(converter_module.tomogram_input_files(tomos_dir, prefix))
+    assert checked == []
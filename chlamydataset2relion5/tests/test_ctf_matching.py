@@ -0,0 +1,54 @@
+import os
+import shutil
+import numpy as np
+import pytest
+
+from chlamydataset2relion5 import TomogramConverter, match_ctf_to_tilts, tomogram_input_files
+
+def ctf_entry(frame, tilt_angle, defocus):
+    return {'frame': frame, 'tilt_angle': tilt_angle, 'defocus_u': defocus, 'defocus_v': defocus + 100, 'astigmatism_angle': 45.0}
+
+def test_tolerance_is_exclusive():
+    # Binary fractions, so that the distances are exact
+    ctf_data = [ctf_entry(1, -0.5, 30000.0), ctf_entry(2, 0.625, 31000.0)]
+    defocus_u, _, _, ctf_match = match_ctf_to_tilts(ctf_data, [-0.4375, 0.5], tolerance=0.25)
+    np.testing.assert_array_equal(ctf_match, [0, 1])
+    np.testing.assert_array_equal(defocus_u, [30000.0, 31000.0])
+
+    with pytest.raises(ValueError, match='No CTF entry found for tilt angles 0.50'):
+        match_ctf_to_tilts(ctf_data, [-0.4375, 0.5], tolerance=0.125)
+
+    messages = []
+    defocus_u, defocus_v, _, ctf_match = match_ctf_to_tilts(ctf_data, [-0.4375, 0.5], tolerance=0.125,
+                                                            allow_missing=True, log=messages.append)
+    np.testing.assert_array_equal(ctf_match, [0, -1])
+    np.testing.assert_array_equal(defocus_u, [30000.0, 0.0])
+    np.testing.assert_array_equal(defocus_v, [30100.0, 0.0])
+    assert len(messages) == 1 and '0.50' in messages[0]
+
+def test_entries_without_tilt_angle_match_by_frame():
+    ctf_data = [ctf_entry(2, None, 32000.0), ctf_entry(1, None, 31000.0), ctf_entry(3, 20.0, 33000.0)]
+    defocus_u, _, _, ctf_match = match_ctf_to_tilts(ctf_data, [-10.0, 0.0, 20.0])
+    np.testing.assert_array_equal(ctf_match, [1, 0, 2])
+    np.testing.assert_array_equal(defocus_u, [31000.0, 32000.0, 33000.0])
+
+    # No entry for frame 3, nor one at 30 deg
+    with pytest.raises(ValueError, match='30.00'):
+        match_ctf_to_tilts(ctf_data, [-10.0, 0.0, 30.0])
+
+def test_tomograms_with_unmatched_tilts_fail_unless_allowed(synthetic_tree, tmp_path):
+    tomos_dir, correspondence_star = synthetic_tree
+    prefix = sorted(os.listdir(tomos_dir))[0]
+    # A copy of the tree (metadata only) with the CTF entry of the last tilt missing
+    copy_dir = tmp_path / 'tomos'
+    shutil.copytree(os.path.join(tomos_dir, prefix), copy_dir / prefix,
+                    ignore=lambda folder, names: [name for name in names if name.endswith('.st')])
+    ctf_path = copy_dir / prefix / tomogram_input_files(str(copy_dir), prefix)[2]
+    lines = ctf_path.read_text().splitlines(keepends=True)
+    ctf_path.write_text(''.join(lines[:-1]))
+
+    with pytest.raises(ValueError, match='No CTF entry found'):
+        TomogramConverter(str(copy_dir), correspondence_star).collect(prefix)
+    data = TomogramConverter(str(copy_dir), correspondence_star, allow_missing_ctf=True).collect(prefix)
+    assert data['tilt_series_data']['ctf_match'][-1] == -1
+    assert data['tilt_series_data']['defocus_u'][-1] == 0.0
@@ -0,0 +1,34 @@
+import os
+
+import chlamydataset2relion5 as converter
+
+# Files each stage opens for one tomogram of the synthetic tree: the metadata files read,
+# the six inputs hashed for the manifest and the two files written
+EXPECTED_FILES_OPENED = {
+    'check_manifest': 0,
+    'fingerprint_inputs': 6,
+    'softlinks': 0,
+    'probe_inputs': 0,
+    'read_tlt': 1,
+    'read_xf': 1,
+    'read_ctf': 1,
+    'read_acquisition': 3,
+    'match_ctf': 0,
+    'compute_alignments': 0,
+    'write_tilt_series': 1,
+    'write_edf': 1,
+}
+
+def test_stage_files_opened_are_exact(synthetic_tree, tmp_path, monkeypatch):
+    tomos_dir, correspondence_star = synthetic_tree
+    tomolist = converter.tomolist_mapping(converter.read_star_loop(correspondence_star))
+    prefixes = sorted(os.listdir(tomos_dir))[:3]
+    monkeypatch.setattr(converter, '_stage_records', None)
+    converter.enable_instrumentation()
+    for prefix in prefixes:
+        data, _ = converter.convert_tomogram_incremental(tomos_dir, str(tmp_path), prefix, tomolist, 'ctf3d', 'cryocare')
+        assert data is not None
+    records = converter.take_stage_records()
+    for prefix in prefixes:
+        opened = {record['stage']: record['files_opened'] for record in records if record['tomogram'] == prefix}
+        assert opened == EXPECTED_FILES_OPENED
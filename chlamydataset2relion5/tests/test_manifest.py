@@ -0,0 +1,99 @@
+import os
+import pytest
+
+import chlamydataset2relion5 as converter
+from benchmark import generate_tree, TREE_DIRNAME, CORRESPONDENCE_FILENAME
+
+@pytest.fixture
+def tree(tmp_path):
+    """A synthetic tree of its own, as the tests modify its inputs."""
+    generate_tree(str(tmp_path), n_tomograms=4, n_tilts=7)
+    return str(tmp_path / TREE_DIRNAME), str(tmp_path / CORRESPONDENCE_FILENAME)
+
+def convert(tree, output_dir, *options):
+    tomos_dir, correspondence_star = tree
+    converter.run(converter.parse_args(['--tomos_dir', tomos_dir, '--correspondence_star', correspondence_star,
+                                        '--output_dir', str(output_dir), *options]))
+
+def skipped(capsys):
+    out = capsys.readouterr().out
+    return sorted(line.split()[-1] for line in out.splitlines() if line.startswith("Skipping unchanged tomogram"))
+
+def input_path(tree, prefix, index=0):
+    tomos_dir, _ = tree
+    return os.path.join(tomos_dir, prefix, converter.tomogram_input_files(tomos_dir, prefix)[index])
+
+def test_touched_inputs_are_skipped_and_edited_ones_reconverted(tree, tmp_path, capsys):
+    prefixes = sorted(os.listdir(tree[0]))
+    convert(tree, tmp_path / 'output')
+    assert skipped(capsys) == []
+
+    touched = input_path(tree, prefixes[0])
+    os.utime(touched, (os.path.getatime(touched) + 100, os.path.getmtime(touched) + 100))
+    with open(input_path(tree, prefixes[1], 1), 'r') as f:
+        xf = f.read()
+    with open(input_path(tree, prefixes[1], 1), 'w') as f:
+        f.write(xf.replace('.', '1.', 1))
+    convert(tree, tmp_path / 'output')
+    assert skipped(capsys) == [prefixes[0]] + prefixes[2:]
+
+    # The refreshed fingerprint of the touched file was recorded
+    convert(tree, tmp_path / 'output')
+    assert skipped(capsys) == prefixes
+
+def test_changed_options_reconvert(tree, tmp_path, capsys):
+    convert(tree, tmp_path / 'output')
+    convert(tree, tmp_path / 'output', '--cosine_weight')
+    assert skipped(capsys) == []
+    convert(tree, tmp_path / 'output', '--cosine_weight')
+    assert skipped(capsys) == sorted(os.listdir(tree[0]))
+
+def test_force_and_selections_keep_other_manifest_entries(tree, tmp_path, capsys):
+    prefixes = sorted(os.listdir(tree[0]))
+    convert(tree, tmp_path / 'output')
+    convert(tree, tmp_path / 'output', '--include', prefixes[0], '--force')
+    assert skipped(capsys) == []
+    assert sorted(converter.read_manifest(str(tmp_path / 'output'))) == prefixes
+    convert(tree, tmp_path / 'output')
+    assert skipped(capsys) == prefixes
+
+def interrupt_at(monkeypatch, prefix):
+    """Make the conversion of prefix raise KeyboardInterrupt, like a run killed at that tomogram."""
+    convert_tomogram = converter.convert_tomogram
+
+    def interrupted(tomos_dir, output_dir, tomo_prefix, *args, **kwargs):
+        if tomo_prefix == prefix:
+            raise KeyboardInterrupt
+        return convert_tomogram(tomos_dir, output_dir, tomo_prefix, *args, **kwargs)
+    monkeypatch.setattr(converter, 'convert_tomogram', interrupted)
+
+def test_interrupted_run_resumes(tree, tmp_path, capsys, monkeypatch):
+    prefixes = sorted(os.listdir(tree[0]))
+    with monkeypatch.context() as m:
+        interrupt_at(m, prefixes[2])
+        with pytest.raises(KeyboardInterrupt):
+            convert(tree, tmp_path / 'output')
+    capsys.readouterr()
+    convert(tree, tmp_path / 'output')
+    assert skipped(capsys) == prefixes[:2]
+
+def test_interrupted_multiblock_run_is_recovered(tree, tmp_path, capsys, monkeypatch):
+    prefixes = sorted(os.listdir(tree[0]))
+    output_dir = tmp_path / 'output'
+    star_path = output_dir / converter.MULTIBLOCK_STAR_FILENAME
+    with monkeypatch.context() as m:
+        interrupt_at(m, prefixes[2])
+        with pytest.raises(KeyboardInterrupt):
+            convert(tree, output_dir, '--multiblock_star')
+    assert os.path.exists(str(star_path) + '.tmp') and not os.path.exists(star_path)
+    capsys.readouterr()
+
+    convert(tree, output_dir, '--multiblock_star')
+    assert skipped(capsys) == prefixes[:2]
+    assert not os.path.exists(str(star_path) + '.tmp')
+    assert sorted(converter.read_multiblock_index(str(output_dir))) == prefixes
+    recovered = star_path.read_text()
+
+    # Same file as converting everything again
+    convert(tree, output_dir, '--multiblock_star', '--force')
+    assert star_path.read_text() == recovered
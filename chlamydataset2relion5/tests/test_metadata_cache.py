@@ -0,0 +1,63 @@
+import os
+import shutil
+import numpy as np
+import pytest
+
+from chlamydataset2relion5 import (MetadataCache, TomogramConverter, build_metadata_cache, read_tomogram_metadata,
+                                   tomogram_input_files)
+
+@pytest.fixture
+def tomos_dir(synthetic_tree, tmp_path):
+    """The metadata of the synthetic tree, one tomogram without acquisition order and one without .tlt file."""
+    tree_dir, _ = synthetic_tree
+    shutil.copytree(tree_dir, tmp_path / 'tomos', ignore=lambda folder, names: [name for name in names if name.endswith('.st')])
+    tomos_dir = str(tmp_path / 'tomos')
+    prefixes = sorted(os.listdir(tomos_dir))
+    os.remove(os.path.join(tomos_dir, prefixes[1], tomogram_input_files(tomos_dir, prefixes[1])[3]))
+    os.remove(os.path.join(tomos_dir, prefixes[2], tomogram_input_files(tomos_dir, prefixes[2])[0]))
+    return tomos_dir
+
+def test_cache_round_trip(tomos_dir, tmp_path):
+    prefixes = sorted(os.listdir(tomos_dir))
+    cache = MetadataCache(build_metadata_cache(tomos_dir, prefixes, str(tmp_path / 'metadata.bin'), threads=4))
+    assert cache.prefixes == prefixes and cache.tomos_dir == os.path.abspath(tomos_dir)
+    for prefix in prefixes:
+        assert prefix in cache
+        if prefix == prefixes[2]:
+            with pytest.raises(ValueError, match='Required files not found'):
+                cache.metadata(prefix)
+            continue
+        expected = read_tomogram_metadata(tomos_dir, prefix)
+        metadata = cache.metadata(prefix)
+        assert metadata['tilt_angles'] == pytest.approx(expected['tilt_angles'])
+        np.testing.assert_allclose(metadata['xf_data'], np.asarray(expected['xf_data'], dtype=float))
+        assert len(metadata['ctf_data']) == len(expected['ctf_data'])
+        for entry, expected_entry in zip(metadata['ctf_data'], expected['ctf_data']):
+            assert entry == pytest.approx(expected_entry)
+        if prefix == prefixes[1]:
+            assert metadata['acquisition_order'] is None and expected['acquisition_order'] is None
+        else:
+            np.testing.assert_allclose(metadata['acquisition_order'], expected['acquisition_order'])
+    assert 'not_cached' not in cache
+    with pytest.raises(ValueError, match='is not in the metadata cache'):
+        cache.metadata('not_cached')
+
+def test_cache_gives_the_same_tables(tomos_dir, synthetic_tree, tmp_path):
+    _, correspondence_star = synthetic_tree
+    prefixes = sorted(os.listdir(tomos_dir))
+    cache_path = build_metadata_cache(tomos_dir, prefixes, str(tmp_path / 'metadata.bin'))
+    from_files = TomogramConverter(tomos_dir, correspondence_star)
+    from_cache = TomogramConverter(correspondence_star=correspondence_star, metadata_cache=cache_path)
+    for prefix in prefixes[:2] + prefixes[3:]:
+        record, table = from_files.convert(prefix)
+        cached_record, cached_table = from_cache.convert(prefix)
+        assert cached_record == record
+        assert set(cached_table) == set(table)
+        for label, values in table.items():
+            assert list(cached_table[label]) == list(values)
+
+def test_rebuilt_cache_keeps_digests(tomos_dir, tmp_path):
+    prefixes = sorted(os.listdir(tomos_dir))
+    first = MetadataCache(build_metadata_cache(tomos_dir, prefixes, str(tmp_path / 'first.bin')))
+    second = MetadataCache(build_metadata_cache(tomos_dir, prefixes[::-1], str(tmp_path / 'second.bin')))
+    assert all(first.digest(prefix) == second.digest(prefix) for prefix in prefixes)
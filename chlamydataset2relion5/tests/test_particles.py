@@ -0,0 +1,36 @@
+from chlamydataset2relion5 import particles_main, read_star_loop
+
+def write_annotation_star(path, tomo_names):
+    with open(path, 'w') as f:
+        f.write("data_\n\nloop_\n")
+        for i, column in enumerate(['rlnCoordinateX', 'rlnCoordinateY', 'rlnCoordinateZ', 'rlnAngleRot', 'rlnAngleTilt',
+                                    'rlnAnglePsi', 'rlnTomoName']):
+            f.write(f"_{column} #{i + 1}\n")
+        for tomo_name in tomo_names:
+            f.write(f"100.0\t200.0\t300.0\t10.0\t20.0\t30.0\t{tomo_name}\n")
+
+def test_particle_names_restart_in_each_species(tmp_path):
+    correspondence_star = tmp_path / 'tomolist.star'
+    correspondence_star.write_text("data_\n\nloop_\n_tomoman_tomo_num\n_tomoman_stack_dir\n1 TS_01\n2 TS_02\n")
+    write_annotation_star(tmp_path / 'first.star', ['tomo_0001', 'tomo_0002', 'tomo_0001'])
+    write_annotation_star(tmp_path / 'second.star', ['tomo_0002', 'tomo_0001', 'tomo_0002'])
+    particles_main(['--correspondence_star', str(correspondence_star), '--output_dir', str(tmp_path / 'out'),
+                    '--star_files', str(tmp_path / 'first.star'), str(tmp_path / 'second.star')])
+    first = read_star_loop(str(tmp_path / 'out' / 'particles_first.star'), 'particles')
+    second = read_star_loop(str(tmp_path / 'out' / 'particles_second.star'), 'particles')
+    assert list(first['rlnTomoParticleName']) == ['TS_01/1', 'TS_02/1', 'TS_01/2']
+    assert list(second['rlnTomoParticleName']) == ['TS_02/1', 'TS_01/1', 'TS_02/2']
+
+def test_particle_stats_prefixes_follow_the_correspondence_table(tmp_path):
+    from particle_stats import load_particle_stats
+    correspondence_star = tmp_path / 'tomolist.star'
+    correspondence_star.write_text("data_\n\nloop_\n_tomoman_tomo_num\n_tomoman_stack_dir\n1 TS_01\n2 TS_02\n")
+    write_annotation_star(tmp_path / 'first.star', ['tomo_0001', 'tomo_0002', 'tomo_0001'])
+    star_files = {'first': str(tmp_path / 'first.star')}
+    cache_path = str(tmp_path / 'stats.npz')
+    stats = load_particle_stats(star_files, str(correspondence_star), cache_path)
+    assert stats.select(['first>=2']) == ['TS_01']
+    # The cached statistics are reused with another table, whose prefixes they don't keep
+    stats = load_particle_stats(star_files, cache_path=cache_path, tomolist={'Position_7': 1, 'Position_9': 2})
+    assert stats.select(['first>=1']) == ['Position_7', 'Position_9']
+    assert stats.select(['first>=1'], key='tomo_name') == ['tomo_0001', 'tomo_0002']
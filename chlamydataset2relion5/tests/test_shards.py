@@ -0,0 +1,43 @@
+import os
+import pytest
+
+import chlamydataset2relion5 as converter
+
+def convert(synthetic_tree, output_dir, *options):
+    tomos_dir, correspondence_star = synthetic_tree
+    converter.run(converter.parse_args(['--tomos_dir', tomos_dir, '--correspondence_star', correspondence_star,
+                                        '--output_dir', str(output_dir), *options]))
+
+def test_merged_shards_match_an_unsharded_run(synthetic_tree, tmp_path):
+    convert(synthetic_tree, tmp_path / 'single')
+    for shard in ['1/2', '2/2']:
+        convert(synthetic_tree, tmp_path / 'sharded', '--shard', shard)
+    partial = [converter.read_tomogram_star_rows(str(tmp_path / 'sharded' / f'tomograms.shard{i}of2.star')) for i in (1, 2)]
+    assert all(partial) and not set(partial[0]) & set(partial[1])
+
+    assert converter.merge_shards(str(tmp_path / 'sharded')) == len(os.listdir(synthetic_tree[0]))
+    single = (tmp_path / 'single' / 'tomograms.star').read_text()
+    merged = (tmp_path / 'sharded' / 'tomograms.star').read_text()
+    assert merged == single.replace(str(tmp_path / 'single'), str(tmp_path / 'sharded'))
+    assert sorted(converter.read_manifest(str(tmp_path / 'sharded'))) == sorted(converter.read_manifest(str(tmp_path / 'single')))
+
+def test_overlapping_partial_files_are_rejected(synthetic_tree, tmp_path):
+    output_dir = tmp_path / 'sharded'
+    for shard in ['1/2', '2/2']:
+        convert(synthetic_tree, output_dir, '--shard', shard)
+    first, second = output_dir / 'tomograms.shard1of2.star', output_dir / 'tomograms.shard2of2.star'
+    # A tomogram of the first shard also in the second one
+    second.write_text(second.read_text() + converter.read_tomogram_star_rows(str(first))[0])
+    with pytest.raises(ValueError, match='Duplicate tomograms'):
+        converter.merge_shards(str(output_dir))
+    assert not (output_dir / 'tomograms.star').exists()
+
+    # Partial files of a run with another shard count
+    convert(synthetic_tree, output_dir, '--shard', '2/2')
+    convert(synthetic_tree, output_dir, '--shard', '1/3')
+    with pytest.raises(ValueError, match='different shard counts'):
+        converter.merge_shards(str(output_dir))
+    os.remove(output_dir / 'tomograms.shard1of3.star')
+    os.remove(second)
+    with pytest.raises(ValueError, match='shards 2/2 are missing'):
+        converter.merge_shards(str(output_dir))
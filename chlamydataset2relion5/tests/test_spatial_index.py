@@ -0,0 +1,16 @@
+import numpy as np
+
+from spatial_index import SpatialIndex
+
+def test_nearest_excludes_self_for_duplicate_picks(tmp_path):
+    star_path = tmp_path / 'ribosome.star'
+    with open(star_path, 'w') as f:
+        f.write("data_\n\nloop_\n_rlnCoordinateX #1\n_rlnCoordinateY #2\n_rlnCoordinateZ #3\n_rlnTomoName #4\n")
+        for x in [100.0, 100.0, 100.0, 400.0]:
+            f.write(f"{x}\t200.0\t300.0\ttomo_0001\n")
+    with SpatialIndex({'ribosome': str(star_path)}, pixel_size=1.0) as index:
+        nn = index.nearest('ribosome', 'ribosome', k=2)
+    assert (nn['query_row'] != nn['target_row']).all()
+    first = nn[nn['k'] == 1]
+    np.testing.assert_array_equal(first['distance'], [0.0, 0.0, 0.0, 300.0])
+    assert set(nn.loc[nn['query_row'] == 0, 'target_row']) == {1, 2}
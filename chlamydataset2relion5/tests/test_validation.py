@@ -0,0 +1,52 @@
+import os
+import shutil
+import pytest
+
+from chlamydataset2relion5 import PIXEL_SIZE, MRC_HEADER_SIZE, read_mrc_header, read_tlt_file, validate_tomogram_stacks
+from benchmark import write_mrc_stack
+
+@pytest.fixture
+def tomogram(synthetic_tree, tmp_path):
+    """A copy of the metadata of one tomogram of the synthetic tree, with small stacks that hold their data."""
+    tomos_dir, _ = synthetic_tree
+    prefix = sorted(os.listdir(tomos_dir))[0]
+    shutil.copytree(os.path.join(tomos_dir, prefix), tmp_path / prefix,
+                    ignore=lambda folder, names: [name for name in names if name.endswith('.st')])
+    n_tilts = len(read_tlt_file(str(tmp_path), prefix))
+    stack_path = str(tmp_path / prefix / f"{prefix}.st")
+    write_mrc_stack(stack_path, 16, 16, n_tilts, PIXEL_SIZE)
+    return str(tmp_path), prefix, stack_path
+
+def test_read_mrc_header(tomogram):
+    _, _, stack_path = tomogram
+    header = read_mrc_header(stack_path)
+    assert (header['nx'], header['ny'], header['mode'], header['nsymbt']) == (16, 16, 2, 0)
+    assert header['pixel_size'] == pytest.approx(PIXEL_SIZE)
+    assert header['file_size'] == header['data_size'] == MRC_HEADER_SIZE + 16 * 16 * header['nz'] * 4
+
+def test_valid_stacks_have_no_problems(tomogram):
+    tomos_dir, prefix, _ = tomogram
+    assert validate_tomogram_stacks(tomos_dir, prefix) == []
+
+def test_truncated_stack(tomogram):
+    tomos_dir, prefix, stack_path = tomogram
+    with open(stack_path, 'r+b') as f:
+        f.truncate(os.path.getsize(stack_path) - 1)
+    problems = validate_tomogram_stacks(tomos_dir, prefix)
+    assert len(problems) == 1 and 'truncated' in problems[0]
+
+def test_wrong_pixel_size(tomogram):
+    tomos_dir, prefix, stack_path = tomogram
+    n_tilts = read_mrc_header(stack_path)['nz']
+    write_mrc_stack(stack_path, 16, 16, n_tilts, 2 * PIXEL_SIZE)
+    problems = validate_tomogram_stacks(tomos_dir, prefix)
+    assert len(problems) == 1 and 'pixel size' in problems[0]
+    assert validate_tomogram_stacks(tomos_dir, prefix, pixel_size=2 * PIXEL_SIZE) == []
+
+def test_section_count_and_missing_stack(tomogram):
+    tomos_dir, prefix, stack_path = tomogram
+    n_tilts = read_mrc_header(stack_path)['nz']
+    write_mrc_stack(stack_path, 16, 16, n_tilts + 1, PIXEL_SIZE)
+    assert validate_tomogram_stacks(tomos_dir, prefix) == [f"{prefix}.st: {n_tilts + 1} sections but {n_tilts} tilt angles in the .tlt file"]
+    os.remove(stack_path)
+    assert validate_tomogram_stacks(tomos_dir, prefix) == [f"{prefix}.st: not found"]